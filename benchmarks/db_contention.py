@@ -0,0 +1,123 @@
+"""
+Measures API read latency on tasks database while several download
+workers are writing progress into it.
+
+Every writer runs in its own process (as huey process workers do) and
+reports progress of a single task, readers emulate 'GET /tasks' calls.
+
+Usage:
+    python -m benchmarks.db_contention [--writers 20] [--duration 10]
+        [--journal-mode WAL] [--per-chunk]
+
+Use '--journal-mode DELETE' to compare against default sqlite journal,
+'--per-chunk' makes writers save on every chunk (no progress coalescing)
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+
+
+def _writer(dtask_id: int, deadline: float, per_chunk: bool, results):
+    # pylint: disable=import-outside-toplevel
+    import ddownloader.dtask_repository as dtask_repo
+    from ddownloader.downloader import DownloadStatus, DownloadTask
+    from ddownloader.progress import ProgressReporter
+
+    dtask = DownloadTask('http://bench.local/file', f'file{dtask_id}')
+    dtask.id = dtask_id
+    dtask.status = DownloadStatus.IN_PROGRESS
+
+    reporter = ProgressReporter(flush_interval=0 if per_chunk else None)
+    writes = 0
+    errors = 0
+    while time.time() < deadline:
+        dtask.downloaded_size += 1024 * 1024 * 5
+        try:
+            dtask_repo.find_by_id(dtask_id)
+            reporter.update(dtask)
+            writes += 1
+        except dtask_repo.DBError:
+            errors += 1
+
+        time.sleep(0.01)  # ~500MB/s per writer with 5MB chunks
+
+    results.put({'writes': writes, 'errors': errors})
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    values = sorted(values)
+    idx = min(int(len(values) * pct / 100), len(values) - 1)
+    return values[idx]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--writers', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--journal-mode', default='WAL')
+    parser.add_argument('--per-chunk', action='store_true')
+    args = parser.parse_args()
+
+    db_dir = tempfile.mkdtemp(prefix='ddownloader-bench-')
+    os.environ['DB_PATH'] = os.path.join(db_dir, 'bench.db')
+    os.environ['DB_JOURNAL_MODE'] = args.journal_mode
+
+    # pylint: disable=import-outside-toplevel
+    import ddownloader.dtask_repository as dtask_repo
+    from ddownloader.downloader import DownloadTask
+
+    ids = []
+    for idx in range(args.writers):
+        dtask = DownloadTask('http://bench.local/file', f'file{idx}')
+        dtask_repo.save(dtask)
+        ids.append(dtask.id)
+
+    results = multiprocessing.Queue()
+    deadline = time.time() + args.duration
+    writers = [
+        multiprocessing.Process(
+            target=_writer,
+            args=(dtask_id, deadline, args.per_chunk, results)
+        )
+        for dtask_id in ids
+    ]
+    for proc in writers:
+        proc.start()
+
+    latencies = []
+    read_errors = 0
+    while time.time() < deadline:
+        start = time.perf_counter()
+        try:
+            dtask_repo.paginate(30, 1)
+            dtask_repo.count()
+            latencies.append((time.perf_counter() - start) * 1000)
+        except dtask_repo.DBError:
+            read_errors += 1
+
+        time.sleep(0.005)
+
+    writes = [results.get() for _ in writers]
+    for proc in writers:
+        proc.join()
+
+    print(json.dumps({
+        'journal_mode': args.journal_mode,
+        'writers': args.writers,
+        'per_chunk': args.per_chunk,
+        'reads': len(latencies),
+        'read_errors': read_errors,
+        'read_p50_ms': round(statistics.median(latencies), 3),
+        'read_p99_ms': round(_percentile(latencies, 99), 3),
+        'read_max_ms': round(max(latencies), 3),
+        'writes': sum(w['writes'] for w in writes),
+        'write_errors': sum(w['errors'] for w in writes)
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
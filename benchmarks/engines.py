@@ -0,0 +1,116 @@
+"""
+Compares thread-per-download engine ('downloader.download') against
+the asyncio engine ('aio_downloader') downloading many files at once
+from a local stand-in server.
+
+Usage:
+    python -m benchmarks.engines [--downloads 200] [--size 4194304]
+        [--latency 0.05]
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.http_stand_in import StandInServer
+
+
+def _tasks(server, args, target_dir):
+    # pylint: disable=import-outside-toplevel
+    from ddownloader.downloader import DownloadTask
+
+    return [
+        DownloadTask(
+            server.file_url(args.size),
+            os.path.join(target_dir, f'file{idx}')
+        )
+        for idx in range(args.downloads)
+    ]
+
+
+def _run_threads(dtasks):
+    # pylint: disable=import-outside-toplevel
+    from ddownloader import downloader
+
+    with ThreadPoolExecutor(max_workers=len(dtasks)) as executor:
+        futures = [
+            executor.submit(downloader.download, d, lambda: None, lambda: None)
+            for d in dtasks
+        ]
+        peak_threads = threading.active_count()
+        for future in futures:
+            future.result()
+
+    return peak_threads
+
+
+def _run_asyncio(dtasks):
+    # pylint: disable=import-outside-toplevel
+    from ddownloader.aio_downloader import engine
+
+    futures = [engine.submit(d, lambda: None, lambda: None) for d in dtasks]
+    peak_threads = threading.active_count()
+    for future in futures:
+        future.result()
+
+    engine.close()
+    return peak_threads
+
+
+def _measure(name, runner, server, args):
+    target_dir = tempfile.mkdtemp(prefix='ddownloader-bench-')
+    dtasks = _tasks(server, args, target_dir)
+
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    peak_threads = runner(dtasks)
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+
+    total_mb = sum(d.downloaded_size for d in dtasks) / 1024 / 1024
+    completed = sum(1 for d in dtasks if d.status.value == 'Completed')
+    shutil.rmtree(target_dir)
+
+    return {
+        'engine': name,
+        'downloads': len(dtasks),
+        'completed': completed,
+        'seconds': round(elapsed, 3),
+        'mb_per_s': round(total_mb / elapsed, 2),
+        'cpu_seconds': round(cpu, 3),
+        'peak_threads': peak_threads,
+        'max_rss_mb': round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+        )
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--downloads', type=int, default=200)
+    parser.add_argument('--size', type=int, default=4 * 1024 * 1024)
+    parser.add_argument('--latency', type=float, default=0.05)
+    args = parser.parse_args()
+
+    os.environ.setdefault('DB_PATH', os.path.join(tempfile.mkdtemp(), 'b.db'))
+    os.environ['DOWNLOAD_SEGMENTS'] = '1'
+
+    server = StandInServer(latency=args.latency).start()
+    try:
+        results = [
+            _measure('threads', _run_threads, server, args),
+            _measure('asyncio', _run_asyncio, server, args)
+        ]
+    finally:
+        server.stop()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+"""
+Local HTTP server standing in for download origins in benchmarks.
+
+Serves synthetic files at '/files/<size in bytes>' supporting 'Range'
+requests. Body bytes are deterministic, see 'expected_bytes'. Given
+contents (e.g. archives) are served as well, see 'add_content'.
+
+Every response can be delayed ('latency') and every connection can be
+throttled ('bandwidth', bytes per second). Files requested with
+'?chunked=1' are sent with 'Transfer-Encoding: chunked' and without
+'Content-Length'.
+
+Files carry 'ETag' and 'Last-Modified' validators, which change when
+server 'version' is increased, and conditional requests ('If-Range',
+'If-None-Match', 'If-Modified-Since') are honored.
+"""
+import multiprocessing
+import re
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+BLOCK_SIZE = 1024 * 1024
+_BLOCK = bytes(range(256)) * (BLOCK_SIZE // 256)
+
+_PATH_RE = re.compile(r'^/files/(\d+)')
+_CONTENT_RE = re.compile(r'^/contents/([^?]+)')
+_RANGE_RE = re.compile(r'^bytes=(\d+)-(\d*)$')
+
+
+def expected_bytes(start: int, end: int) -> bytes:
+    """Content served for inclusive byte range [start, end]"""
+    return bytes(i % 256 for i in range(start, end + 1))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: 'StandInServer'
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def _serve(self, send_body: bool):
+        match = _PATH_RE.match(self.path)
+        content_match = _CONTENT_RE.match(self.path)
+        content = self.server.contents.get(content_match.group(1)) \
+            if content_match else None
+        if not match and content is None:
+            self.send_error(404)
+            return
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        size = int(match.group(1)) if match else len(content)
+        start, end = 0, size - 1
+        status = 200
+        chunked = parse_qs(urlsplit(self.path).query).get('chunked') == ['1']
+
+        etag = f'"{size}-{self.server.version}"'
+        last_modified = formatdate(self.server.version * 3600, usegmt=True)
+
+        if etag == self.headers.get('If-None-Match') \
+                or last_modified == self.headers.get('If-Modified-Since'):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        # Ranges of changed content are ignored, whole content is sent
+        if_range = self.headers.get('If-Range')
+        range_header = self.headers.get('Range')
+        if if_range and if_range not in (etag, last_modified):
+            range_header = None
+
+        range_match = _RANGE_RE.match(range_header or '')
+        if range_match:
+            start = int(range_match.group(1))
+            if range_match.group(2):
+                end = min(int(range_match.group(2)), size - 1)
+            if start >= size:
+                self.send_error(416)
+                return
+            status = 206
+
+        self.send_response(status)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', last_modified)
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.send_header('Content-Length', str(end - start + 1))
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.end_headers()
+
+        if send_body:
+            self._write_body(start, end, chunked, content)
+
+    def _write_body(
+        self,
+        start: int,
+        end: int,
+        chunked: bool,
+        content: bytes = None
+    ):
+        # Throttled connections write smaller pieces, so rate is steady
+        piece_size = BLOCK_SIZE if not self.server.bandwidth \
+            else max(min(BLOCK_SIZE, self.server.bandwidth // 20), 1)
+
+        started = time.monotonic()
+        offset = start
+        try:
+            while offset <= end:
+                block_offset = offset % BLOCK_SIZE
+                length = min(
+                    piece_size,
+                    BLOCK_SIZE - block_offset,
+                    end - offset + 1
+                )
+                if content is None:
+                    piece = _BLOCK[block_offset:block_offset + length]
+                else:
+                    piece = content[offset:offset + length]
+
+                if chunked:
+                    self.wfile.write(b'%x\r\n%b\r\n' % (length, piece))
+                else:
+                    self.wfile.write(piece)
+                offset += length
+
+                if self.server.bandwidth:
+                    sent = offset - start
+                    ahead = sent / self.server.bandwidth \
+                        - (time.monotonic() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+
+            if chunked:
+                self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        latency: float = 0,
+        port: int = 0,
+        bandwidth: int = 0
+    ) -> None:
+        super().__init__(('127.0.0.1', port), _Handler)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.version = 1
+        self.contents: dict[str, bytes] = {}
+        self._thread: threading.Thread = None
+
+    @property
+    def base_url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def file_url(self, size: int, chunked: bool = False) -> str:
+        url = f'{self.base_url}/files/{size}'
+        return f'{url}?chunked=1' if chunked else url
+
+    def add_content(self, name: str, content: bytes) -> str:
+        """Serves given content, returns its url"""
+        self.contents[name] = content
+        return f'{self.base_url}/contents/{name}'
+
+    def start(self) -> 'StandInServer':
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+class StandInProcess:
+    """Runs a 'StandInServer' in a child process, so CPU spent serving
+    files is not accounted to the process being measured
+    """
+
+    def __init__(self, latency: float = 0, bandwidth: int = 0) -> None:
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.base_url: str = None
+        self._process: multiprocessing.Process = None
+
+    def file_url(self, size: int, chunked: bool = False) -> str:
+        url = f'{self.base_url}/files/{size}'
+        return f'{url}?chunked=1' if chunked else url
+
+    def start(self) -> 'StandInProcess':
+        parent_con, child_con = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(
+            target=_serve_process,
+            args=(self.latency, self.bandwidth, child_con),
+            daemon=True
+        )
+        self._process.start()
+        self.base_url = parent_con.recv()
+        return self
+
+    def stop(self) -> None:
+        self._process.terminate()
+        self._process.join()
+
+
+def _serve_process(latency: float, bandwidth: int, con) -> None:
+    server = StandInServer(latency=latency, bandwidth=bandwidth)
+    con.send(server.base_url)
+    server.serve_forever()
@@ -0,0 +1,364 @@
+"""
+Local server standing in for Redis in tests and benchmarks.
+
+Speaks the Redis protocol (RESP) and keeps data in memory, implementing
+the subset of commands used by huey's Redis storage: lists (blocking
+pops included), sorted sets, hashes, 'MULTI'/'EXEC' transactions and
+scripts. Lua is not interpreted: only scripts with a known python
+equivalent (see '_SCRIPTS') can be loaded and run.
+"""
+import hashlib
+import socketserver
+import threading
+import time
+from typing import Callable
+
+from huey.storage import SCHEDULE_POP_LUA
+
+
+class CommandError(Exception):
+    def __init__(self, message: str, prefix: str = 'ERR') -> None:
+        super().__init__(message)
+        self.reply = f'{prefix} {message}'
+
+
+class _Status(str):
+    """Reply sent as a simple string, e.g. '+OK'"""
+
+
+OK = _Status('OK')
+QUEUED = _Status('QUEUED')
+
+
+class _Store:
+    """Keyspace of the stand-in, every command runs under one lock"""
+
+    def __init__(self) -> None:
+        self.cond = threading.Condition()
+        self.data: dict[bytes, object] = {}
+        self.scripts: dict[str, Callable] = {}
+
+    def _get(self, key: bytes, kind: type, create: bool = False):
+        value = self.data.get(key)
+        if value is None:
+            if not create:
+                return None
+            value = self.data[key] = kind()
+        elif not isinstance(value, kind):
+            raise CommandError(
+                'Operation against a key holding the wrong kind of value',
+                'WRONGTYPE'
+            )
+        return value
+
+    def _drop_if_empty(self, key: bytes) -> None:
+        if not self.data.get(key) and key in self.data:
+            del self.data[key]
+
+    # Generic
+    def ping(self, *args):
+        return args[0] if args else _Status('PONG')
+
+    def select(self, db):
+        return OK
+
+    def client(self, *args):
+        return OK
+
+    def flushdb(self, *args):
+        self.data.clear()
+        return OK
+
+    flushall = flushdb
+
+    def delete(self, *keys):
+        return sum(1 for key in keys if self.data.pop(key, None) is not None)
+
+    def exists(self, *keys):
+        return sum(1 for key in keys if key in self.data)
+
+    # Strings
+    def get(self, key):
+        return self._get(key, bytes)
+
+    def set(self, key, value, *args):
+        self.data[key] = value
+        return OK
+
+    # Lists
+    def lpush(self, key, *values):
+        items = self._get(key, list, create=True)
+        for value in values:
+            items.insert(0, value)
+        self.cond.notify_all()
+        return len(items)
+
+    def rpop(self, key):
+        items = self._get(key, list)
+        if not items:
+            return None
+        value = items.pop()
+        self._drop_if_empty(key)
+        return value
+
+    def llen(self, key):
+        return len(self._get(key, list) or [])
+
+    def lrange(self, key, start, stop):
+        items = self._get(key, list) or []
+        start, stop = int(start), int(stop)
+        stop = len(items) if stop == -1 else stop + 1
+        return items[start:stop]
+
+    # Sorted sets
+    def _sorted(self, key) -> list[tuple[float, bytes]]:
+        members = self._get(key, dict) or {}
+        return sorted((score, member) for member, score in members.items())
+
+    def zadd(self, key, *args):
+        members = self._get(key, dict, create=True)
+        # Options (NX, XX, CH...) are not supported
+        added = 0
+        for idx in range(0, len(args), 2):
+            score, member = float(args[idx]), args[idx + 1]
+            added += member not in members
+            members[member] = score
+        return added
+
+    def zcard(self, key):
+        return len(self._get(key, dict) or {})
+
+    def zrange(self, key, start, stop, *args):
+        items = self._sorted(key)
+        start, stop = int(start), int(stop)
+        stop = len(items) if stop == -1 else stop + 1
+        return [member for _, member in items[start:stop]]
+
+    def zrangebyscore(self, key, low, high):
+        low, high = float(low), float(high)
+        return [m for score, m in self._sorted(key) if low <= score <= high]
+
+    def zremrangebyscore(self, key, low, high):
+        members = self._get(key, dict) or {}
+        removed = self.zrangebyscore(key, low, high)
+        for member in removed:
+            del members[member]
+        self._drop_if_empty(key)
+        return len(removed)
+
+    # Hashes
+    def hset(self, key, *args):
+        fields = self._get(key, dict, create=True)
+        added = 0
+        for idx in range(0, len(args), 2):
+            added += args[idx] not in fields
+            fields[args[idx]] = args[idx + 1]
+        return added
+
+    def hsetnx(self, key, field, value):
+        fields = self._get(key, dict, create=True)
+        if field in fields:
+            return 0
+        fields[field] = value
+        return 1
+
+    def hget(self, key, field):
+        return (self._get(key, dict) or {}).get(field)
+
+    def hdel(self, key, *names):
+        fields = self._get(key, dict) or {}
+        removed = sum(1 for name in names if fields.pop(name, None) is not None)
+        self._drop_if_empty(key)
+        return removed
+
+    def hexists(self, key, field):
+        return int(field in (self._get(key, dict) or {}))
+
+    def hlen(self, key):
+        return len(self._get(key, dict) or {})
+
+    def hgetall(self, key):
+        return [
+            item
+            for field, value in (self._get(key, dict) or {}).items()
+            for item in (field, value)
+        ]
+
+    # Scripts
+    def script(self, subcommand, *args):
+        subcommand = subcommand.decode().lower()
+        if subcommand == 'load':
+            return self._load_script(args[0].decode())
+        if subcommand == 'flush':
+            self.scripts.clear()
+            return OK
+        raise CommandError(f'Unsupported SCRIPT subcommand: {subcommand}')
+
+    def _load_script(self, script: str) -> bytes:
+        if script not in _SCRIPTS:
+            raise CommandError('Stand-in does not run arbitrary Lua scripts')
+
+        sha = hashlib.sha1(script.encode()).hexdigest()
+        self.scripts[sha] = _SCRIPTS[script]
+        return sha.encode()
+
+    def evalsha(self, sha, numkeys, *args):
+        script = self.scripts.get(sha.decode())
+        if script is None:
+            raise CommandError(
+                'No matching script. Please use EVAL.',
+                'NOSCRIPT'
+            )
+        numkeys = int(numkeys)
+        return script(self, args[:numkeys], args[numkeys:])
+
+    def eval(self, script, numkeys, *args):
+        sha = self._load_script(script.decode())
+        return self.evalsha(sha, numkeys, *args)
+
+
+def _schedule_pop(store: _Store, keys: list, args: list) -> list:
+    """Equivalent of 'huey.storage.SCHEDULE_POP_LUA'"""
+    items = store.zrangebyscore(keys[0], b'-inf', args[0])
+    store.zremrangebyscore(keys[0], b'-inf', args[0])
+    return items
+
+
+_SCRIPTS = {SCHEDULE_POP_LUA: _schedule_pop}
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    server: 'RedisStandIn'
+
+    def handle(self):
+        transaction = None
+
+        while True:
+            try:
+                command = self._read_command()
+            except (ConnectionError, ValueError):
+                return
+            if command is None:
+                return
+
+            name = command[0].decode().lower()
+            args = command[1:]
+
+            if name == 'multi':
+                transaction = []
+                reply = OK
+            elif name == 'discard':
+                transaction = None
+                reply = OK
+            elif name == 'exec':
+                reply = self.server.execute_many(transaction or [])
+                transaction = None
+            elif transaction is not None:
+                transaction.append((name, args))
+                reply = QUEUED
+            elif name == 'brpop':
+                reply = self.server.brpop(args[:-1], float(args[-1]))
+            else:
+                reply = self.server.execute(name, args)
+
+            try:
+                self.wfile.write(_encode(reply))
+            except OSError:
+                return
+
+    def _read_command(self) -> list[bytes]:
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b'*'):
+            # Inline command
+            return line.split()
+
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+
+def _encode(reply) -> bytes:
+    if isinstance(reply, CommandError):
+        return f'-{reply.reply}\r\n'.encode()
+    if isinstance(reply, _Status):
+        return f'+{reply}\r\n'.encode()
+    if reply is None:
+        return b'$-1\r\n'
+    if isinstance(reply, bool):
+        reply = int(reply)
+    if isinstance(reply, int):
+        return f':{reply}\r\n'.encode()
+    if isinstance(reply, str):
+        reply = reply.encode()
+    if isinstance(reply, bytes):
+        return b'$%d\r\n%s\r\n' % (len(reply), reply)
+    if isinstance(reply, (list, tuple)):
+        return b'*%d\r\n' % len(reply) + b''.join(_encode(r) for r in reply)
+
+    raise TypeError(f'Unable to encode reply: {reply!r}')
+
+
+class RedisStandIn(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port: int = 0) -> None:
+        super().__init__(('127.0.0.1', port), _Handler)
+        self.store = _Store()
+        self._thread: threading.Thread = None
+
+    @property
+    def url(self) -> str:
+        return f'redis://127.0.0.1:{self.server_address[1]}/0'
+
+    def execute(self, name: str, args: list[bytes]):
+        with self.store.cond:
+            return self._run(name, args)
+
+    def execute_many(self, commands: list[tuple[str, list[bytes]]]) -> list:
+        """Runs given commands atomically, as 'EXEC' does"""
+        with self.store.cond:
+            return [self._run(name, args) for name, args in commands]
+
+    def brpop(self, keys: list[bytes], timeout: float):
+        deadline = time.monotonic() + timeout if timeout else None
+
+        with self.store.cond:
+            while True:
+                for key in keys:
+                    value = self._run('rpop', [key])
+                    if isinstance(value, bytes):
+                        return [key, value]
+
+                remaining = deadline - time.monotonic() if deadline else None
+                if remaining is not None and remaining <= 0:
+                    return None
+                self.store.cond.wait(remaining)
+
+    def _run(self, name: str, args: list[bytes]):
+        if name == 'del':
+            name = 'delete'
+
+        handler = getattr(self.store, name, None)
+        if handler is None or name.startswith('_'):
+            return CommandError(f"unknown command '{name}'")
+
+        try:
+            return handler(*args)
+        except CommandError as err:
+            return err
+        except (TypeError, ValueError, IndexError) as err:
+            return CommandError(f'Invalid arguments for {name}: {err}')
+
+    def start(self) -> 'RedisStandIn':
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,285 @@
+"""
+End to end benchmark suite. Downloads synthetic files served by a local
+stand-in server (see 'http_stand_in') through:
+
+* 'downloader': 'downloader.download' run directly, with progress
+  reported to database as workers do
+* 'huey': tasks created through 'POST /tasks/batch' and downloaded by an
+  in process huey consumer running 'async_tasks', while api latency is
+  sampled on 'GET /tasks' and 'GET /metrics'
+
+Reports transfer rate, CPU seconds and database transactions per GB and
+api p50/p99 latencies as JSON. Pass the JSON output of a previous run
+as '--baseline' to get relative changes, e.g. between two commits.
+
+Huey queue is stored in a sqlite file, or with '--queue redis' in a
+local Redis stand-in (see 'redis_stand_in').
+
+Usage:
+    python -m benchmarks.suite [--downloads 8] [--size 67108864]
+        [--latency 0.01] [--bandwidth 0] [--chunked] [--workers 4]
+        [--queue sqlite] [--output result.json] [--baseline previous.json]
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.http_stand_in import StandInProcess
+from benchmarks.redis_stand_in import RedisStandIn
+
+
+GB = 1024 ** 3
+
+
+class _Meter:
+    """Measures wall time, CPU time and database transactions of
+    current process between 'start' and 'stop'
+    """
+
+    def start(self) -> '_Meter':
+        self._started = time.perf_counter()
+        self._cpu_started = time.process_time()
+        self._db_started = _db_transactions()
+        return self
+
+    def stop(self, total_bytes: int) -> dict:
+        elapsed = time.perf_counter() - self._started
+        cpu = time.process_time() - self._cpu_started
+        db_transactions = _db_transactions() - self._db_started
+        gigabytes = max(total_bytes, 1) / GB
+
+        return {
+            'seconds': round(elapsed, 3),
+            'mb_per_s': round(total_bytes / 1024 / 1024 / elapsed, 2),
+            'cpu_seconds_per_gb': round(cpu / gigabytes, 3),
+            'db_transactions_per_gb': round(db_transactions / gigabytes, 1)
+        }
+
+
+def _db_transactions() -> int:
+    # pylint: disable=import-outside-toplevel
+    from ddownloader import metrics
+    return metrics.db_query_seconds.dump()['count']
+
+
+def _file_urls(server: StandInProcess, args) -> list[str]:
+    return [server.file_url(args.size, args.chunked)] * args.downloads
+
+
+def run_downloader(server: StandInProcess, args, target_dir: str) -> dict:
+    # pylint: disable=import-outside-toplevel
+    import ddownloader.dtask_repository as dtask_repo
+    from ddownloader import downloader
+    from ddownloader.downloader import DownloadStatus, DownloadTask
+    from ddownloader.progress import ProgressReporter
+
+    dtasks = [
+        DownloadTask(url, os.path.join(target_dir, f'downloader{idx}'))
+        for idx, url in enumerate(_file_urls(server, args))
+    ]
+    dtask_repo.save_many(dtasks)
+    reporter = ProgressReporter()
+
+    def _download(dtask):
+        downloader.download(dtask, lambda: reporter.update(dtask), lambda: None)
+
+    meter = _Meter().start()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        list(executor.map(_download, dtasks))
+    reporter.flush()
+
+    result = meter.stop(sum(d.downloaded_size for d in dtasks))
+    result['completed'] = sum(
+        1 for d in dtasks if d.status == DownloadStatus.COMPLETED
+    )
+    return result
+
+
+def run_huey(server: StandInProcess, args, target_dir: str) -> dict:
+    # pylint: disable=import-outside-toplevel
+    import ddownloader.dtask_repository as dtask_repo
+    from ddownloader import async_tasks
+    from ddownloader.downloader import DownloadStatus
+    from ddownloader.web.app import app
+
+    client = app.test_client()
+    latencies = {'GET /tasks': [], 'GET /metrics': []}
+    done = threading.Event()
+
+    def _sample_api():
+        while not done.is_set():
+            for endpoint, path in (
+                ('GET /tasks', '/tasks?page_size=30'),
+                ('GET /metrics', '/metrics')
+            ):
+                started = time.perf_counter()
+                client.get(path)
+                latencies[endpoint].append(time.perf_counter() - started)
+            time.sleep(0.05)
+
+    consumer = async_tasks.huey.create_consumer(
+        workers=args.workers,
+        worker_type='thread',
+        periodic=False
+    )
+    consumer.start()
+
+    meter = _Meter().start()
+    sampler = threading.Thread(target=_sample_api, daemon=True)
+    sampler.start()
+
+    res = client.post('/tasks/batch', json={'dtasks': [
+        {
+            'url': url,
+            'relative_target_path': os.path.relpath(
+                os.path.join(target_dir, f'huey{idx}'),
+                os.environ['DOWNLOADS_PATH']
+            )
+        }
+        for idx, url in enumerate(_file_urls(server, args))
+    ]})
+    dtask_ids = [r['dtask']['id'] for r in res.get_json()['results']]
+
+    finished = (DownloadStatus.COMPLETED, DownloadStatus.FAILED)
+    while True:
+        dtasks = dtask_repo.find_by_ids(dtask_ids)
+        if all(d.status in finished for d in dtasks):
+            break
+        time.sleep(0.1)
+
+    done.set()
+    sampler.join()
+    consumer.stop(graceful=True)
+
+    result = meter.stop(sum(int(d.downloaded_size) for d in dtasks))
+    result['completed'] = sum(
+        1 for d in dtasks if d.status == DownloadStatus.COMPLETED
+    )
+    result['api_latency_ms'] = {
+        endpoint: _percentiles(values)
+        for endpoint, values in latencies.items()
+    }
+    return result
+
+
+def _percentiles(values: list[float]) -> dict:
+    if len(values) < 2:
+        return {'samples': len(values)}
+
+    cuts = statistics.quantiles(values, n=100)
+    return {
+        'samples': len(values),
+        'p50': round(cuts[49] * 1000, 2),
+        'p99': round(cuts[98] * 1000, 2)
+    }
+
+
+def compare(result: dict, baseline: dict) -> dict:
+    """Relative change (%) of every numeric metric against baseline"""
+    def _diff(current, previous):
+        if isinstance(current, dict) and isinstance(previous, dict):
+            return {
+                k: _diff(v, previous[k])
+                for k, v in current.items() if k in previous
+            }
+        if isinstance(current, (int, float)) and previous:
+            return round((current - previous) / previous * 100, 1)
+        return None
+
+    return {
+        name: _diff(scenario, baseline['scenarios'].get(name, {}))
+        for name, scenario in result['scenarios'].items()
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL,
+            text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--downloads', type=int, default=8)
+    parser.add_argument('--size', type=int, default=64 * 1024 * 1024)
+    parser.add_argument('--latency', type=float, default=0.01)
+    parser.add_argument(
+        '--bandwidth',
+        type=int,
+        default=0,
+        help='Bytes per second per connection, 0 for unlimited'
+    )
+    parser.add_argument('--chunked', action='store_true')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--queue', choices=('sqlite', 'redis'), default='sqlite')
+    parser.add_argument(
+        '--scenarios',
+        default='downloader,huey',
+        help='Comma separated scenarios to run'
+    )
+    parser.add_argument('--output')
+    parser.add_argument('--baseline')
+    args = parser.parse_args()
+
+    # Everything is kept inside a scratch directory, configuration has
+    # to be set before importing ddownloader modules
+    work_dir = tempfile.mkdtemp(prefix='ddownloader-bench-')
+    os.environ['DB_PATH'] = os.path.join(work_dir, 'bench.db')
+    os.environ['DOWNLOADS_PATH'] = work_dir
+    os.environ['CONTROL_SOCKET_DIR'] = os.path.join(work_dir, 'control')
+    os.environ['METRICS_DIR'] = os.path.join(work_dir, 'metrics')
+    os.environ['MAX_CONCURRENT_DOWNLOADS'] = str(args.workers)
+    os.environ['MAX_DOWNLOADS_PER_HOST'] = str(args.workers)
+    os.environ['QUEUE_BACKEND'] = args.queue
+
+    redis_server = None
+    if args.queue == 'redis':
+        redis_server = RedisStandIn().start()
+        os.environ['QUEUE_URL'] = redis_server.url
+
+    runners = {'downloader': run_downloader, 'huey': run_huey}
+    server = StandInProcess(args.latency, args.bandwidth).start()
+    result = {
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'params': vars(args),
+        'scenarios': {}
+    }
+    try:
+        for name in args.scenarios.split(','):
+            target_dir = os.path.join(work_dir, name)
+            os.makedirs(target_dir)
+            result['scenarios'][name] = runners[name](server, args, target_dir)
+            shutil.rmtree(target_dir)
+    finally:
+        server.stop()
+        if redis_server:
+            redis_server.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            result['change_pct'] = compare(result, json.load(baseline_file))
+
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
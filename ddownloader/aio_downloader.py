@@ -0,0 +1,352 @@
+"""
+asyncio based download engine. A single event loop, running in a
+background thread, drives every transfer of the process, so hundreds
+of concurrent downloads do not need hundreds of threads.
+
+Memory is bounded by 'async_max_concurrency() * chunk size'. Disk
+writes, hashing and task callbacks (which write into database) are
+delegated to a small thread pool to keep the loop responsive, so a
+slow callback of a download never delays the others. Downloads are
+always fetched through a single stream.
+"""
+import asyncio
+import concurrent.futures
+import os
+import threading
+from typing import Callable
+
+import aiohttp
+
+from ddownloader import config_loader as dconfig
+from ddownloader import archives, bandwidth, hashing, metrics, storage
+from ddownloader.downloader import (
+    DownloadStatus,
+    DownloadTask,
+    complete,
+    discard_archive,
+    fail,
+    fail_extraction,
+    open_extractor,
+    prepare_target,
+    restart,
+    resume_offset,
+    store_validators
+)
+from ddownloader.errors import ShortReadError
+from ddownloader.mirrors import Sources
+
+
+class AioEngine:
+
+    def __init__(self, max_concurrency: int = None) -> None:
+        self.max_concurrency = max_concurrency \
+            or dconfig.async_max_concurrency()
+        self.chunk_size = 1024 * 1024  # 1MB
+
+        self._lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop = None
+        self._pid: int = None
+        self._semaphore: asyncio.Semaphore = None
+        self._session: aiohttp.ClientSession = None
+
+    def submit(
+        self,
+        dtask: DownloadTask,
+        on_update: Callable,
+        reload_status: Callable,
+        sources: Sources = None
+    ) -> concurrent.futures.Future:
+        """Schedules given task into engine loop without blocking
+        the caller. Callbacks are invoked from engine thread pool, one
+        at a time for a given task, so they may block. Mirrors are
+        handled as 'downloader.download' does.
+
+        Returns:
+            concurrent.futures.Future: Resolved once download stops
+        """
+        loop = self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(
+            self._download(dtask, on_update, reload_status, sources),
+            loop
+        )
+
+    def close(self) -> None:
+        """Closes http session and stops engine loop. Pending downloads
+        are abandoned
+        """
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                return
+
+            if self._session is not None:
+                asyncio.run_coroutine_threadsafe(
+                    self._session.close(),
+                    self._loop
+                ).result()
+
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop = None
+            self._semaphore = None
+            self._session = None
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                self._loop = asyncio.new_event_loop()
+                self._pid = os.getpid()
+
+                threading.Thread(
+                    target=self._loop.run_forever,
+                    name='ddownloader-aio-engine',
+                    daemon=True
+                ).start()
+
+            return self._loop
+
+    async def _download(
+        self,
+        dtask: DownloadTask,
+        on_update: Callable,
+        reload_status: Callable,
+        sources: Sources
+    ) -> None:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=0),
+                timeout=aiohttp.ClientTimeout(sock_connect=60, sock_read=60)
+            )
+
+        if not dtask.valid_for_download():
+            return
+
+        loop = asyncio.get_running_loop()
+        async with self._semaphore:
+            dtask.status = DownloadStatus.IN_PROGRESS
+            dtask.retry_at = None
+            await loop.run_in_executor(None, on_update)
+
+            dtask.downloaded_size = resume_offset(dtask)
+            resumed_from = dtask.downloaded_size
+
+            bandwidth.governor.register(dtask.id, dtask.max_rate)
+            try:
+                await self._transfer_from_sources(
+                    dtask,
+                    on_update,
+                    reload_status,
+                    sources
+                )
+            except Exception as err:  # pylint: disable=broad-except
+                fail(dtask, err, resumed_from)
+                await loop.run_in_executor(None, on_update)
+            finally:
+                bandwidth.governor.unregister(dtask.id)
+
+    async def _transfer_from_sources(
+        self,
+        dtask: DownloadTask,
+        on_update: Callable,
+        reload_status: Callable,
+        sources: Sources
+    ) -> None:
+        while True:
+            try:
+                await self._transfer(dtask, on_update, reload_status, sources)
+                return
+            except Exception as err:  # pylint: disable=broad-except
+                if sources is None or not sources.switch(err):
+                    raise
+
+    async def _transfer(
+        self,
+        dtask: DownloadTask,
+        on_update: Callable,
+        reload_status: Callable,
+        sources: Sources = None
+    ) -> None:
+        loop = asyncio.get_running_loop()
+
+        headers = None
+        if dtask.downloaded_size:
+            headers = {'Range': f'bytes={dtask.downloaded_size}-'}
+            if dtask.if_range:
+                headers['If-Range'] = dtask.if_range
+
+        # Stalled mirrors are left for next one
+        timeout = self._session.timeout
+        if dtask.mirrors:
+            timeout = aiohttp.ClientTimeout(
+                sock_connect=60,
+                sock_read=dconfig.mirror_stall_timeout()
+            )
+
+        async with self._session.get(
+            dtask.source_url,
+            headers=headers,
+            timeout=timeout
+        ) as res:
+            res.raise_for_status()
+
+            # Whole content is sent when it changed since last attempt
+            if dtask.downloaded_size and res.status != 206:
+                await loop.run_in_executor(None, restart, dtask)
+            store_validators(dtask, res.headers)
+
+            if res.content_length is not None:
+                dtask.total_size = res.content_length + dtask.downloaded_size
+
+            try:
+                await loop.run_in_executor(None, prepare_target, dtask)
+            except storage.InsufficientSpaceError as err:
+                dtask.status = DownloadStatus.FAILED
+                dtask.err_message = err.message
+                await loop.run_in_executor(None, on_update)
+                return
+
+            hasher = None
+            if dtask.file_hash:
+                hasher = await loop.run_in_executor(
+                    None,
+                    hashing.resume_hasher,
+                    dtask.id,
+                    dtask.file_hash,
+                    dtask.target_path,
+                    dtask.downloaded_size
+                )
+
+            target = await loop.run_in_executor(
+                None,
+                storage.TargetFile,
+                dtask.target_path
+            )
+
+            extractor = None
+            try:
+                extractor = await loop.run_in_executor(
+                    None,
+                    _enter_extractor,
+                    dtask
+                )
+
+                chunks = _iter_content(res.content, dtask.id, self.chunk_size)
+                if sources:
+                    chunks = sources.watch_async(chunks)
+
+                async for chunk in chunks:
+                    wait = bandwidth.governor.delay(dtask.id, len(chunk))
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+
+                    await loop.run_in_executor(
+                        None,
+                        _consume_chunk,
+                        target,
+                        dtask.downloaded_size,
+                        chunk,
+                        hasher,
+                        extractor
+                    )
+                    dtask.downloaded_size += len(chunk)
+                    metrics.transfer_meter.record(dtask.id, len(chunk))
+
+                    await loop.run_in_executor(
+                        None,
+                        _report,
+                        reload_status,
+                        on_update
+                    )
+
+                    if dtask.status != DownloadStatus.IN_PROGRESS:
+                        if hasher:
+                            await loop.run_in_executor(
+                                None,
+                                hashing.save_checkpoint,
+                                dtask.id,
+                                hasher
+                            )
+                        return
+
+                # Chunked responses: size is known once stream is over
+                if res.content_length is None:
+                    dtask.total_size = dtask.downloaded_size
+
+                if extractor and dtask.downloaded_size == dtask.total_size:
+                    await loop.run_in_executor(None, extractor.finish)
+            except archives.ExtractionError as err:
+                fail_extraction(dtask, err)
+                await loop.run_in_executor(None, on_update)
+                return
+            finally:
+                await loop.run_in_executor(None, target.close)
+                if extractor:
+                    await loop.run_in_executor(None, extractor.abort)
+
+        if dtask.downloaded_size != dtask.total_size:
+            raise ShortReadError(dtask.downloaded_size, dtask.total_size)
+
+        await loop.run_in_executor(
+            None,
+            _complete,
+            dtask,
+            hasher,
+            extractor is not None
+        )
+        await loop.run_in_executor(None, on_update)
+
+
+async def _iter_content(
+    content: aiohttp.StreamReader,
+    dtask_id: int,
+    chunk_size: int
+):
+    """Yields chunks of given body, throttled tasks read smaller ones
+    (see 'bandwidth.BandwidthGovernor.read_size')
+    """
+    while True:
+        chunk = await content.read(
+            bandwidth.governor.read_size(dtask_id, chunk_size)
+        )
+        if not chunk:
+            return
+        yield chunk
+
+
+def _enter_extractor(dtask: DownloadTask):
+    return open_extractor(dtask).__enter__()
+
+
+def _consume_chunk(target, offset, chunk, hasher, extractor) -> None:
+    """Writes given chunk into target file, and feeds it to hasher and
+    extractor if any. Runs in engine thread pool
+    """
+    target.write_at(offset, chunk)
+    if hasher:
+        hasher.update(chunk)
+    if extractor:
+        extractor.feed(chunk)
+
+
+def _report(reload_status: Callable, on_update: Callable) -> None:
+    reload_status()
+    on_update()
+
+
+def _complete(dtask: DownloadTask, hasher, extracted: bool) -> None:
+    complete(dtask, hasher)
+    if extracted:
+        discard_archive(dtask)
+
+
+engine = AioEngine()
+
+
+def download(
+    dtask: DownloadTask,
+    on_update: Callable,
+    reload_status: Callable
+) -> None:
+    """Same contract as 'downloader.download', blocks until download
+    stops while transfer is driven by the shared engine loop
+    """
+    engine.submit(dtask, on_update, reload_status).result()
@@ -0,0 +1,665 @@
+"""
+Extraction of downloaded archives, either once downloaded (see
+'extract_file') or while being downloaded (see 'open_stream'): bytes
+received by download loop are fed into a stream extractor, so archive
+members land in destination directory as they arrive, without an extra
+read pass over the archive.
+
+* tar archives, plain or compressed with gzip, bzip2 or xz, are parsed
+  block by block as bytes arrive
+* zip archives keep their index (central directory) at the end of the
+  file, so it is fetched first through range requests. Members are then
+  extracted as their bytes arrive; archives whose index can not be
+  fetched, encrypted ones and unsupported compression methods can not
+  be streamed
+"""
+import abc
+import bz2
+import io
+import lzma
+import os
+import stat
+import struct
+import tarfile
+import zipfile
+import zlib
+from pathlib import Path
+from typing import Iterator
+
+import requests
+
+from ddownloader import http_session
+
+
+# Suffix of archive names and the format they are extracted as
+SUFFIXES = {
+    '.tar': 'tar',
+    '.tar.gz': 'tar.gz',
+    '.tgz': 'tar.gz',
+    '.tar.bz2': 'tar.bz2',
+    '.tbz2': 'tar.bz2',
+    '.tar.xz': 'tar.xz',
+    '.txz': 'tar.xz',
+    '.zip': 'zip'
+}
+
+_BLOCK_SIZE = tarfile.BLOCKSIZE
+_ZERO_BLOCK = bytes(_BLOCK_SIZE)
+
+# Fixed part of zip local file header, ends with name and extra field
+# lengths
+_ZIP_HEADER = struct.Struct('<4s2B4HL2L2H')
+_ZIP_HEADER_SIGNATURE = b'PK\003\004'
+
+# Max decompressed bytes produced at once out of a single chunk
+_MAX_INFLATE = 1024 * 1024
+_READ_SIZE = 1024 * 1024
+
+
+class ExtractionError(Exception):
+    def __init__(self, message: str) -> None:
+        super().__init__(message)
+        self.message = message
+
+
+class StreamingNotSupportedError(ExtractionError):
+    """Archive can not be extracted while downloading, it has to be
+    extracted once downloaded
+    """
+
+
+def archive_format(name: str) -> str:
+    """Format of archive with given (file) name, None if name does not
+    have a supported archive suffix
+    """
+    name = name.lower()
+    for suffix in sorted(SUFFIXES, key=len, reverse=True):
+        if name.endswith(suffix) and len(name) > len(suffix):
+            return SUFFIXES[suffix]
+    return None
+
+
+def default_dest(archive_path: str) -> str:
+    """Directory named after archive, next to it"""
+    name = os.path.basename(archive_path)
+    for suffix in sorted(SUFFIXES, key=len, reverse=True):
+        if name.lower().endswith(suffix) and len(name) > len(suffix):
+            return os.path.join(
+                os.path.dirname(archive_path),
+                name[:-len(suffix)]
+            )
+    return f'{archive_path}.extracted'
+
+
+def extract_file(archive_path: str, dest: str) -> None:
+    """Extracts a downloaded archive (tar, optionally compressed, or
+    zip) into dest. Members can not escape dest
+
+    Raises:
+        ExtractionError: If file is not a supported archive or it has
+            unsafe members
+    """
+    if tarfile.is_tarfile(archive_path):
+        with tarfile.open(archive_path) as archive:
+            _extract_tar(archive, Path(dest))
+    elif zipfile.is_zipfile(archive_path):
+        # Member names are sanitized by zipfile
+        with zipfile.ZipFile(archive_path) as archive:
+            archive.extractall(dest)
+    else:
+        raise ExtractionError('File is not a supported archive')
+
+
+def _extract_tar(archive: tarfile.TarFile, dest: Path) -> None:
+    if hasattr(tarfile, 'data_filter'):
+        try:
+            archive.extractall(dest, filter='data')
+        except tarfile.FilterError as err:
+            raise ExtractionError(f'Unsafe archive member: {err}') from err
+        return
+
+    for member in archive.getmembers():
+        _safe_path(dest, member.name)
+        if member.issym() or member.islnk() or member.isdev():
+            raise ExtractionError(f'Unsafe archive member: {member.name}')
+    archive.extractall(dest)
+
+
+def _safe_path(dest: Path, name: str) -> Path:
+    """Path of archive member of given name inside dest
+
+    Raises:
+        ExtractionError: If member would land outside of dest
+    """
+    parts = Path(name.replace('\\', '/')).parts
+    if not parts or Path(name).is_absolute() or '..' in parts:
+        raise ExtractionError(f'Unsafe archive member: {name}')
+    return dest.joinpath(*parts)
+
+
+class _Stream(abc.ABC):
+    """Base of stream extractors. Feed them all the bytes of archive,
+    in order, then call 'finish' to check archive was complete.
+    Extractors are context managers, open files are closed on exit.
+    """
+
+    def __init__(self, dest: str) -> None:
+        self.dest = Path(dest)
+        self.members = 0
+        self._out: io.BufferedWriter = None
+
+    @abc.abstractmethod
+    def feed(self, data: bytes) -> None:
+        pass
+
+    @abc.abstractmethod
+    def finish(self) -> None:
+        pass
+
+    def replay(self, archive_path: str, size: int) -> None:
+        """Feeds first 'size' bytes of given (partially downloaded)
+        archive, so a resumed download can go on feeding next ones.
+        Members in those bytes are extracted again
+        """
+        with open(archive_path, 'rb') as archive:
+            while size > 0:
+                data = archive.read(min(_READ_SIZE, size))
+                if not data:
+                    raise ExtractionError('Partial archive is shorter than expected')
+                self.feed(data)
+                size -= len(data)
+
+    def abort(self) -> None:
+        if self._out:
+            self._out.close()
+            self._out = None
+
+    def __enter__(self) -> '_Stream':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.abort()
+
+    def _open_member(self, name: str) -> Path:
+        path = _safe_path(self.dest, name)
+        os.makedirs(path.parent, exist_ok=True)
+        self._out = open(path, 'wb')
+        self.members += 1
+        return path
+
+    def _close_member(self) -> None:
+        self._out.close()
+        self._out = None
+
+
+class _Decompressor:
+    """Incremental decompression of gzip, bzip2 and xz streams, made
+    of one or several concatenated members
+    """
+
+    def __init__(self, compression: str) -> None:
+        self.compression = compression
+        self._decompressor = self._new()
+
+    def _new(self):
+        if self.compression == 'gz':
+            return zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+        if self.compression == 'bz2':
+            return bz2.BZ2Decompressor()
+        return lzma.LZMADecompressor()
+
+    @property
+    def eof(self) -> bool:
+        return self._decompressor.eof
+
+    def inflate(self, data: bytes) -> Iterator[bytes]:
+        try:
+            while data:
+                if self._decompressor.eof:
+                    # Next member of a multi-member stream
+                    data = self._decompressor.unused_data + data \
+                        if self._decompressor.unused_data else data
+                    self._decompressor = self._new()
+
+                yield from _inflate(self._decompressor, data)
+                data = self._decompressor.unused_data \
+                    if self._decompressor.eof else b''
+                if data:
+                    self._decompressor = self._new()
+        except (zlib.error, OSError, EOFError, lzma.LZMAError) as err:
+            raise ExtractionError(f'Corrupt archive: {err}') from err
+
+
+def _inflate(decompressor, data: bytes) -> Iterator[bytes]:
+    """Decompresses given chunk with given (zlib, bz2 or lzma)
+    decompressor in pieces of up to '_MAX_INFLATE' bytes, so highly
+    compressed chunks do not take unbounded memory
+
+    Raises:
+        ExtractionError: If chunk is not valid compressed data
+    """
+    try:
+        if hasattr(decompressor, 'unconsumed_tail'):
+            while data:
+                out = decompressor.decompress(data, _MAX_INFLATE)
+                data = decompressor.unconsumed_tail
+                if out:
+                    yield out
+            return
+
+        out = decompressor.decompress(data, _MAX_INFLATE)
+        while True:
+            if out:
+                yield out
+            if decompressor.eof or decompressor.needs_input:
+                return
+            out = decompressor.decompress(b'', _MAX_INFLATE)
+    except (zlib.error, OSError, EOFError, lzma.LZMAError) as err:
+        raise ExtractionError(f'Corrupt archive: {err}') from err
+
+
+class TarStream(_Stream):
+    """Extracts a tar archive, plain or compressed ('gz', 'bz2', 'xz'),
+    out of its bytes in order. Regular files and directories are
+    extracted, links and special files are skipped.
+    """
+
+    def __init__(self, dest: str, compression: str = None) -> None:
+        super().__init__(dest)
+        self._decompressor = _Decompressor(compression) if compression else None
+        self._buf = bytearray()
+
+        self._remaining = 0
+        self._padding = 0
+        self._member: tarfile.TarInfo = None
+        self._meta: bytearray = None
+        self._overrides: dict[str, str] = {}
+        self._ended = False
+
+    def feed(self, data: bytes) -> None:
+        if self._decompressor:
+            for block in self._decompressor.inflate(bytes(data)):
+                self._process(block)
+        else:
+            self._process(data)
+
+    def finish(self) -> None:
+        if self._remaining or self._padding or self._buf.strip(b'\0'):
+            raise ExtractionError('Archive ended in the middle of a member')
+        if self._decompressor and not self._decompressor.eof:
+            raise ExtractionError('Compressed archive is truncated')
+        self.abort()
+
+    def _process(self, data: bytes) -> None:
+        view = memoryview(data)
+        while view:
+            if self._remaining:
+                size = min(self._remaining, len(view))
+                self._write(view[:size])
+                view = view[size:]
+                self._remaining -= size
+                if not self._remaining:
+                    self._end_member()
+                continue
+
+            if self._padding:
+                size = min(self._padding, len(view))
+                view = view[size:]
+                self._padding -= size
+                continue
+
+            needed = _BLOCK_SIZE - len(self._buf)
+            self._buf += view[:needed]
+            view = view[needed:]
+            if len(self._buf) == _BLOCK_SIZE:
+                block = bytes(self._buf)
+                self._buf.clear()
+                self._start_member(block)
+
+    def _write(self, data: memoryview) -> None:
+        if self._out:
+            self._out.write(data)
+        elif self._meta is not None:
+            self._meta += data
+
+    def _start_member(self, block: bytes) -> None:
+        if self._ended or block == _ZERO_BLOCK:
+            # End of archive is marked by zero blocks, rest is padding
+            self._ended = True
+            return
+
+        try:
+            info = tarfile.TarInfo.frombuf(block, 'utf-8', 'surrogateescape')
+        except tarfile.HeaderError as err:
+            raise ExtractionError(f'Corrupt archive: {err}') from err
+
+        if 'path' in self._overrides:
+            info.name = self._overrides['path']
+        if 'size' in self._overrides:
+            info.size = int(self._overrides['size'])
+
+        self._member = info
+        self._remaining = info.size
+        self._padding = -info.size % _BLOCK_SIZE
+
+        if info.type in (tarfile.GNUTYPE_LONGNAME, tarfile.XHDTYPE,
+                         tarfile.XGLTYPE, tarfile.GNUTYPE_LONGLINK):
+            self._meta = bytearray()
+        else:
+            self._overrides = {}
+            if info.isreg():
+                self._open_member(info.name)
+            elif info.isdir():
+                os.makedirs(_safe_path(self.dest, info.name), exist_ok=True)
+                self.members += 1
+            # Data of links and special files is skipped
+
+        if not self._remaining:
+            self._end_member()
+
+    def _end_member(self) -> None:
+        info = self._member
+        if self._meta is not None:
+            self._apply_meta(info.type, bytes(self._meta))
+            self._meta = None
+        elif self._out:
+            path = Path(self._out.name)
+            self._close_member()
+            os.chmod(path, (info.mode & 0o755) | stat.S_IRUSR | stat.S_IWUSR)
+            os.utime(path, (info.mtime, info.mtime))
+
+    def _apply_meta(self, member_type: bytes, data: bytes) -> None:
+        """Long names and pax headers apply to next member"""
+        if member_type == tarfile.GNUTYPE_LONGNAME:
+            self._overrides['path'] = data.rstrip(b'\0').decode(
+                'utf-8',
+                'surrogateescape'
+            )
+        elif member_type == tarfile.XHDTYPE:
+            self._overrides.update(_parse_pax(data))
+
+
+def _parse_pax(data: bytes) -> dict[str, str]:
+    """Parses '<length> <key>=<value>\\n' records of a pax header
+
+    Raises:
+        ExtractionError: If header is corrupt
+    """
+    records = {}
+    pos = 0
+    while pos < len(data):
+        space = data.find(b' ', pos)
+        if space < 0:
+            break
+        try:
+            length = int(data[pos:space])
+            if length <= space - pos:
+                raise ValueError(f'invalid record length {length}')
+
+            key, _, value = data[space + 1:pos + length - 1].partition(b'=')
+            records[key.decode()] = value.decode('utf-8', 'surrogateescape')
+        except ValueError as err:
+            raise ExtractionError(f'Corrupt pax header: {err}') from err
+        pos += length
+    return records
+
+
+class ZipStream(_Stream):
+    """Extracts a zip archive out of its bytes in order, guided by its
+    entries as read from central directory (see 'read_zip_entries')
+    """
+
+    def __init__(self, dest: str, entries: list[zipfile.ZipInfo]) -> None:
+        super().__init__(dest)
+        self._entries = sorted(entries, key=lambda e: e.header_offset)
+        self._idx = 0
+        self._pos = 0
+
+        self._header = bytearray()
+        self._in_data = False
+        self._remaining = 0
+        self._inflater = None
+        self._entry_size = 0
+        self._crc = 0
+
+    def feed(self, data: bytes) -> None:
+        view = memoryview(data)
+        while view and self._idx < len(self._entries):
+            entry = self._entries[self._idx]
+
+            # Bytes before next entry (e.g. a previous entry trailer)
+            if self._pos < entry.header_offset:
+                view = self._advance(
+                    view,
+                    min(entry.header_offset - self._pos, len(view))
+                )
+                continue
+
+            if not self._in_data:
+                size = min(self._header_missing(), len(view))
+                self._header += view[:size]
+                view = self._advance(view, size)
+                if not self._header_missing():
+                    self._start_entry(entry)
+                continue
+
+            size = min(self._remaining, len(view))
+            self._write(view[:size])
+            view = self._advance(view, size)
+            self._remaining -= size
+            if not self._remaining:
+                self._end_entry(entry)
+
+    def finish(self) -> None:
+        if self._idx < len(self._entries):
+            raise ExtractionError('Archive ended before all its members')
+        self.abort()
+
+    def _advance(self, view: memoryview, size: int) -> memoryview:
+        self._pos += size
+        return view[size:]
+
+    def _header_missing(self) -> int:
+        """Bytes missing to complete local header of next entry, its
+        fixed part first then its variable one (name and extra field)
+        """
+        if len(self._header) < _ZIP_HEADER.size:
+            return _ZIP_HEADER.size - len(self._header)
+
+        fields = _ZIP_HEADER.unpack_from(self._header)
+        if fields[0] != _ZIP_HEADER_SIGNATURE:
+            raise ExtractionError('Corrupt archive: bad local file header')
+        return _ZIP_HEADER.size + fields[-2] + fields[-1] - len(self._header)
+
+    def _start_entry(self, entry: zipfile.ZipInfo) -> None:
+        self._header.clear()
+        self._in_data = True
+        self._remaining = entry.compress_size
+        self._entry_size = entry.file_size
+        self._crc = 0
+
+        if entry.is_dir():
+            os.makedirs(_safe_path(self.dest, entry.filename), exist_ok=True)
+            self.members += 1
+        else:
+            self._open_member(entry.filename)
+            if entry.compress_type == zipfile.ZIP_DEFLATED:
+                self._inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+            elif entry.compress_type == zipfile.ZIP_BZIP2:
+                self._inflater = bz2.BZ2Decompressor()
+            else:
+                self._inflater = None
+
+        if not self._remaining:
+            self._end_entry(entry)
+
+    def _write(self, data: memoryview) -> None:
+        if self._out is None:
+            return
+
+        pieces = _inflate(self._inflater, data) if self._inflater else [data]
+        for out in pieces:
+            # Entries inflating beyond their declared size are rejected
+            # before filling the disk
+            if self._out.tell() + len(out) > self._entry_size:
+                raise ExtractionError(
+                    'Corrupt archive: entry larger than declared'
+                )
+
+            self._crc = zlib.crc32(out, self._crc)
+            self._out.write(out)
+
+    def _end_entry(self, entry: zipfile.ZipInfo) -> None:
+        if self._out is not None:
+            if hasattr(self._inflater, 'flush'):
+                tail = self._inflater.flush()
+                self._crc = zlib.crc32(tail, self._crc)
+                self._out.write(tail)
+
+            size = self._out.tell()
+            self._close_member()
+            if size != entry.file_size or self._crc != entry.CRC:
+                raise ExtractionError(
+                    f'Corrupt archive: bad checksum of {entry.filename}'
+                )
+
+        self._inflater = None
+        self._in_data = False
+        self._idx += 1
+
+
+class RangeFile(io.RawIOBase):
+    """Read only, seekable view of a remote file, read through range
+    requests. Reads are rounded up to 'min_fetch' bytes
+    """
+
+    def __init__(
+        self,
+        url: str,
+        size: int,
+        if_range: str = None,
+        min_fetch: int = 64 * 1024
+    ) -> None:
+        super().__init__()
+        self.url = url
+        self.size = size
+        self.if_range = if_range
+        self.min_fetch = min_fetch
+
+        self._pos = 0
+        self._cache_start = 0
+        self._cache = b''
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self._pos = max(0, min(offset, self.size))
+        return self._pos
+
+    def read(self, size: int = -1) -> bytes:
+        end = self.size if size is None or size < 0 \
+            else min(self._pos + size, self.size)
+        if end <= self._pos:
+            return b''
+
+        cache_end = self._cache_start + len(self._cache)
+        if not (self._cache_start <= self._pos and end <= cache_end):
+            fetch_end = min(max(end, self._pos + self.min_fetch), self.size)
+            self._cache = self._fetch(self._pos, fetch_end - 1)
+            self._cache_start = self._pos
+
+        data = self._cache[
+            self._pos - self._cache_start:end - self._cache_start
+        ]
+        self._pos += len(data)
+        return data
+
+    def _fetch(self, start: int, end: int) -> bytes:
+        headers = {'Range': f'bytes={start}-{end}'}
+        if self.if_range:
+            headers['If-Range'] = self.if_range
+
+        try:
+            res = http_session.get_session().get(
+                self.url,
+                headers=headers,
+                timeout=60
+            )
+        except requests.RequestException as err:
+            raise StreamingNotSupportedError(
+                f'Unable to fetch archive index: {err}'
+            ) from err
+
+        if res.status_code != 206:
+            raise StreamingNotSupportedError(
+                'Server does not serve byte ranges of archive'
+            )
+        return res.content
+
+
+def read_zip_entries(fileobj) -> list[zipfile.ZipInfo]:
+    """Reads entries of a zip archive out of its central directory
+
+    Raises:
+        StreamingNotSupportedError: If entries can not be read or they
+            can not be extracted while downloading
+    """
+    try:
+        with zipfile.ZipFile(fileobj) as archive:
+            entries = archive.infolist()
+    except zipfile.BadZipFile as err:
+        raise StreamingNotSupportedError(
+            f'Unable to read archive index: {err}'
+        ) from err
+
+    for entry in entries:
+        if entry.flag_bits & 0x1:
+            raise StreamingNotSupportedError('Archive is encrypted')
+        if entry.compress_type not in (
+            zipfile.ZIP_STORED,
+            zipfile.ZIP_DEFLATED,
+            zipfile.ZIP_BZIP2
+        ):
+            raise StreamingNotSupportedError(
+                f'Unsupported compression of {entry.filename}'
+            )
+    return entries
+
+
+def open_stream(
+    archive_path: str,
+    dest: str,
+    url: str,
+    total_size: int,
+    if_range: str = None
+) -> _Stream:
+    """Opens the stream extractor of an archive being downloaded from
+    given url into given path
+
+    Raises:
+        StreamingNotSupportedError: If archive has to be extracted once
+            downloaded
+    """
+    fmt = archive_format(archive_path)
+    if fmt is None:
+        raise StreamingNotSupportedError('File is not a supported archive')
+
+    if fmt == 'zip':
+        if not total_size:
+            raise StreamingNotSupportedError('Archive size is unknown')
+        entries = read_zip_entries(RangeFile(url, total_size, if_range))
+        return ZipStream(dest, entries)
+
+    compression = fmt.partition('.')[2] or None
+    return TarStream(dest, compression)
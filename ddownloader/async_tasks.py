@@ -1,27 +1,290 @@
-from huey import SqliteHuey
+import time
+
+from huey import crontab
+from huey.exceptions import TaskLockedException
 import huey
 
 import ddownloader.dtask_repository as dtask_repo
-from ddownloader.config_loader import get_db_path
+from ddownloader import config_loader as dconfig
+from ddownloader import bandwidth, control, dedup, hashing, leases, metrics
+from ddownloader import mirrors, postprocess, queue_backend
+from ddownloader.control import ControlCommand
+from ddownloader.downloader import DownloadStatus, DownloadTask
 from ddownloader.log_utils import logger
-from ddownloader import downloader
+from ddownloader import aio_downloader, downloader
+from ddownloader.progress import ProgressReporter
+
+
+huey = queue_backend.create_huey()
+
+# Seconds before a task whose download could not start (its lease or
+# target file are held elsewhere) is dispatched again
+BUSY_DISPATCH_DELAY = 5
+
+# Shared by all downloads running in this worker process
+progress_reporter = ProgressReporter()
+
+
+def _on_cancel(dtask_id: int, _value) -> None:
+    """Deleted tasks may be paused, hash state kept for them is dropped
+    as they will not be resumed
+    """
+    hashing.discard_checkpoint(dtask_id)
+    control.registry.push(dtask_id, ControlCommand.CANCEL)
+
+
+control.register_handler(ControlCommand.LIMIT_RATE, bandwidth.apply_limit)
+control.register_handler(ControlCommand.CANCEL, _on_cancel)
+
+
+@huey.on_startup()
+def start_control_listener():
+    control.start_listener()
+
+
+@huey.on_startup()
+def start_metrics_exporter():
+    metrics.start_exporter()
+
+
+@huey.on_startup()
+def load_bandwidth_limit():
+    bandwidth.governor.set_global_rate(_global_rate_setting())
+
+
+def _global_rate_setting() -> int:
+    return int(dtask_repo.get_setting(
+        bandwidth.GLOBAL_RATE_SETTING,
+        dconfig.max_download_rate()
+    ))
+
+
+_bandwidth_checked_at = 0.0
+
+
+def _refresh_bandwidth():
+    """Reads global limit and number of downloads running across all
+    workers, at most once per status check interval. Global limit is
+    shared by workers of every node this way, and limit changes reach
+    workers the control channel does not (e.g. on other nodes)
+    """
+    global _bandwidth_checked_at
+    now = time.monotonic()
+    if now - _bandwidth_checked_at < dconfig.status_check_interval():
+        return
+
+    _bandwidth_checked_at = now
+    bandwidth.governor.set_global_rate(_global_rate_setting())
+    bandwidth.governor.set_running_total(
+        dtask_repo.count(DownloadStatus.IN_PROGRESS)
+    )
+
+
+@huey.on_startup()
+def recover_abandoned_tasks():
+    """Tasks left 'In Progress', or claimed and never started, by a
+    killed consumer are resumed
+    """
+    if leases.recover_abandoned():
+        dispatch()
+
+
+@huey.on_startup()
+def recover_post_processing():
+    """Pipelines pending or left running by a killed consumer are
+    resumed, see 'postprocess.recover'
+    """
+    postprocess.recover()
+
+
+@huey.on_startup()
+def dispatch_queued():
+    """Queued tasks are dispatched again, as queue storage may not
+    hold them (e.g. queue backend changed). Their claims are released
+    first, unless a live worker holds them, as their download messages
+    may be lost
+    """
+    leases.release_unstarted()
+    dispatch()
+
+
+@huey.task()
+def dispatch():
+    """Starts as many queued downloads as concurrency limits allow,
+    highest priority first. See 'dtask_repository.claim_for_dispatch'
+
+    Priorities are read from database when dispatching, so reordering
+    queued tasks does not require to enqueue them again.
+    """
+    try:
+        with huey.lock_task('dispatch'):
+            dtask_ids = dtask_repo.claim_for_dispatch(
+                dconfig.max_concurrent_downloads(),
+                dconfig.max_downloads_per_host()
+            )
+    except TaskLockedException:
+        # Another dispatch is running, retry once it is done
+        dispatch.schedule(delay=1)
+        return
+
+    for dtask_id in dtask_ids:
+        download(dtask_id)
+
 
+@huey.periodic_task(crontab(minute='*'))
+def periodic_dispatch():
+    dispatch()
 
-_db_path = get_db_path()
-logger.info('Huey database: %s', _db_path)
-huey = SqliteHuey(_db_path)
+
+@huey.periodic_task(crontab(minute='*'))
+def periodic_recovery():
+    recover_abandoned_tasks()
+    recover_post_processing()
+
+
+@huey.task()
+def post_process(dtask_id: int):
+    """Hands pipeline of a task completed outside of workers (e.g. from
+    a duplicate) over to post-processing pool of worker
+    """
+    postprocess.start(dtask_repo.find_by_id(dtask_id))
 
 
 @huey.task()
 def download(dtask_id: int):
     dtask = dtask_repo.find_by_id(dtask_id)
+    if dtask is None:
+        return
+
+    if not leases.keeper.acquire(dtask_id):
+        logger.warning('Task %s is already being downloaded', dtask_id)
+        _postpone(dtask_id)
+        return
+
+    if not leases.target_locks.acquire(dtask_id, dtask.target_path):
+        logger.warning(
+            'Target of task %s is being written by another worker',
+            dtask_id
+        )
+        leases.keeper.release(dtask_id)
+        _postpone(dtask_id)
+        return
+
+    if dtask.status == DownloadStatus.QUEUED and dtask.queued_at:
+        metrics.queue_wait_seconds.observe(time.time() - dtask.queued_at)
+
+    check_interval = dconfig.status_check_interval()
+    last_check = time.monotonic()
 
     def _reload_status():
-        db_task = dtask_repo.find_by_id(dtask_id)
-        dtask.status = db_task.status
+        """Applies commands pushed through control channel. Database
+        is only checked from time to time, as a fallback for commands
+        that could not be delivered, bandwidth limits included
+        """
+        nonlocal last_check
+        command = control.registry.pop(dtask_id)
 
-    downloader.download(
-        dtask,
-        on_update=lambda: dtask_repo.save(dtask),
-        reload_status=_reload_status
-    )
+        if command is None and check_interval:
+            if time.monotonic() - last_check >= check_interval:
+                last_check = time.monotonic()
+                db_task = dtask_repo.find_by_id(dtask_id)
+                if db_task is None:
+                    command = ControlCommand.CANCEL
+                elif db_task.status == DownloadStatus.PAUSED:
+                    command = ControlCommand.PAUSE
+                elif db_task.max_rate != dtask.max_rate:
+                    dtask.max_rate = db_task.max_rate
+                    bandwidth.governor.set_task_rate(
+                        dtask_id,
+                        db_task.max_rate
+                    )
+                _refresh_bandwidth()
+
+        if command == ControlCommand.PAUSE:
+            dtask.status = DownloadStatus.PAUSED
+        elif command == ControlCommand.CANCEL:
+            dtask.status = DownloadStatus.FAILED
+            dtask.err_message = 'Download was cancelled'
+
+    def _on_update():
+        progress_reporter.update(dtask)
+
+    # Released here unless the shared event loop took the download over
+    handed_over = False
+    try:
+        # Fastest consistent mirror is picked before starting
+        sources = None
+        if dtask.status == DownloadStatus.QUEUED:
+            sources = mirrors.select(dtask)
+
+        # Hand transfer over to shared event loop and release huey worker
+        if dconfig.download_engine() == 'asyncio':
+            future = aio_downloader.engine.submit(
+                dtask,
+                on_update=_on_update,
+                reload_status=_reload_status,
+                sources=sources
+            )
+            handed_over = True
+            future.add_done_callback(
+                lambda f: _on_aio_download_done(dtask, f)
+            )
+            return
+
+        downloader.download(
+            dtask,
+            on_update=_on_update,
+            reload_status=_reload_status,
+            sources=sources
+        )
+    finally:
+        if not handed_over:
+            _release(dtask)
+
+
+def _postpone(dtask_id: int):
+    """Frees slot claimed by a task whose download could not start, it
+    is dispatched again later (if still queued)
+    """
+    dtask_repo.release_dispatch(dtask_id)
+    dispatch.schedule(delay=BUSY_DISPATCH_DELAY)
+
+
+def _on_aio_download_done(dtask: DownloadTask, future):
+    _release(dtask)
+
+    if future.exception():
+        logger.error(
+            'Download of task %s failed: %s',
+            dtask.id,
+            future.exception()
+        )
+
+
+def _release(dtask: DownloadTask):
+    """Drops worker state kept for given task once its download stops
+    and fills the freed download slot.
+
+    Hash state of paused tasks is kept, so they can be resumed without
+    re-reading downloaded bytes
+    """
+    control.registry.discard(dtask.id)
+    leases.target_locks.release(dtask.id)
+    leases.keeper.release(dtask.id)
+
+    if dtask.status != DownloadStatus.PAUSED:
+        hashing.discard_checkpoint(dtask.id)
+
+    # Tasks attached to this one are completed or downloaded on their own
+    dedup.on_finished(dtask)
+
+    # Runs in its own pool, download slot is filled right away
+    if dtask.status == DownloadStatus.COMPLETED:
+        postprocess.start(dtask)
+
+    # Failed attempt is dispatched again once its retry delay is over,
+    # periodic dispatch picks it up if this schedule is lost
+    if dtask.status == DownloadStatus.QUEUED and dtask.retry_at:
+        dispatch.schedule(delay=max(dtask.retry_at - time.time(), 0))
+
+    dispatch()
@@ -0,0 +1,185 @@
+"""
+Bandwidth limiting of running downloads.
+
+Every running task gets a token bucket whose rate is its share of the
+global limit (max-min fair sharing: tasks with a lower own limit keep
+it and leftover bandwidth is split evenly among the others). Limits
+can be changed at any time, rates are rebalanced immediately.
+
+Global limit is shared by every worker process (and node) using the
+tasks database: governor state is per process, and each process takes
+a share of global limit proportional to the downloads it runs out of
+all downloads in progress, see 'BandwidthGovernor.set_running_total'.
+Workers refresh that count, and limits stored in database, on their
+periodic status check (see 'config_loader.status_check_interval'), so
+shares and limits changed on other nodes are applied within a check.
+"""
+import threading
+import time
+
+
+# Setting holding global limit, in bytes per second (0 for no limit)
+GLOBAL_RATE_SETTING = 'global_max_rate'
+
+# Seconds of traffic a throttled task reads at once, so it waits for
+# short periods and keeps checking control commands between reads
+THROTTLE_SLICE = 0.1
+
+
+class TokenBucket:
+    """Token bucket allowing bursts of up to one second of traffic.
+    Consumers reserve tokens upfront and wait for the deficit, so
+    concurrent consumers are served in arrival order.
+    """
+
+    def __init__(self, rate: float) -> None:
+        self._lock = threading.Lock()
+        self.rate = rate
+        self._tokens = rate
+        self._updated_at = time.monotonic()
+
+    def set_rate(self, rate: float) -> None:
+        with self._lock:
+            self._refill()
+            self.rate = rate
+            self._tokens = min(self._tokens, rate)
+
+    def reserve(self, amount: int) -> float:
+        """Takes 'amount' tokens from bucket
+
+        Returns:
+            float: Seconds to wait before using reserved tokens,
+                0 if bucket is unlimited
+        """
+        with self._lock:
+            if not self.rate:
+                return 0
+
+            self._refill()
+            self._tokens -= amount
+            if self._tokens >= 0:
+                return 0
+
+            return -self._tokens / self.rate
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        if self.rate:
+            elapsed = now - self._updated_at
+            self._tokens = min(self.rate, self._tokens + elapsed * self.rate)
+        self._updated_at = now
+
+
+class BandwidthGovernor:
+
+    def __init__(self, global_rate: int = 0) -> None:
+        self._lock = threading.Lock()
+        self.global_rate = global_rate
+        self._running_total = 0
+        self._task_limits: dict[int, int] = {}
+        self._buckets: dict[int, TokenBucket] = {}
+
+    def register(self, dtask_id: int, max_rate: int = 0) -> None:
+        """Starts governing the traffic of given task
+
+        Args:
+            dtask_id (int): Running task
+            max_rate (int): Own limit of task in bytes per second,
+                0 means no limit other than its global share
+        """
+        with self._lock:
+            self._task_limits[dtask_id] = max_rate or 0
+            self._buckets.setdefault(dtask_id, TokenBucket(0))
+            self._rebalance()
+
+    def unregister(self, dtask_id: int) -> None:
+        with self._lock:
+            self._task_limits.pop(dtask_id, None)
+            self._buckets.pop(dtask_id, None)
+            self._rebalance()
+
+    def set_global_rate(self, rate: int) -> None:
+        with self._lock:
+            self.global_rate = rate or 0
+            self._rebalance()
+
+    def set_running_total(self, running: int) -> None:
+        """Sets number of downloads in progress across all workers,
+        current process gets a proportional share of global limit
+        """
+        with self._lock:
+            self._running_total = running or 0
+            self._rebalance()
+
+    def set_task_rate(self, dtask_id: int, rate: int) -> None:
+        with self._lock:
+            if dtask_id in self._task_limits:
+                self._task_limits[dtask_id] = rate or 0
+                self._rebalance()
+
+    def rate_of(self, dtask_id: int) -> float:
+        """Current allowed rate of given task, 0 means unlimited"""
+        with self._lock:
+            bucket = self._buckets.get(dtask_id)
+            return bucket.rate if bucket else 0
+
+    def read_size(self, dtask_id: int, max_size: int) -> int:
+        """Max bytes given task should read at once: 'THROTTLE_SLICE'
+        seconds of its allowed rate, or 'max_size' if it is unlimited
+        """
+        rate = self.rate_of(dtask_id)
+        if not rate:
+            return max_size
+        return max(min(int(rate * THROTTLE_SLICE), max_size), 1)
+
+    def delay(self, dtask_id: int, amount: int) -> float:
+        """Accounts 'amount' bytes received by given task
+
+        Returns:
+            float: Seconds task must wait before receiving more bytes
+        """
+        with self._lock:
+            bucket = self._buckets.get(dtask_id)
+
+        return bucket.reserve(amount) if bucket else 0
+
+    def throttle(self, dtask_id: int, amount: int) -> None:
+        """Blocking version of 'delay'"""
+        wait = self.delay(dtask_id, amount)
+        if wait > 0:
+            time.sleep(wait)
+
+    def _rebalance(self) -> None:
+        # Unlimited tasks sort last, so capped ones take their share first
+        limits = sorted(
+            self._task_limits.items(),
+            key=lambda item: item[1] or float('inf')
+        )
+
+        # Downloads of this process may not be counted in total yet
+        budget = self.global_rate * len(limits) \
+            / max(self._running_total, len(limits), 1)
+
+        remaining = budget
+        for idx, (dtask_id, limit) in enumerate(limits):
+            if self.global_rate:
+                share = remaining / (len(limits) - idx)
+                rate = min(limit, share) if limit else share
+                remaining -= rate
+            else:
+                rate = limit
+
+            self._buckets[dtask_id].set_rate(rate)
+
+
+governor = BandwidthGovernor()
+
+
+def apply_limit(dtask_id: int, rate: int) -> None:
+    """Applies a limit received through control channel, task id 0
+    stands for global limit
+    """
+    if dtask_id:
+        governor.set_task_rate(dtask_id, int(rate or 0))
+    else:
+        governor.set_global_rate(int(rate or 0))
@@ -0,0 +1,107 @@
+"""
+In memory caching helpers
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable
+from urllib.parse import urlsplit, urlunsplit
+
+
+class _InFlight:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.value = None
+        self.error: Exception = None
+
+
+class TTLCache:
+    """Thread safe LRU cache whose entries expire 'ttl' seconds after
+    being stored. Concurrent loads of the same missing key are collapsed
+    into a single call to loader, see 'get_or_load'
+    """
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[Any, tuple[float, Any]] = OrderedDict()
+        self._in_flight: dict[Any, _InFlight] = {}
+
+    def get(self, key) -> Any:
+        """Returns cached value of key, None if missing or expired"""
+        with self._lock:
+            return self._get_locked(key)
+
+    def put(self, key, value) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def get_or_load(self, key, loader: Callable[[], Any]) -> Any:
+        """Returns cached value of key, loading it if missing. If key
+        is already being loaded by another thread, waits for it instead
+        of calling loader again. Loader errors are raised to every
+        waiting caller and are not cached.
+        """
+        with self._lock:
+            value = self._get_locked(key)
+            if value is not None:
+                return value
+
+            in_flight = self._in_flight.get(key)
+            owner = in_flight is None
+            if owner:
+                in_flight = _InFlight()
+                self._in_flight[key] = in_flight
+
+        if not owner:
+            in_flight.done.wait()
+            if in_flight.error:
+                raise in_flight.error
+            return in_flight.value
+
+        try:
+            in_flight.value = loader()
+            self.put(key, in_flight.value)
+            return in_flight.value
+        except Exception as err:
+            in_flight.error = err
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            in_flight.done.set()
+
+    def _get_locked(self, key) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return value
+
+
+def normalize_url(url: str) -> str:
+    """Normalizes given url so equivalent urls share cache entries:
+    scheme and host are lower cased, default ports and fragments
+    are removed
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+
+    default_port = {'http': ':80', 'https': ':443'}.get(scheme)
+    if default_port and netloc.endswith(default_port):
+        netloc = netloc[:-len(default_port)]
+
+    return urlunsplit((scheme, netloc, parts.path or '/', parts.query, ''))
@@ -1,7 +1,10 @@
 """
 Utilities to read and process env config
 """
+import json
 import os
+import socket
+import tempfile
 from dotenv import load_dotenv
 
 
@@ -13,3 +16,252 @@ def get_db_path():
 
 def downloads_dir():
     return os.getenv('DOWNLOADS_PATH')
+
+def db_journal_mode():
+    return os.getenv('DB_JOURNAL_MODE', 'WAL')
+
+def db_synchronous():
+    return os.getenv('DB_SYNCHRONOUS', 'NORMAL')
+
+def db_busy_timeout():
+    """Milliseconds to wait for a database lock before failing
+    """
+    return int(os.getenv('DB_BUSY_TIMEOUT', '5000'))
+
+def download_segments():
+    """Max number of parallel byte ranges used to fetch a single file
+    when origin server supports 'Range' requests
+    """
+    return int(os.getenv('DOWNLOAD_SEGMENTS', '4'))
+
+def min_segment_size():
+    """Files smaller than 'download_segments() * min_segment_size()'
+    are downloaded through a single stream
+    """
+    return int(os.getenv('MIN_SEGMENT_SIZE', str(1024 * 1024 * 16)))
+
+def progress_flush_interval():
+    """Max seconds download progress can stay in memory before
+    being written into database
+    """
+    return float(os.getenv('PROGRESS_FLUSH_INTERVAL', '2'))
+
+def progress_flush_bytes():
+    """Max downloaded bytes (across all tasks) that can be reported
+    before progress is written into database
+    """
+    return int(os.getenv('PROGRESS_FLUSH_BYTES', str(1024 * 1024 * 64)))
+
+def control_socket_dir():
+    """Directory holding the unix sockets of workers listening for
+    control commands (pause, cancel, resume)
+    """
+    return os.getenv(
+        'CONTROL_SOCKET_DIR',
+        os.path.join(tempfile.gettempdir(), 'ddownloader-control')
+    )
+
+def metrics_dir():
+    """Directory where every process writes snapshots of its
+    metrics, merged when serving '/metrics'
+    """
+    return os.getenv(
+        'METRICS_DIR',
+        os.path.join(tempfile.gettempdir(), 'ddownloader-metrics')
+    )
+
+def metrics_flush_interval():
+    """Seconds between snapshots of process metrics"""
+    return float(os.getenv('METRICS_FLUSH_INTERVAL', '5'))
+
+def status_check_interval():
+    """Seconds between database status checks of a running download,
+    fallback for control commands that could not be delivered.
+    Use 0 to disable it
+    """
+    return float(os.getenv('STATUS_CHECK_INTERVAL', '30'))
+
+def progress_stream_interval():
+    """Seconds between database polls of the progress events stream
+    """
+    return float(os.getenv('PROGRESS_STREAM_INTERVAL', '1'))
+
+def download_engine():
+    """Engine used by workers to run downloads:
+        'threads': One blocking download per huey worker
+        'asyncio': Downloads are handed over to a shared event loop,
+            see 'aio_downloader'
+    """
+    return os.getenv('DOWNLOAD_ENGINE', 'threads')
+
+def async_max_concurrency():
+    """Max concurrent transfers driven by the asyncio engine of a
+    worker process
+    """
+    return int(os.getenv('ASYNC_MAX_CONCURRENCY', '200'))
+
+def http_pool_hosts():
+    """Number of hosts whose connection pools are kept by the shared
+    http session
+    """
+    return int(os.getenv('HTTP_POOL_HOSTS', '10'))
+
+def http_pool_size():
+    """Max keep-alive connections kept per host"""
+    return int(os.getenv('HTTP_POOL_SIZE', '16'))
+
+def http_max_idle():
+    """Seconds an unused http session keeps its connections open"""
+    return float(os.getenv('HTTP_MAX_IDLE', '60'))
+
+def preallocate_files():
+    """Reserve whole target file size on disk before downloading when
+    total size is known
+    """
+    return os.getenv('PREALLOCATE_FILES', 'false').lower() == 'true'
+
+def max_download_rate():
+    """Default global bandwidth limit in bytes per second, 0 for no
+    limit. Once limit is changed through api, stored value is used
+    """
+    return int(os.getenv('MAX_DOWNLOAD_RATE', '0'))
+
+def max_concurrent_downloads():
+    """Max downloads running at the same time across all workers"""
+    return int(os.getenv('MAX_CONCURRENT_DOWNLOADS', '4'))
+
+def max_downloads_per_host():
+    """Max downloads running at the same time from a single host"""
+    return int(os.getenv('MAX_DOWNLOADS_PER_HOST', '2'))
+
+def metadata_cache_size():
+    """Max number of urls whose metadata is kept in memory"""
+    return int(os.getenv('METADATA_CACHE_SIZE', '1024'))
+
+def metadata_cache_ttl():
+    """Seconds url metadata is kept in memory"""
+    return float(os.getenv('METADATA_CACHE_TTL', '300'))
+
+def receive_buffer_size():
+    """Size in bytes of buffers used to receive downloads, also the
+    max size of a single read
+    """
+    return int(os.getenv('RECEIVE_BUFFER_SIZE', str(1024 * 1024 * 4)))
+
+def receive_buffers():
+    """Max number of receive buffers per process. Streams beyond this
+    number wait for a buffer to be released
+    """
+    return int(os.getenv('RECEIVE_BUFFERS', '16'))
+
+def receive_min_chunk():
+    """Size in bytes of first (and smallest) reads of a stream"""
+    return int(os.getenv('RECEIVE_MIN_CHUNK', str(1024 * 64)))
+
+def lease_ttl():
+    """Seconds a worker lease on a running task lasts without being
+    renewed. Tasks whose lease expired are put back in queue
+    """
+    return float(os.getenv('LEASE_TTL', '60'))
+
+def queue_backend():
+    """Storage of huey task queue, kept apart from tasks database:
+        'sqlite': A sqlite file, see 'queue_db_path'
+        'redis': A Redis (compatible) server shared by all worker
+            nodes, see 'queue_url'
+    """
+    return os.getenv('QUEUE_BACKEND', 'sqlite')
+
+def queue_db_path():
+    """Sqlite file of huey task queue, next to tasks database by
+    default (e.g. 'ddownloader.db' -> 'ddownloader.queue.db'). None if
+    neither of them is configured
+    """
+    default_path = None
+    if get_db_path():
+        root, ext = os.path.splitext(get_db_path())
+        default_path = f'{root}.queue{ext or ".db"}'
+
+    return os.getenv('QUEUE_DB_PATH', default_path)
+
+def queue_url():
+    """Url of Redis server holding huey task queue"""
+    return os.getenv('QUEUE_URL', 'redis://localhost:6379/0')
+
+def queue_name():
+    """Name of huey task queue, workers sharing a queue backend must
+    use the same name
+    """
+    return os.getenv('QUEUE_NAME', 'ddownloader')
+
+def worker_id():
+    """Identifies worker node in task leases, must be unique among
+    nodes sharing tasks database. Host name by default
+    """
+    return os.getenv('WORKER_ID') or socket.gethostname()
+
+def post_process_workers():
+    """Threads per worker process running post-processing stages of
+    completed downloads, apart from download workers
+    """
+    return int(os.getenv('POST_PROCESS_WORKERS', '2'))
+
+def default_post_process():
+    """Post-processing stages of tasks created without them, as a JSON
+    list e.g. '[{"stage": "verify"}]'. See 'postprocess' module
+    """
+    return json.loads(os.getenv('POST_PROCESS', '[]'))
+
+def notify_timeout():
+    """Seconds to wait for webhooks called by 'notify' stage"""
+    return float(os.getenv('NOTIFY_TIMEOUT', '10'))
+
+def retry_max_attempts():
+    """Consecutive attempts of a download failing with transient errors
+    before it is failed. Attempts that downloaded some bytes start the
+    count again. 1 disables retries
+    """
+    return max(int(os.getenv('RETRY_MAX_ATTEMPTS', '5')), 1)
+
+def retry_base_delay():
+    """Seconds to wait before first retry, doubled on every next one"""
+    return float(os.getenv('RETRY_BASE_DELAY', '2'))
+
+def retry_max_delay():
+    """Max seconds to wait before a retry"""
+    return float(os.getenv('RETRY_MAX_DELAY', '300'))
+
+def retry_statuses():
+    """Http statuses of transient server errors, which are retried"""
+    statuses = os.getenv('RETRY_STATUSES', '408,425,429,500,502,503,504')
+    return {int(status) for status in statuses.split(',') if status.strip()}
+
+def mirror_probe_bytes():
+    """Bytes fetched from every mirror to measure its throughput"""
+    return int(os.getenv('MIRROR_PROBE_BYTES', str(256 * 1024)))
+
+def mirror_probe_timeout():
+    """Seconds to wait for a mirror probe"""
+    return float(os.getenv('MIRROR_PROBE_TIMEOUT', '5'))
+
+def mirror_stall_timeout():
+    """Seconds without receiving bytes after which a mirror is left
+    for next one
+    """
+    return float(os.getenv('MIRROR_STALL_TIMEOUT', '15'))
+
+def mirror_check_interval():
+    """Seconds spent receiving from a mirror between two checks of its
+    throughput
+    """
+    return float(os.getenv('MIRROR_CHECK_INTERVAL', '10'))
+
+def mirror_min_rate():
+    """Bytes per second below which a mirror is left for next one"""
+    return int(os.getenv('MIRROR_MIN_RATE', '0'))
+
+def mirror_switch_ratio():
+    """A mirror is left for next one once its throughput drops below
+    this fraction of the throughput measured when probing next one
+    """
+    return float(os.getenv('MIRROR_SWITCH_RATIO', '0.25'))
@@ -0,0 +1,171 @@
+"""
+Out of band control channel used to push pause/cancel/resume commands
+from api process to the workers running download tasks.
+
+Every worker process listens on its own unix datagram socket inside
+'config_loader.control_socket_dir()', commands are broadcasted to all
+the sockets in that directory and stored into the process local
+'registry', where running downloads look for them after every chunk.
+
+Commands carrying a value (e.g. bandwidth limits) are not stored, they
+are delivered to the handler registered through 'register_handler'.
+"""
+import json
+import os
+import socket
+import threading
+from enum import Enum
+from typing import Callable
+
+from ddownloader import config_loader as dconfig
+from ddownloader.log_utils import logger
+
+
+class ControlCommand(Enum):
+    PAUSE = 'pause'
+    RESUME = 'resume'
+    CANCEL = 'cancel'
+
+    # Bandwidth limit of a task, or global one if task id is 0
+    LIMIT_RATE = 'limit_rate'
+
+
+class ControlRegistry:
+    """Thread safe, in process store of the last command received
+    for every download task
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._commands: dict[int, ControlCommand] = {}
+
+    def push(self, dtask_id: int, command: ControlCommand) -> None:
+        with self._lock:
+            if command == ControlCommand.RESUME:
+                # Task was resumed before a worker noticed the pause
+                self._commands.pop(dtask_id, None)
+            else:
+                self._commands[dtask_id] = command
+
+    def pop(self, dtask_id: int) -> ControlCommand:
+        """Removes and returns pending command for given task or
+        None if there is no pending command
+        """
+        with self._lock:
+            return self._commands.pop(dtask_id, None)
+
+    def discard(self, dtask_id: int) -> None:
+        with self._lock:
+            self._commands.pop(dtask_id, None)
+
+
+registry = ControlRegistry()
+
+_handlers: dict[ControlCommand, Callable[[int, object], None]] = {}
+
+_listener: threading.Thread = None
+_listener_pid: int = None
+_listener_lock = threading.Lock()
+
+
+def register_handler(
+    command: ControlCommand,
+    handler: Callable[[int, object], None]
+) -> None:
+    """Sets the function invoked with task id and value of every
+    received command of given type, instead of storing it in registry
+    """
+    _handlers[command] = handler
+
+
+def send(dtask_id: int, command: ControlCommand, value=None) -> None:
+    """Broadcasts given command to every listening worker process,
+    including current one.
+    """
+    _dispatch(dtask_id, command, value)
+
+    sock_dir = dconfig.control_socket_dir()
+    if not os.path.isdir(sock_dir):
+        return
+
+    message = json.dumps({
+        'dtask_id': dtask_id,
+        'command': command.value,
+        'value': value
+    }).encode()
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+        for name in os.listdir(sock_dir):
+            path = os.path.join(sock_dir, name)
+            if path == _socket_path():
+                continue
+
+            try:
+                sock.sendto(message, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Listener process is gone, remove its stale socket
+                _remove_socket(path)
+            except OSError as err:
+                logger.warning('Unable to send control command: %s', err)
+
+
+def start_listener() -> None:
+    """Starts the background thread receiving commands for current
+    process. Safe to call several times, only one listener is started
+    per process.
+    """
+    global _listener, _listener_pid
+
+    with _listener_lock:
+        if _listener_pid == os.getpid() and _listener.is_alive():
+            return
+
+        os.makedirs(dconfig.control_socket_dir(), exist_ok=True)
+        path = _socket_path()
+        _remove_socket(path)
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(path)
+
+        _listener = threading.Thread(
+            target=_listen,
+            args=(sock,),
+            name='ddownloader-control',
+            daemon=True
+        )
+        _listener_pid = os.getpid()
+        _listener.start()
+        logger.info('Listening for control commands on: %s', path)
+
+
+def _listen(sock: socket.socket) -> None:
+    while True:
+        data = sock.recv(4096)
+        try:
+            message = json.loads(data)
+            _dispatch(
+                int(message['dtask_id']),
+                ControlCommand(message['command']),
+                message.get('value')
+            )
+        except (ValueError, KeyError, TypeError) as err:
+            logger.warning('Invalid control command received: %s', err)
+
+
+def _dispatch(dtask_id: int, command: ControlCommand, value) -> None:
+    handler = _handlers.get(command)
+    if handler:
+        handler(dtask_id, value)
+    else:
+        registry.push(dtask_id, command)
+
+
+def _socket_path() -> str:
+    return os.path.join(dconfig.control_socket_dir(), f'{os.getpid()}.sock')
+
+
+def _remove_socket(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
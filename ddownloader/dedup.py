@@ -0,0 +1,274 @@
+"""
+Content addressed deduplication of downloads.
+
+New tasks are matched against existing ones by 'file_hash' when given,
+otherwise by normalized url (plus ETag or Content-Length for completed
+files, as content behind an url may change):
+
+* If a completed task matches, its file is cloned into the new target
+  and the new task is completed right away, see 'link_file'
+* If a queued or running task matches, the new task is attached to it
+  and is not dispatched; it is completed from the same file once its
+  source completes, or detached and downloaded on its own if source
+  fails or is removed
+"""
+import fcntl
+import os
+import shutil
+from collections import defaultdict
+
+import ddownloader.dtask_repository as dtask_repo
+from ddownloader import hashing, postprocess
+from ddownloader.cache import normalize_url
+from ddownloader.downloader import DownloadStatus, DownloadTask, UrlMetadata
+from ddownloader.log_utils import logger
+
+
+IN_FLIGHT = [DownloadStatus.QUEUED, DownloadStatus.IN_PROGRESS]
+
+# Linux ioctl sharing extents of a file with another one (reflink)
+FICLONE = 0x40049409
+
+
+def content_key(url: str, url_meta: UrlMetadata) -> str:
+    """Identifies content served at given url by its ETag, or its size
+    if there is no ETag. None if there is no metadata to rely on
+    """
+    if url_meta is None:
+        return None
+
+    if url_meta.etag:
+        validator = f'etag:{url_meta.etag}'
+    elif url_meta.content_length:
+        validator = f'length:{url_meta.content_length}'
+    else:
+        return None
+
+    return f'{normalize_url(url)}#{validator}'
+
+
+def find_completed(dtask: DownloadTask) -> DownloadTask:
+    """Returns a completed task with same content than given one whose
+    file is still on disk, None if there is no such task
+    """
+    hash_key = hashing.hash_key(dtask.file_hash)
+    if hash_key:
+        candidates = dtask_repo.find_by_key(
+            'hash_key',
+            hash_key,
+            [DownloadStatus.COMPLETED]
+        )
+    elif dtask.content_key:
+        candidates = dtask_repo.find_by_key(
+            'content_key',
+            dtask.content_key,
+            [DownloadStatus.COMPLETED]
+        )
+    else:
+        return None
+
+    for candidate in candidates:
+        if _file_intact(candidate):
+            return candidate
+
+    return None
+
+
+def _file_intact(dtask: DownloadTask) -> bool:
+    """Whether file of given completed task is still on disk"""
+    try:
+        return os.path.getsize(dtask.target_path) == dtask.total_size
+    except OSError:
+        return False
+
+
+def find_in_flight(dtask: DownloadTask) -> DownloadTask:
+    """Returns a queued or running task fetching same content than
+    given one, None if there is no such task
+    """
+    hash_key = hashing.hash_key(dtask.file_hash)
+    if hash_key:
+        candidates = dtask_repo.find_by_key('hash_key', hash_key, IN_FLIGHT, 1)
+    else:
+        candidates = dtask_repo.find_by_key(
+            'url_key',
+            normalize_url(dtask.url),
+            IN_FLIGHT,
+            1
+        )
+
+    return candidates[0] if candidates else None
+
+
+def resolve(dtask: DownloadTask) -> DownloadTask:
+    """Looks for an existing task with same content than given (new,
+    not yet saved) one. Given task is completed from a matching
+    completed task or attached to a matching in flight task.
+
+    Returns:
+        DownloadTask: Matching task, None if there was no match
+    """
+    source = find_completed(dtask)
+    if source and complete_from(dtask, source):
+        return source
+
+    source = find_in_flight(dtask)
+    if source:
+        dtask.attached_to = source.id
+        return source
+
+    return None
+
+
+def resolve_many(dtasks: list[DownloadTask]) -> list[DownloadTask]:
+    """Same as 'resolve' for a batch of new tasks. Existing tasks
+    matching any of them are looked up with a single query
+
+    Returns:
+        list[DownloadTask]: Matching task of each given one, None for
+            the ones without a match
+    """
+    if not dtasks:
+        return []
+
+    keys = {'hash_key': set(), 'content_key': set(), 'url_key': set()}
+    for dtask in dtasks:
+        hash_key = hashing.hash_key(dtask.file_hash)
+        if hash_key:
+            keys['hash_key'].add(hash_key)
+        else:
+            keys['url_key'].add(normalize_url(dtask.url))
+            if dtask.content_key:
+                keys['content_key'].add(dtask.content_key)
+
+    candidates = defaultdict(list)
+    for candidate in dtask_repo.find_by_keys(
+        keys,
+        [DownloadStatus.COMPLETED] + IN_FLIGHT
+    ):
+        for key in _keys_of(candidate):
+            candidates[key].append(candidate)
+
+    return [_resolve_among(dtask, candidates) for dtask in dtasks]
+
+
+def _keys_of(dtask: DownloadTask) -> list[tuple[str, str]]:
+    """Dedup keys of given task, as (key column, key) pairs"""
+    keys = [
+        ('hash_key', hashing.hash_key(dtask.file_hash)),
+        ('content_key', dtask.content_key),
+        ('url_key', normalize_url(dtask.url))
+    ]
+    return [(column, key) for column, key in keys if key]
+
+
+def _resolve_among(
+    dtask: DownloadTask,
+    candidates: dict[tuple[str, str], list[DownloadTask]]
+) -> DownloadTask:
+    """Resolves given task against candidates grouped by dedup key,
+    applying same rules than 'find_completed' and 'find_in_flight'
+    """
+    hash_key = hashing.hash_key(dtask.file_hash)
+    if hash_key:
+        completed_key = in_flight_key = ('hash_key', hash_key)
+    else:
+        completed_key = ('content_key', dtask.content_key)
+        in_flight_key = ('url_key', normalize_url(dtask.url))
+
+    completed = [
+        candidate for candidate in candidates.get(completed_key, [])
+        if candidate.status == DownloadStatus.COMPLETED
+    ]
+    source = next(
+        (candidate for candidate in completed if _file_intact(candidate)),
+        None
+    )
+    if source and complete_from(dtask, source):
+        return source
+
+    source = next((
+        candidate for candidate in candidates.get(in_flight_key, [])
+        if candidate.status in IN_FLIGHT
+    ), None)
+    if source:
+        dtask.attached_to = source.id
+        return source
+
+    return None
+
+
+def complete_from(dtask: DownloadTask, source: DownloadTask) -> bool:
+    """Completes given task with file of (completed) source task
+
+    Returns:
+        bool: False if file could not be linked nor copied
+    """
+    try:
+        link_file(source.target_path, dtask.target_path)
+    except OSError as err:
+        logger.warning(
+            'Unable to reuse file of task %s: %s',
+            source.id,
+            err
+        )
+        return False
+
+    dtask.total_size = source.total_size
+    dtask.downloaded_size = source.total_size
+    dtask.status = DownloadStatus.COMPLETED
+    return True
+
+
+def on_finished(source: DownloadTask) -> None:
+    """Completes tasks attached to given one if it completed, or lets
+    them be downloaded on their own if it failed or was removed.
+    Tasks attached to paused sources keep waiting.
+    """
+    if source.status not in [DownloadStatus.COMPLETED, DownloadStatus.FAILED]:
+        return
+
+    followers = dtask_repo.find_followers(source.id)
+    if not followers:
+        return
+
+    if source.status == DownloadStatus.COMPLETED:
+        for follower in followers:
+            if complete_from(follower, source):
+                dtask_repo.save(follower)
+                postprocess.start(follower)
+
+    dtask_repo.detach_followers(source.id)
+
+
+def link_file(source_path: str, target_path: str) -> None:
+    """Makes target path hold same content than source path, without
+    copying data when possible: file is reflinked (copy on write) if
+    file system supports it, copied otherwise.
+
+    Files are never hardlinked, as a source downloaded again (e.g.
+    restarted, or resumed over a truncated file) would change every
+    task sharing its file.
+    """
+    os.makedirs(os.path.dirname(target_path) or '.', exist_ok=True)
+
+    if _reflink(source_path, target_path):
+        return
+
+    shutil.copyfile(source_path, target_path)
+
+
+def _reflink(source_path: str, target_path: str) -> bool:
+    try:
+        with open(source_path, 'rb') as source, \
+                open(target_path, 'xb') as target:
+            try:
+                fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+                return True
+            except OSError:
+                pass
+    except OSError:
+        return False
+
+    os.remove(target_path)
+    return False
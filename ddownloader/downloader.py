@@ -1,12 +1,35 @@
 import os
+import threading
+import time
 import uuid
-from dataclasses import dataclass
+from contextlib import nullcontext
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from dataclasses import dataclass, replace
 from enum import Enum
+from functools import partial
 from typing import Callable
+from urllib.parse import urlparse
 
 import requests
 from requests.exceptions import RequestException
-from ddownloader.errors import MetadataReqError
+from ddownloader import config_loader as dconfig
+from ddownloader import (
+    archives,
+    bandwidth,
+    hashing,
+    http_session,
+    metrics,
+    receive,
+    retry,
+    storage
+)
+from ddownloader.cache import TTLCache, normalize_url
+from ddownloader.errors import (
+    MetadataReqError,
+    RangeNotSatisfiedError,
+    ShortReadError
+)
+from ddownloader.log_utils import logger
 
 
 class DownloadStatus(Enum):
@@ -17,6 +40,15 @@ class DownloadStatus(Enum):
     COMPLETED = "Completed"
     FAILED = "Failed"
 
+class PostProcessStatus(Enum):
+    """Status of post-processing pipeline of a task and of each one of
+    its stages, see 'postprocess' module
+    """
+    PENDING = "Pending"
+    RUNNING = "Running"
+    DONE = "Done"
+    FAILED = "Failed"
+
 @dataclass
 class DownloadTask:
     url: str
@@ -28,6 +60,54 @@ class DownloadTask:
     status: DownloadStatus = DownloadStatus.QUEUED
     file_hash: str = None
     err_message: str = None
+    max_rate: int = 0
+    priority: int = 0
+    queued_at: float = None
+
+    # Deduplication, see 'dedup' module
+    attached_to: int = None
+    content_key: str = None
+
+    # Validators of downloaded content, sent as 'If-Range' on resume
+    etag: str = None
+    last_modified: str = None
+
+    # Stages run once download completes, see 'postprocess' module
+    post_process: list[dict] = None
+    post_status: PostProcessStatus = None
+
+    # Archive extracted into this directory while downloading, see
+    # 'archives' module. Archive is removed once extracted unless kept
+    extract_to: str = None
+    keep_archive: bool = True
+
+    # Automatic retries, see 'retry' module. 'retries' counts failed
+    # attempts in a row, 'attempts' keeps history of failed ones
+    retries: int = 0
+    retry_at: float = None
+    attempts: list[dict] = None
+
+    # Other urls serving same file, and url currently downloaded from,
+    # see 'mirrors' module
+    mirrors: list[str] = None
+    source: str = None
+
+    @property
+    def source_url(self) -> str:
+        return self.source or self.url
+
+    @property
+    def if_range(self) -> str:
+        """Validator to send in 'If-Range' header, weak ETags can not
+        be used for ranges
+        """
+        if self.etag and not self.etag.startswith('W/'):
+            return self.etag
+        return self.last_modified
+
+    @property
+    def host(self) -> str:
+        return urlparse(self.url).hostname or ''
 
     def to_dict(self) -> dict:
         return {
@@ -38,7 +118,19 @@ class DownloadTask:
             'downloaded_size': self.downloaded_size,
             'status': self.status.value,
             'file_hash': self.file_hash,
-            'err_message': self.err_message
+            'err_message': self.err_message,
+            'max_rate': self.max_rate,
+            'priority': self.priority,
+            'attached_to': self.attached_to,
+            'post_status': self.post_status.value if self.post_status else None,
+            'post_process': self.post_process,
+            'extract_to': self.extract_to,
+            'keep_archive': self.keep_archive,
+            'retries': self.retries,
+            'retry_at': self.retry_at,
+            'attempts': self.attempts,
+            'mirrors': self.mirrors,
+            'source': self.source
         }
 
     def valid_for_download(self) -> bool:
@@ -84,6 +176,7 @@ class UrlMetadata:
     content_type: str = ''
     server: str = ''
     proposed_file_name: str = ''
+    etag: str = None
 
     def to_dict(self) -> dict:
         return {
@@ -92,7 +185,8 @@ class UrlMetadata:
             'content_length': self.content_length,
             'content_type': self.content_type,
             'server': self.server,
-            'proposed_file_name': self.proposed_file_name
+            'proposed_file_name': self.proposed_file_name,
+            'etag': self.etag
         }
 
     def compute_file_name(self) -> str:
@@ -125,9 +219,43 @@ class UrlMetadata:
         self.proposed_file_name = filename
 
 
+_metadata_cache = TTLCache(
+    dconfig.metadata_cache_size(),
+    dconfig.metadata_cache_ttl()
+)
+
+
 def metadata(url: str) -> UrlMetadata:
+    """Retrieves metadata of given url through a HEAD request. Results
+    are cached (see 'config_loader.metadata_cache_ttl') and concurrent
+    requests for the same url share a single HEAD request.
+
+    Raises:
+        MetadataReqError: If HEAD request fails
+    """
+    url_meta = _metadata_cache.get_or_load(
+        normalize_url(url),
+        lambda: _fetch_metadata(url)
+    )
+    return replace(url_meta, url=url)
+
+
+def cached_metadata(url: str) -> UrlMetadata:
+    """Returns cached metadata of given url without doing any request,
+    None if url metadata is not cached
+    """
+    url_meta = _metadata_cache.get(normalize_url(url))
+    return replace(url_meta, url=url) if url_meta else None
+
+
+def _fetch_metadata(url: str) -> UrlMetadata:
     try:
-        res = requests.head(url, timeout=5, allow_redirects=True)
+        with metrics.metadata_request_seconds.time():
+            res = http_session.get_session().head(
+                url,
+                timeout=5,
+                allow_redirects=True
+            )
         res.raise_for_status()
     except RequestException as err:
         raise MetadataReqError(str(err)) from err
@@ -138,7 +266,7 @@ def metadata(url: str) -> UrlMetadata:
         url_meta.content_disposition = res.headers['Content-Disposition']
 
     if 'Content-Length' in res.headers:
-        url_meta.content_length = res.headers['Content-Length']
+        url_meta.content_length = int(res.headers['Content-Length'])
 
     if 'Content-Type' in res.headers:
         url_meta.content_type = res.headers['Content-Type']
@@ -146,6 +274,9 @@ def metadata(url: str) -> UrlMetadata:
     if 'Server' in res.headers:
         url_meta.server = res.headers['Server']
 
+    if 'ETag' in res.headers:
+        url_meta.etag = res.headers['ETag']
+
     url_meta.compute_file_name()
     return url_meta
 
@@ -153,11 +284,19 @@ def metadata(url: str) -> UrlMetadata:
 def download(
     dtask: DownloadTask,
     on_update: Callable,
-    reload_status: Callable
+    reload_status: Callable,
+    sources: 'mirrors.Sources' = None
 ) -> None:
     """Starts or resumes given download task if it is
     ready for download. See 'DownloadTask.valid_for_download'
 
+    When origin server advertises 'Accept-Ranges: bytes' and file is
+    big enough, download is split into several byte ranges fetched
+    in parallel. See '_download_segmented'
+
+    Failed attempts are recorded on task, which is queued again to be
+    retried later if failure is transient. See 'fail'
+
     Args:
         dtask (str): Download job descriptor
         on_update (Callable): Callback to invoke constantly during
@@ -165,33 +304,174 @@ def download(
         reload_status (Callable): Callback to invoke in order to ask for
             external refresh of download status. Use this for
             check if download was externaly paused
+        sources (mirrors.Sources): Mirrors of task, selected by
+            'mirrors.select'. Download moves to next one when current
+            one fails or is too slow
     """
-    chunk_size = 1024 * 1024 * 5  # 5MB
-
     if dtask.valid_for_download():
 
         # Set status as 'In progress'
         dtask.status = DownloadStatus.IN_PROGRESS
+        dtask.retry_at = None
         on_update()
 
-        with _make_request(dtask) as res:
-            res.raise_for_status()
+        # Resume from persisted progress, bounded by bytes on disk
+        dtask.downloaded_size = resume_offset(dtask)
+        resumed_from = dtask.downloaded_size
 
-            # Get file total size from response headers
-            if res.headers['Content-length']:
-                dtask.total_size = int(res.headers['Content-length'])
-                if dtask.downloaded_size > 0:
-                    dtask.total_size += dtask.downloaded_size
+        bandwidth.governor.register(dtask.id, dtask.max_rate)
+        try:
+            _transfer_from_sources(dtask, on_update, reload_status, sources)
+        except Exception as err:  # pylint: disable=broad-except
+            fail(dtask, err, resumed_from)
+            on_update()
+        finally:
+            bandwidth.governor.unregister(dtask.id)
 
-            # Append bytes if file already exists, otherwise write
-            file_mode = 'ab' if os.path.exists(dtask.target_path) else 'wb'
-            with open(dtask.target_path, file_mode) as target:
-                for chunk in res.iter_content(chunk_size=chunk_size):
 
-                    # Ensure chunk is not empty
-                    if chunk:
-                        target.write(chunk)
-                        dtask.downloaded_size += len(chunk)
+def fail(dtask: DownloadTask, err: Exception, resumed_from: int) -> None:
+    """Records failed attempt of given running task. Task is queued
+    again, to be dispatched once its retry delay is over, if error is
+    transient and attempts are left, and failed otherwise.
+
+    Args:
+        dtask (DownloadTask): Task whose attempt failed, its
+            'downloaded_size' must count bytes on disk
+        err (Exception): Error that stopped the attempt
+        resumed_from (int): Downloaded size when attempt started
+    """
+    # Task was paused or cancelled meanwhile
+    if dtask.status != DownloadStatus.IN_PROGRESS:
+        return
+
+    # Hash state of a previous pause no longer matches bytes on disk
+    hashing.discard_checkpoint(dtask.id)
+
+    failure = retry.classify(err)
+    if failure.retryable:
+        logger.warning(
+            'Download of task %s failed: %s',
+            dtask.id,
+            failure.message
+        )
+    else:
+        logger.error('Download of task %s failed', dtask.id, exc_info=err)
+
+    # Attempts that made progress start the count again
+    progressed = dtask.downloaded_size > resumed_from
+    dtask.retries = 1 if progressed else dtask.retries + 1
+    dtask.err_message = failure.message
+
+    attempts = dtask.attempts or []
+    attempts.append({
+        'at': time.time(),
+        'error': failure.message,
+        'retryable': failure.retryable,
+        'downloaded_size': dtask.downloaded_size
+    })
+    dtask.attempts = attempts[-retry.MAX_HISTORY:]
+
+    if failure.retryable and dtask.retries < dconfig.retry_max_attempts():
+        delay = failure.retry_after
+        if delay is None:
+            delay = retry.backoff(dtask.retries)
+
+        dtask.status = DownloadStatus.QUEUED
+        dtask.retry_at = time.time() + delay
+    else:
+        dtask.status = DownloadStatus.FAILED
+
+
+def _transfer_from_sources(
+    dtask: DownloadTask,
+    on_update: Callable,
+    reload_status: Callable,
+    sources: 'mirrors.Sources'
+) -> None:
+    """Transfers task from its current source, resuming from next mirror
+    (if any) when current one fails or is too slow
+    """
+    while True:
+        try:
+            _transfer(dtask, on_update, reload_status, sources)
+            return
+        except Exception as err:  # pylint: disable=broad-except
+            if sources is None or not sources.switch(err):
+                raise
+
+
+def _transfer(
+    dtask: DownloadTask,
+    on_update: Callable,
+    reload_status: Callable,
+    sources: 'mirrors.Sources' = None
+) -> None:
+    """Downloads remaining bytes of given running task through a
+    single stream, or through several ones if server allows it.
+
+    Progress callbacks are invoked after every chunk, so they are
+    expected to be cheap (see 'progress.ProgressReporter'). Chunk size
+    adapts to throughput, see 'receive.iter_body'
+    """
+    with _make_request(dtask) as res:
+        res.raise_for_status()
+
+        # Resource changed since download started (or server ignores
+        # ranges), full content is received so download starts over
+        if dtask.downloaded_size and res.status_code != 206:
+            restart(dtask)
+        store_validators(dtask, res.headers)
+
+        # Get file total size from response headers
+        size_known = bool(res.headers.get('Content-length'))
+        if size_known:
+            dtask.total_size = int(res.headers['Content-length'])
+            if dtask.downloaded_size > 0:
+                dtask.total_size += dtask.downloaded_size
+
+        try:
+            prepare_target(dtask)
+        except storage.InsufficientSpaceError as err:
+            dtask.status = DownloadStatus.FAILED
+            dtask.err_message = err.message
+            on_update()
+            return
+
+        # Archive bytes are extracted in order, from a single stream
+        if not dtask.extract_to and _supports_segments(dtask, res):
+            _download_segmented(dtask, res, on_update, reload_status)
+            return
+
+        hasher = None
+        if dtask.file_hash:
+            hasher = hashing.resume_hasher(
+                dtask.id,
+                dtask.file_hash,
+                dtask.target_path,
+                dtask.downloaded_size
+            )
+
+        try:
+            with storage.TargetFile(dtask.target_path) as target, \
+                    receive.buffer() as buf, \
+                    open_extractor(dtask) as extractor:
+                chunks = receive.iter_body(
+                    res,
+                    buf,
+                    partial(bandwidth.governor.read_size, dtask.id)
+                )
+                if sources:
+                    chunks = sources.watch(chunks)
+
+                for chunk in chunks:
+                    bandwidth.governor.throttle(dtask.id, len(chunk))
+                    target.write_at(dtask.downloaded_size, chunk)
+                    dtask.downloaded_size += len(chunk)
+                    metrics.transfer_meter.record(dtask.id, len(chunk))
+                    if hasher:
+                        hasher.update(chunk)
+                    if extractor:
+                        extractor.feed(chunk)
 
                     # Reload external status before update downloaded size
                     # to avoid override possible external changes
@@ -200,14 +480,420 @@ def download(
 
                     # Stop download if status was externally changed
                     if dtask.status != DownloadStatus.IN_PROGRESS:
+                        if hasher:
+                            hashing.save_checkpoint(dtask.id, hasher)
                         res.close()
                         return
 
-                if dtask.downloaded_size == dtask.total_size:
-                    dtask.status = DownloadStatus.COMPLETED
-                else:
-                    dtask.status = DownloadStatus.FAILED
-                on_update()
+                # Chunked responses: size is known once stream is over
+                if not size_known:
+                    dtask.total_size = dtask.downloaded_size
+
+                if extractor and dtask.downloaded_size == dtask.total_size:
+                    extractor.finish()
+        except archives.ExtractionError as err:
+            fail_extraction(dtask, err)
+            on_update()
+            return
+
+        if dtask.downloaded_size != dtask.total_size:
+            raise ShortReadError(dtask.downloaded_size, dtask.total_size)
+
+        complete(dtask, hasher)
+        if extractor:
+            discard_archive(dtask)
+        on_update()
+
+
+def open_extractor(dtask: DownloadTask):
+    """Opens stream extractor bytes of given task are fed into. Bytes
+    already on disk (if download is resumed) are fed first, as archive
+    is parsed from its first byte.
+
+    If archive can not be extracted while downloading, an 'extract'
+    post-processing stage is added to task instead, see 'postprocess'
+
+    Returns:
+        Context manager of extractor, which is None if task is not
+        extracted while downloading
+    """
+    if not dtask.extract_to or _extracts_once_downloaded(dtask):
+        return nullcontext()
+
+    try:
+        extractor = archives.open_stream(
+            dtask.target_path,
+            dtask.extract_to,
+            dtask.source_url,
+            dtask.total_size,
+            dtask.if_range
+        )
+    except archives.StreamingNotSupportedError as err:
+        logger.info(
+            'Archive of task %s is extracted once downloaded: %s',
+            dtask.id,
+            err.message
+        )
+        _extract_once_downloaded(dtask)
+        return nullcontext()
+
+    if dtask.downloaded_size:
+        try:
+            extractor.replay(dtask.target_path, dtask.downloaded_size)
+        except archives.ExtractionError:
+            extractor.abort()
+            raise
+    return extractor
+
+
+def _extracts_once_downloaded(dtask: DownloadTask) -> bool:
+    return any(
+        step['stage'] == 'extract' for step in dtask.post_process or []
+    )
+
+
+def _extract_once_downloaded(dtask: DownloadTask) -> None:
+    """Falls back to extraction by a post-processing stage, run before
+    any other stage of task
+    """
+    step = {
+        'stage': 'extract',
+        'options': {
+            'to': os.path.relpath(dtask.extract_to, dconfig.downloads_dir()),
+            'remove_archive': not dtask.keep_archive
+        },
+        'status': PostProcessStatus.PENDING.value,
+        'message': None
+    }
+    dtask.post_process = [step] + (dtask.post_process or [])
+    dtask.post_status = PostProcessStatus.PENDING
+
+
+def fail_extraction(dtask: DownloadTask, err: archives.ExtractionError):
+    logger.warning('Extraction of task %s failed: %s', dtask.id, err.message)
+    dtask.status = DownloadStatus.FAILED
+    dtask.err_message = f'Extraction failed: {err.message}'
+
+
+def discard_archive(dtask: DownloadTask) -> None:
+    """Removes archive of a completed task once extracted, unless it is
+    kept. Archive is only written while downloading so download can be
+    resumed
+    """
+    if dtask.status == DownloadStatus.COMPLETED and not dtask.keep_archive:
+        os.remove(dtask.target_path)
+
+
+def restart(dtask: DownloadTask) -> None:
+    """Discards downloaded bytes of given task, so it is downloaded
+    again from first byte
+    """
+    logger.info('Content of task %s changed, restarting download', dtask.id)
+
+    dtask.downloaded_size = 0
+    hashing.discard_checkpoint(dtask.id)
+    if os.path.exists(dtask.target_path):
+        os.truncate(dtask.target_path, 0)
+
+
+def store_validators(dtask: DownloadTask, headers) -> None:
+    """Keeps 'ETag' and 'Last-Modified' of response, so content can be
+    validated when download is resumed, see 'DownloadTask.if_range'
+    """
+    if headers.get('ETag'):
+        dtask.etag = headers['ETag']
+    if headers.get('Last-Modified'):
+        dtask.last_modified = headers['Last-Modified']
+
+
+def is_fresh(dtask: DownloadTask) -> bool:
+    """Checks through a conditional request whether content of given
+    (downloaded) task is still the one served at its url. Unchanged
+    content is answered with a bodyless '304 Not Modified'.
+
+    Raises:
+        MetadataReqError: If request fails
+
+    Returns:
+        bool: True if content did not change, False if it changed,
+            None if task has no validators to check against
+    """
+    headers = {}
+    if dtask.etag:
+        headers['If-None-Match'] = dtask.etag
+    if dtask.last_modified:
+        headers['If-Modified-Since'] = dtask.last_modified
+    if not headers:
+        return None
+
+    try:
+        # Body of a changed resource is not read
+        with http_session.get_session().get(
+            dtask.url,
+            stream=True,
+            headers=headers,
+            timeout=5
+        ) as res:
+            if res.status_code == 304:
+                return True
+            res.raise_for_status()
+            return False
+    except RequestException as err:
+        raise MetadataReqError(str(err)) from err
+
+
+def prepare_target(dtask: DownloadTask) -> None:
+    """Checks free space for (and optionally preallocates) the bytes
+    of target file, once total size is known. Nothing is done
+    if total size is unknown.
+
+    Raises:
+        InsufficientSpaceError: If there is not enough free space
+    """
+    if not dtask.total_size:
+        return
+
+    storage.check_free_space(dtask.target_path, dtask.total_size)
+
+    if dconfig.preallocate_files():
+        with storage.TargetFile(dtask.target_path) as target:
+            target.preallocate(dtask.total_size)
+
+
+def complete(dtask: DownloadTask, hasher: hashing.StreamingHasher = None):
+    """Marks a fully downloaded task as completed, or as failed if its
+    content does not match expected 'file_hash'
+
+    Args:
+        dtask (DownloadTask): Task which bytes were all downloaded
+        hasher (StreamingHasher): Digest computed while downloading,
+            if not given and task has a 'file_hash', target file
+            is read and hashed
+    """
+    # Drop stale bytes of a previous, longer, file
+    if os.path.getsize(dtask.target_path) > dtask.total_size:
+        os.truncate(dtask.target_path, dtask.total_size)
+
+    if dtask.file_hash:
+        if hasher is None:
+            hasher = hashing.hash_file(dtask.file_hash, dtask.target_path)
+
+        mismatch = hasher.mismatch_message()
+        if mismatch:
+            dtask.status = DownloadStatus.FAILED
+            dtask.err_message = mismatch
+            return
+
+    dtask.status = DownloadStatus.COMPLETED
+
+
+@dataclass
+class _Segment:
+    """Inclusive byte range of target file fetched by a single
+    connection during a segmented download
+    """
+    start: int
+    end: int
+    written: int = 0
+
+    @property
+    def size(self) -> int:
+        return self.end - self.start + 1
+
+    @property
+    def done(self) -> bool:
+        return self.written >= self.size
+
+
+def _supports_segments(dtask: DownloadTask, res: requests.Response) -> bool:
+    """Checks if given response allows to fetch remaining bytes of task
+    through several parallel range requests.
+
+    Only fresh downloads (full '200' responses) of identity encoded
+    content are segmented, resumed downloads keep using a single stream.
+    """
+    segments = dconfig.download_segments()
+    if segments <= 1 or res.status_code != 200:
+        return False
+
+    if res.headers.get('Accept-Ranges', '').lower() != 'bytes':
+        return False
+
+    if res.headers.get('Content-Encoding', 'identity') != 'identity':
+        return False
+
+    return dtask.total_size >= segments * dconfig.min_segment_size()
+
+
+def _split_ranges(total_size: int, segments: int) -> list[_Segment]:
+    """Splits 'total_size' bytes into 'segments' contiguous ranges of
+    (almost) the same size
+    """
+    seg_size = total_size // segments
+    ranges = []
+
+    for idx in range(segments):
+        start = idx * seg_size
+        end = total_size - 1 if idx == segments - 1 else start + seg_size - 1
+        ranges.append(_Segment(start, end))
+
+    return ranges
+
+
+def _download_segmented(
+    dtask: DownloadTask,
+    first_res: requests.Response,
+    on_update: Callable,
+    reload_status: Callable
+) -> None:
+    """Downloads task as a set of byte ranges fetched in parallel and
+    written at their offsets into target file.
+
+    First segment reuses the already opened response, which is
+    abandoned once segment is complete. Progress of every segment is
+    added into 'dtask.downloaded_size'.
+
+    If download is externally stopped or a segment fails, target file
+    is truncated to its contiguous downloaded prefix, so it can be
+    resumed later through a single 'Range' request.
+    """
+    segments = _split_ranges(dtask.total_size, dconfig.download_segments())
+    progress_lock = threading.Lock()
+    stop = threading.Event()
+
+    # Segments are written at their own offsets of a shared file
+    target = storage.TargetFile(dtask.target_path)
+
+    def _fetch(segment: _Segment, res: requests.Response = None):
+        if res is None:
+            res = _make_range_request(
+                dtask.source_url,
+                segment.start,
+                segment.end,
+                if_range=dtask.if_range
+            )
+
+        with res, receive.buffer() as buf:
+            res.raise_for_status()
+
+            max_read = partial(bandwidth.governor.read_size, dtask.id)
+            for chunk in receive.iter_body(res, buf, max_read):
+                if stop.is_set():
+                    return
+
+                chunk = chunk[:segment.size - segment.written]
+                if chunk:
+                    bandwidth.governor.throttle(dtask.id, len(chunk))
+                    target.write_at(segment.start + segment.written, chunk)
+                    segment.written += len(chunk)
+                    metrics.transfer_meter.record(dtask.id, len(chunk))
+                    with progress_lock:
+                        dtask.downloaded_size += len(chunk)
+
+                if segment.done:
+                    return
+
+    with ThreadPoolExecutor(max_workers=len(segments)) as executor:
+        futures = [executor.submit(_fetch, segments[0], first_res)]
+        futures += [executor.submit(_fetch, seg) for seg in segments[1:]]
+
+        pending = futures
+        while pending:
+            done, pending = wait(pending, timeout=1, return_when=FIRST_EXCEPTION)
+
+            reload_status()
+            on_update()
+
+            failed = any(f.exception() for f in done)
+            if failed or dtask.status != DownloadStatus.IN_PROGRESS:
+                stop.set()
+                break
+
+    target.close()
+    if all(seg.done for seg in segments):
+        # Segments are not written in order, so hash is computed once
+        # all of them are on disk
+        complete(dtask)
+        on_update()
+        return
+
+    # Keep only bytes that can be resumed through a single stream,
+    # preallocated files keep their size, see 'resume_offset'
+    dtask.downloaded_size = _contiguous_prefix(segments)
+    if not dconfig.preallocate_files():
+        os.truncate(dtask.target_path, dtask.downloaded_size)
+
+    errors = [f.exception() for f in futures if f.done() and f.exception()]
+    if errors:
+        raise errors[0]
+
+    # A segment stream ended before its last byte
+    if dtask.status == DownloadStatus.IN_PROGRESS:
+        raise ShortReadError(dtask.downloaded_size, dtask.total_size)
+
+    on_update()
+
+
+def _contiguous_prefix(segments: list[_Segment]) -> int:
+    prefix = 0
+    for segment in segments:
+        prefix = segment.start + segment.written
+        if not segment.done:
+            break
+
+    return prefix
+
+
+def _make_range_request(
+    url: str,
+    start: int,
+    end: int,
+    if_range: str = None
+) -> requests.Response:
+    """Requests inclusive byte range [start, end] of given url. If
+    'if_range' validator is given, range is only served if content
+    did not change
+
+    Raises:
+        RangeNotSatisfiedError: When server ignores requested range
+            or content changed
+    """
+    headers = {'Range': f'bytes={start}-{end}'}
+    if if_range:
+        headers['If-Range'] = if_range
+
+    res = http_session.get_session().get(
+        url,
+        stream=True,
+        headers=headers,
+        timeout=60 # seconds
+    )
+
+    if res.status_code != 206:
+        res.close()
+        raise RangeNotSatisfiedError(url, res.status_code)
+
+    return res
+
+
+def resume_offset(dtask: DownloadTask) -> int:
+    """Computes the byte from which given task must be resumed.
+
+    Persisted 'downloaded_size' is used since target file may be
+    preallocated, so its size says nothing about downloaded bytes.
+    It is bounded by file size in case file lost bytes. As writes
+    are done at explicit offsets, bytes written after last persisted
+    progress are just downloaded and written again.
+
+    Returns:
+        int: Offset of first byte to download, 0 if target path
+            does not exist yet
+    """
+    if os.path.exists(dtask.target_path):
+        file_size = os.path.getsize(dtask.target_path)
+        return int(min(dtask.downloaded_size, file_size))
+
+    return 0
 
 
 def _make_request(dtask: DownloadTask):
@@ -221,20 +907,25 @@ def _make_request(dtask: DownloadTask):
     Returns:
         [type]: Http request with stream mode enabled
     """
-    starting_byte = 0
-    if os.path.exists(dtask.target_path):
-        starting_byte = os.path.getsize(dtask.target_path)
+    starting_byte = resume_offset(dtask)
 
     # Skip previously downloaded bytes when applicable.
-    # e.g. like when resuming download
-    range_header = {'Range': f'bytes={starting_byte}-'}
-    headers = range_header if starting_byte else None
-
-    return requests.get(
-        dtask.url,
+    # e.g. like when resuming download. Server sends whole content
+    # instead if it changed since download started
+    headers = None
+    if starting_byte:
+        headers = {'Range': f'bytes={starting_byte}-'}
+        if dtask.if_range:
+            headers['If-Range'] = dtask.if_range
+
+    # Stalled mirrors are left for next one
+    timeout = dconfig.mirror_stall_timeout() if dtask.mirrors else 60
+
+    return http_session.get_session().get(
+        dtask.source_url,
         stream=True,
         headers=headers,
-        timeout=60 # seconds
+        timeout=timeout # seconds
     )
 
 # def _refresh(dtask: DownloadTask):
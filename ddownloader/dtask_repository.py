@@ -1,9 +1,16 @@
 import contextlib
+import json
+import os
 import sqlite3
+import threading
+import time
 import ddownloader.config_loader as dconfig
+from ddownloader import hashing, metrics
+from ddownloader.cache import normalize_url
 from ddownloader.downloader import (
     DownloadStatus,
-    DownloadTask
+    DownloadTask,
+    PostProcessStatus
 )
 from ddownloader.log_utils import logger
 
@@ -22,33 +29,354 @@ CREATE_TABLE_IF_NOT_EXISTS = """
     )
 """
 
+# Columns added after first release, created on existing
+# databases by 'init'
+ADDED_COLUMNS = {
+    'max_rate': 'INTEGER DEFAULT 0',
+    'priority': 'INTEGER DEFAULT 0',
+    'host': 'VARCHAR(500)',
+    'dispatched': 'INTEGER DEFAULT 0',
+    'dispatched_at': 'REAL',
+    'queued_at': 'REAL',
+    'lease_owner': 'VARCHAR(300)',
+    'lease_expires_at': 'REAL',
+    'attached_to': 'INTEGER',
+    'url_key': 'VARCHAR(5000)',
+    'content_key': 'VARCHAR(5000)',
+    'hash_key': 'VARCHAR(1000)',
+    'etag': 'VARCHAR(1000)',
+    'last_modified': 'VARCHAR(100)',
+    'post_process': 'TEXT',
+    'post_status': 'VARCHAR(50)',
+    'extract_to': 'VARCHAR(5000)',
+    'keep_archive': 'INTEGER DEFAULT 1',
+    'retries': 'INTEGER DEFAULT 0',
+    'retry_at': 'REAL',
+    'attempts': 'TEXT',
+    'mirrors': 'TEXT',
+    'source': 'VARCHAR(5000)'
+}
+
+# Columns identifying content of a task, see 'dedup' module
+DEDUP_KEY_COLUMNS = ('url_key', 'content_key', 'hash_key')
+
+CREATE_SETTING_TABLE_IF_NOT_EXISTS = """
+    CREATE TABLE IF NOT EXISTS setting(
+        key VARCHAR(100) PRIMARY KEY,
+        value VARCHAR(5000)
+    )
+"""
+
+CREATE_STATUS_INDEX_IF_NOT_EXISTS = """
+    CREATE INDEX IF NOT EXISTS download_task_status_id
+    ON download_task(status, id)
+"""
+
+CREATE_DISPATCH_INDEX_IF_NOT_EXISTS = """
+    CREATE INDEX IF NOT EXISTS download_task_dispatch
+    ON download_task(status, dispatched, priority DESC, id)
+"""
+
+CREATE_DEDUP_INDEXES_IF_NOT_EXIST = [
+    f"""
+    CREATE INDEX IF NOT EXISTS download_task_{column}
+    ON download_task({column}, status)
+    """
+    for column in DEDUP_KEY_COLUMNS
+] + [
+    """
+    CREATE INDEX IF NOT EXISTS download_task_attached_to
+    ON download_task(attached_to)
+    """
+]
+
+CREATE_POST_STATUS_INDEX_IF_NOT_EXISTS = """
+    CREATE INDEX IF NOT EXISTS download_task_post_status
+    ON download_task(post_status)
+"""
+
+# Task counts per status, kept up to date by triggers so counting
+# does not need to scan the whole tasks table
+CREATE_COUNT_TABLE_IF_NOT_EXISTS = """
+    CREATE TABLE IF NOT EXISTS download_task_count(
+        status VARCHAR(50) PRIMARY KEY,
+        total INTEGER NOT NULL DEFAULT 0
+    )
+"""
+
+INIT_COUNT_TABLE = """
+    INSERT INTO download_task_count(status, total)
+    SELECT status, COUNT(*) FROM download_task
+    WHERE NOT EXISTS (SELECT 1 FROM download_task_count)
+    GROUP BY status
+"""
+
+CREATE_COUNT_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS download_task_count_insert
+    AFTER INSERT ON download_task
+    BEGIN
+        INSERT INTO download_task_count(status, total)
+        VALUES(NEW.status, 1)
+        ON CONFLICT(status) DO UPDATE SET total = total + 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS download_task_count_delete
+    AFTER DELETE ON download_task
+    BEGIN
+        UPDATE download_task_count SET total = total - 1
+        WHERE status = OLD.status;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS download_task_count_update
+    AFTER UPDATE OF status ON download_task
+    WHEN OLD.status IS NOT NEW.status
+    BEGIN
+        UPDATE download_task_count SET total = total - 1
+        WHERE status = OLD.status;
+
+        INSERT INTO download_task_count(status, total)
+        VALUES(NEW.status, 1)
+        ON CONFLICT(status) DO UPDATE SET total = total + 1;
+    END
+    """
+]
+
 FIND_BY_ID = """
     SELECT * FROM download_task
     WHERE id = :id
 """
 
 INSERT_DTASK = """
-    INSERT INTO download_task VALUES(
-        null,
+    INSERT INTO download_task(
+        url,
+        target_path,
+        total_size,
+        downloaded_size,
+        status,
+        file_hash,
+        max_rate,
+        priority,
+        host,
+        queued_at,
+        attached_to,
+        url_key,
+        content_key,
+        hash_key,
+        post_process,
+        post_status,
+        extract_to,
+        keep_archive,
+        mirrors
+    ) VALUES(
         :url,
         :target_path,
         :total_size,
         :downloaded_size,
         :status,
         :file_hash,
-        null)
+        :max_rate,
+        :priority,
+        :host,
+        :now,
+        :attached_to,
+        :url_key,
+        :content_key,
+        :hash_key,
+        :post_process,
+        :post_status,
+        :extract_to,
+        :keep_archive,
+        :mirrors)
 """
 
+# Stages are saved as well, as an 'extract' one may be added while
+# downloading, see 'downloader.open_extractor'
 UPDATE_DTASK = """
     UPDATE download_task
     SET
         total_size=:total_size,
         downloaded_size=:downloaded_size,
         status=:status,
-        err_message=:err_message
+        err_message=:err_message,
+        etag=:etag,
+        last_modified=:last_modified,
+        post_process=:post_process,
+        post_status=:post_status,
+        retries=:retries,
+        retry_at=:retry_at,
+        attempts=:attempts,
+        source=:source,
+        dispatched=0,
+        queued_at=CASE
+            WHEN :status = :queued AND status != :queued THEN :now
+            ELSE queued_at
+        END
+    WHERE id = :id
+"""
+
+UPDATE_DTASK_PROGRESS = """
+    UPDATE download_task
+    SET
+        total_size=:total_size,
+        downloaded_size=:downloaded_size,
+        etag=:etag,
+        last_modified=:last_modified,
+        source=:source
+    WHERE id = :id
+"""
+
+# Target path changes when file is moved by a post-processing stage
+UPDATE_POST_PROCESS = """
+    UPDATE download_task
+    SET
+        target_path=:target_path,
+        post_process=:post_process,
+        post_status=:post_status
+    WHERE id = :id
+"""
+
+UPDATE_DTASK_MAX_RATE = """
+    UPDATE download_task
+    SET max_rate=:max_rate
+    WHERE id = :id
+"""
+
+UPDATE_DTASK_PRIORITY = """
+    UPDATE download_task
+    SET priority=:priority
     WHERE id = :id
 """
 
+# Tasks handed over to workers which have not started yet count as
+# running, so they are not dispatched twice
+COUNT_RUNNING_BY_HOST = """
+    SELECT host, COUNT(*) as running FROM download_task
+    WHERE status = :in_progress
+    OR (status = :queued AND dispatched = 1)
+    GROUP BY host
+"""
+
+# Tasks waiting to be retried are left until their delay is over
+FIND_DISPATCH_CANDIDATES = """
+    SELECT id, host FROM download_task
+    WHERE status = :queued AND dispatched = 0 AND attached_to IS NULL
+    AND (retry_at IS NULL OR retry_at <= :now)
+    ORDER BY priority DESC, id ASC
+    LIMIT :limit OFFSET :offset
+"""
+
+MARK_DISPATCHED = """
+    UPDATE download_task
+    SET dispatched=1, dispatched_at=:now
+    WHERE id = :id
+"""
+
+RELEASE_DISPATCH = """
+    UPDATE download_task
+    SET dispatched=0
+    WHERE id = :id AND status = :queued
+"""
+
+# Lease can be taken if it is free, expired or already owned
+ACQUIRE_LEASE = """
+    UPDATE download_task
+    SET lease_owner=:owner, lease_expires_at=:expires_at
+    WHERE id = :id AND (
+        lease_owner IS NULL
+        OR lease_owner = :owner
+        OR lease_expires_at < :now
+    )
+"""
+
+RENEW_LEASE = """
+    UPDATE download_task
+    SET lease_expires_at=:expires_at
+    WHERE id = :id AND lease_owner = :owner
+"""
+
+RELEASE_LEASE = """
+    UPDATE download_task
+    SET lease_owner=NULL, lease_expires_at=NULL
+    WHERE id = :id AND lease_owner = :owner
+"""
+
+FIND_LEASES_BY_STATUS = """
+    SELECT id, lease_owner, lease_expires_at FROM download_task
+    WHERE status = :status
+"""
+
+# Claims older than 'claimed_before' (or taken before claims were
+# timestamped) whose download never started
+FIND_STALE_DISPATCHES = """
+    SELECT id, lease_owner, lease_expires_at FROM download_task
+    WHERE status = :queued AND dispatched = 1
+    AND (dispatched_at IS NULL OR dispatched_at < :claimed_before)
+"""
+
+FIND_POST_PROCESS_LEASES = """
+    SELECT id, lease_owner, lease_expires_at FROM download_task
+    WHERE post_status IN (:pending, :running) AND status = :completed
+"""
+
+# Owner is checked again so a lease renewed in the meantime is kept
+REQUEUE_ABANDONED = """
+    UPDATE download_task
+    SET
+        status=:queued,
+        dispatched=0,
+        queued_at=:now,
+        lease_owner=NULL,
+        lease_expires_at=NULL
+    WHERE id = :id
+    AND status = :in_progress
+    AND lease_owner IS :owner
+    AND (lease_expires_at IS NULL OR lease_expires_at = :expires_at)
+"""
+
+# Lease and claim are checked again, so a download starting meanwhile
+# or a new claim are kept
+RELEASE_STALE_DISPATCH = """
+    UPDATE download_task
+    SET dispatched=0
+    WHERE id = :id
+    AND status = :queued
+    AND dispatched = 1
+    AND (dispatched_at IS NULL OR dispatched_at < :claimed_before)
+    AND lease_owner IS :owner
+    AND (lease_expires_at IS NULL OR lease_expires_at = :expires_at)
+"""
+
+FIND_FOLLOWERS = """
+    SELECT * FROM download_task
+    WHERE attached_to = :source_id
+    ORDER BY id ASC
+"""
+
+ATTACH = """
+    UPDATE download_task
+    SET attached_to=:source_id
+    WHERE id = :id
+"""
+
+DETACH_FOLLOWERS = """
+    UPDATE download_task
+    SET attached_to=NULL
+    WHERE attached_to = :source_id
+"""
+
+FIND_SETTING = """
+    SELECT value FROM setting
+    WHERE key = :key
+"""
+
+UPSERT_SETTING = """
+    INSERT INTO setting(key, value) VALUES(:key, :value)
+    ON CONFLICT(key) DO UPDATE SET value = :value
+"""
+
 DELETE_DTASK = """
     DELETE from download_task
     WHERE id = :id
@@ -66,8 +394,37 @@ FIND_ALL_LIMIT_OFFSET = """
     LIMIT :limit OFFSET :offset
 """
 
+FIND_AFTER_ID = """
+    SELECT * FROM download_task
+    WHERE id > :after_id
+    ORDER BY id ASC
+    LIMIT :limit
+"""
+
+FIND_BY_STATUS_AFTER_ID = """
+    SELECT * FROM download_task
+    WHERE status = :status AND id > :after_id
+    ORDER BY id ASC
+    LIMIT :limit
+"""
+
+FIND_BY_STATUS = """
+    SELECT * FROM download_task
+    WHERE status = :status
+    ORDER BY id ASC
+"""
+
 COUNT = """
-    SELECT COUNT(*) as total_count FROM download_task
+    SELECT COALESCE(SUM(total), 0) as total_count FROM download_task_count
+"""
+
+COUNT_GROUP_BY_STATUS = """
+    SELECT status, total FROM download_task_count
+"""
+
+COUNT_BY_STATUS = """
+    SELECT COALESCE(SUM(total), 0) as total_count FROM download_task_count
+    WHERE status = :status
 """
 
 _db_path = dconfig.get_db_path()
@@ -78,23 +435,73 @@ class DBError(Exception):
         super().__init__("DB Error: {}".format(message))
 
 
+_local = threading.local()
+
+
+def _connect() -> sqlite3.Connection:
+    """Opens a new connection to tasks database tuned for concurrent
+    access from API readers and download writers.
+
+    WAL journaling allows readers to proceed while a writer commits,
+    'busy_timeout' makes writers wait for the lock instead of failing
+    immediately and statements are cached per connection.
+    """
+    con = sqlite3.connect(
+        _db_path,
+        timeout=dconfig.db_busy_timeout() / 1000,
+        cached_statements=256
+    )
+    con.row_factory = sqlite3.Row
+
+    con.execute(f'PRAGMA journal_mode={dconfig.db_journal_mode()}')
+    con.execute(f'PRAGMA synchronous={dconfig.db_synchronous()}')
+    con.execute(f'PRAGMA busy_timeout={dconfig.db_busy_timeout()}')
+    return con
+
+
+def _thread_con() -> sqlite3.Connection:
+    """Returns the connection owned by current thread, opening it
+    on first use. Connections inherited through 'fork' are discarded,
+    so every worker process gets its own ones.
+    """
+    pid = os.getpid()
+    if getattr(_local, 'pid', None) != pid:
+        _local.con = _connect()
+        _local.pid = pid
+
+    return _local.con
+
+
 @contextlib.contextmanager
 def _db_con():
     """Context manager to wrap db connections and
-    query exceptions.
+    query exceptions. Statements executed inside the context
+    are committed as a single transaction.
 
     Yields:
         [sqlite3.Connection]: SQLite database connection
     """
+    started = time.perf_counter()
     try:
-        con = sqlite3.connect(_db_path)
+        con = _thread_con()
 
         with con:
-            con.row_factory = sqlite3.Row
             yield con
-        con.close()
     except Exception as e:
         raise(DBError(e))
+    finally:
+        metrics.db_query_seconds.observe(time.perf_counter() - started)
+
+
+def close():
+    """Closes database connection owned by current thread, if any
+    """
+    con = getattr(_local, 'con', None)
+    if con is not None and _local.pid == os.getpid():
+        con.close()
+
+    _local.con = None
+    _local.pid = None
 
 
 def init():
@@ -104,6 +511,55 @@ def init():
 
     with _db_con() as con:
         con.execute(CREATE_TABLE_IF_NOT_EXISTS)
+        _add_missing_columns(con)
+        _backfill_hosts(con)
+        _backfill_dedup_keys(con)
+        con.execute(CREATE_STATUS_INDEX_IF_NOT_EXISTS)
+        con.execute(CREATE_DISPATCH_INDEX_IF_NOT_EXISTS)
+        for index in CREATE_DEDUP_INDEXES_IF_NOT_EXIST:
+            con.execute(index)
+        con.execute(CREATE_POST_STATUS_INDEX_IF_NOT_EXISTS)
+        con.execute(CREATE_SETTING_TABLE_IF_NOT_EXISTS)
+
+        con.execute(CREATE_COUNT_TABLE_IF_NOT_EXISTS)
+        con.execute(INIT_COUNT_TABLE)
+        for trigger in CREATE_COUNT_TRIGGERS:
+            con.execute(trigger)
+
+def _add_missing_columns(con: sqlite3.Connection):
+    """Adds columns of 'ADDED_COLUMNS' not present yet in tasks table
+    """
+    cur = con.execute('PRAGMA table_info(download_task)')
+    existing = {row['name'] for row in cur.fetchall()}
+
+    for column, definition in ADDED_COLUMNS.items():
+        if column not in existing:
+            con.execute(
+                f'ALTER TABLE download_task ADD COLUMN {column} {definition}'
+            )
+
+def _backfill_hosts(con: sqlite3.Connection):
+    """Fills host of tasks created before it was stored"""
+    cur = con.execute('SELECT id, url FROM download_task WHERE host IS NULL')
+    con.executemany('UPDATE download_task SET host=:host WHERE id=:id', [
+        {'host': DownloadTask(row['url'], '').host, 'id': row['id']}
+        for row in cur.fetchall()
+    ])
+
+def _backfill_dedup_keys(con: sqlite3.Connection):
+    """Fills url and hash keys of tasks created before they were stored"""
+    cur = con.execute(
+        'SELECT id, url, file_hash FROM download_task WHERE url_key IS NULL'
+    )
+    con.executemany(
+        'UPDATE download_task SET url_key=:url_key, hash_key=:hash_key '
+        'WHERE id=:id',
+        [{
+            'url_key': normalize_url(row['url']),
+            'hash_key': hashing.hash_key(row['file_hash']),
+            'id': row['id']
+        } for row in cur.fetchall()]
+    )
 
 def save(dtask: DownloadTask):
     """Upserts a download task into database. If id is greater than 0,
@@ -122,19 +578,438 @@ def save(dtask: DownloadTask):
                 "downloaded_size": dtask.downloaded_size,
                 "status": dtask.status.value,
                 "err_message": dtask.err_message,
+                "etag": dtask.etag,
+                "last_modified": dtask.last_modified,
+                "post_process": _dump_post_process(dtask),
+                "post_status": _post_status_value(dtask),
+                "retries": dtask.retries,
+                "retry_at": dtask.retry_at,
+                "attempts": json.dumps(dtask.attempts) if dtask.attempts else None,
+                "source": dtask.source,
+                "queued": DownloadStatus.QUEUED.value,
+                "now": time.time(),
                 "id": dtask.id
             })
         else:
-            cur = con.execute(INSERT_DTASK, {
-                "url": dtask.url,
-                "target_path": dtask.target_path,
-                "total_size": dtask.total_size,
-                "downloaded_size": dtask.downloaded_size,
-                "status": dtask.status.value,
-                "file_hash": dtask.file_hash
+            cur = con.execute(INSERT_DTASK, _insert_params(dtask))
+            dtask.id = cur.lastrowid
+
+def save_many(
+    dtasks: list[DownloadTask],
+    followers: list[tuple[DownloadTask, DownloadTask]] = None
+):
+    """Inserts given (new) download tasks within a single transaction.
+    Ids are updated in given objects as a side effect.
+
+    Args:
+        dtasks (list[DownloadTask]): Tasks to insert into database
+        followers (list[tuple[DownloadTask, DownloadTask]]): New tasks
+            attached to one of 'dtasks', as (task, source) pairs. They
+            are inserted after 'dtasks', within same transaction
+    """
+    followers = followers or []
+    if not dtasks and not followers:
+        return
+
+    with _db_con() as con:
+        # Immediate transaction keeps any other writer from taking ids
+        # in between, so inserted ids are consecutive
+        con.execute('BEGIN IMMEDIATE')
+        _insert_many(con, dtasks)
+
+        for follower, source in followers:
+            follower.attached_to = source.id
+        _insert_many(con, [follower for follower, _ in followers])
+
+def _insert_many(con: sqlite3.Connection, dtasks: list[DownloadTask]):
+    if not dtasks:
+        return
+
+    con.executemany(INSERT_DTASK, [_insert_params(dtask) for dtask in dtasks])
+
+    last_id = con.execute('SELECT last_insert_rowid()').fetchone()[0]
+    first_id = last_id - len(dtasks) + 1
+    for offset, dtask in enumerate(dtasks):
+        dtask.id = first_id + offset
+
+def _insert_params(dtask: DownloadTask) -> dict:
+    return {
+        "url": dtask.url,
+        "target_path": dtask.target_path,
+        "total_size": dtask.total_size,
+        "downloaded_size": dtask.downloaded_size,
+        "status": dtask.status.value,
+        "file_hash": dtask.file_hash,
+        "max_rate": dtask.max_rate,
+        "priority": dtask.priority,
+        "host": dtask.host,
+        "now": time.time(),
+        "attached_to": dtask.attached_to,
+        "url_key": normalize_url(dtask.url),
+        "content_key": dtask.content_key,
+        "hash_key": hashing.hash_key(dtask.file_hash),
+        "post_process": _dump_post_process(dtask),
+        "post_status": _post_status_value(dtask),
+        "extract_to": dtask.extract_to,
+        "keep_archive": int(dtask.keep_archive),
+        "mirrors": json.dumps(dtask.mirrors) if dtask.mirrors else None
+    }
+
+def _dump_post_process(dtask: DownloadTask) -> str:
+    if dtask.post_process is None:
+        return None
+    return json.dumps(dtask.post_process)
+
+def _post_status_value(dtask: DownloadTask) -> str:
+    return dtask.post_status.value if dtask.post_status else None
+
+def save_progress_many(dtasks: list[DownloadTask]):
+    """Updates size fields (and content validators and source mirror,
+    which are written together with the bytes they apply to) of given
+    (already persisted) tasks within a single transaction. Status and
+    error message are not touched, so progress writes never override
+    external status changes.
+
+    Args:
+        dtasks (list[DownloadTask]): Tasks which progress will be saved
+    """
+    if not dtasks:
+        return
+
+    with _db_con() as con:
+        con.executemany(UPDATE_DTASK_PROGRESS, [{
+            "total_size": dtask.total_size,
+            "downloaded_size": dtask.downloaded_size,
+            "etag": dtask.etag,
+            "last_modified": dtask.last_modified,
+            "source": dtask.source,
+            "id": dtask.id
+        } for dtask in dtasks])
+
+def save_post_process(dtask: DownloadTask):
+    """Updates post-processing stages and status of given task, and its
+    target path as stages may move downloaded file. Kept apart from
+    'save' as post-processing runs once download is over
+    """
+    with _db_con() as con:
+        con.execute(UPDATE_POST_PROCESS, {
+            'target_path': dtask.target_path,
+            'post_process': _dump_post_process(dtask),
+            'post_status': _post_status_value(dtask),
+            'id': dtask.id
+        })
+
+def find_post_process_leases() -> list[tuple[int, str, float]]:
+    """Returns (id, lease owner, lease expiration) of completed tasks
+    whose post-processing is pending or running
+    """
+    with _db_con() as con:
+        cur = con.execute(FIND_POST_PROCESS_LEASES, {
+            'pending': PostProcessStatus.PENDING.value,
+            'running': PostProcessStatus.RUNNING.value,
+            'completed': DownloadStatus.COMPLETED.value
+        })
+        return [
+            (row['id'], row['lease_owner'], row['lease_expires_at'])
+            for row in cur.fetchall()
+        ]
+
+def update_max_rate(dtask_id: int, max_rate: int):
+    """Updates bandwidth limit of given task. Kept apart from 'save' so
+    workers saving task status never override limits set through api
+    """
+    with _db_con() as con:
+        con.execute(UPDATE_DTASK_MAX_RATE, {
+            'max_rate': max_rate,
+            'id': dtask_id
+        })
+
+def update_priority(dtask_id: int, priority: int):
+    with _db_con() as con:
+        con.execute(UPDATE_DTASK_PRIORITY, {
+            'priority': priority,
+            'id': dtask_id
+        })
+
+def claim_for_dispatch(max_running: int, max_per_host: int) -> list[int]:
+    """Picks queued tasks that can be started right now and flags them
+    as dispatched, all within a single (immediate) transaction.
+
+    Tasks are picked by descending priority and then by creation order,
+    skipping those whose host already reached 'max_per_host' running
+    downloads, until 'max_running' downloads are running. Tasks whose
+    retry delay is not over yet are skipped, see 'retry' module.
+
+    Returns:
+        list[int]: Ids of picked tasks, in dispatch order
+    """
+    params = {
+        'in_progress': DownloadStatus.IN_PROGRESS.value,
+        'queued': DownloadStatus.QUEUED.value,
+        'now': time.time()
+    }
+    batch_size = 100
+
+    with _db_con() as con:
+        con.execute('BEGIN IMMEDIATE')
+
+        cur = con.execute(COUNT_RUNNING_BY_HOST, params)
+        running = {row['host']: row['running'] for row in cur.fetchall()}
+        free_slots = max_running - sum(running.values())
+
+        claimed = []
+        offset = 0
+        while free_slots > 0:
+            cur = con.execute(FIND_DISPATCH_CANDIDATES, {
+                **params,
+                'limit': batch_size,
+                'offset': offset
             })
+            rows = cur.fetchall()
 
-            dtask.id = cur.lastrowid
+            for row in rows:
+                if free_slots <= 0:
+                    break
+                if running.get(row['host'], 0) >= max_per_host:
+                    continue
+
+                claimed.append(row['id'])
+                running[row['host']] = running.get(row['host'], 0) + 1
+                free_slots -= 1
+
+            if len(rows) < batch_size:
+                break
+            offset += batch_size
+
+        con.executemany(MARK_DISPATCHED, [
+            {'id': i, 'now': params['now']} for i in claimed
+        ])
+        return claimed
+
+def release_dispatch(dtask_id: int):
+    """Gives back download slot claimed by a queued task whose download
+    could not start, so it can be dispatched again
+    """
+    with _db_con() as con:
+        con.execute(RELEASE_DISPATCH, {
+            'id': dtask_id,
+            'queued': DownloadStatus.QUEUED.value
+        })
+
+def acquire_lease(dtask_id: int, owner: str, ttl: float) -> bool:
+    """Takes lease of given task for 'ttl' seconds, unless another
+    owner holds a lease that has not expired yet
+
+    Returns:
+        bool: True if lease was taken
+    """
+    now = time.time()
+    with _db_con() as con:
+        cur = con.execute(ACQUIRE_LEASE, {
+            'id': dtask_id,
+            'owner': owner,
+            'expires_at': now + ttl,
+            'now': now
+        })
+        return cur.rowcount == 1
+
+def renew_leases(dtask_ids: list[int], owner: str, ttl: float) -> list[int]:
+    """Extends leases of given tasks held by owner, within a single
+    transaction
+
+    Returns:
+        list[int]: Ids of tasks whose lease is no longer held by owner
+    """
+    expires_at = time.time() + ttl
+    lost = []
+
+    with _db_con() as con:
+        for dtask_id in dtask_ids:
+            cur = con.execute(RENEW_LEASE, {
+                'id': dtask_id,
+                'owner': owner,
+                'expires_at': expires_at
+            })
+            if cur.rowcount == 0:
+                lost.append(dtask_id)
+
+    return lost
+
+def release_lease(dtask_id: int, owner: str):
+    with _db_con() as con:
+        con.execute(RELEASE_LEASE, {'id': dtask_id, 'owner': owner})
+
+def find_leases(status: DownloadStatus) -> list[tuple[int, str, float]]:
+    """Returns (id, lease owner, lease expiration) of tasks in
+    given status
+    """
+    with _db_con() as con:
+        cur = con.execute(FIND_LEASES_BY_STATUS, {'status': status.value})
+        return [
+            (row['id'], row['lease_owner'], row['lease_expires_at'])
+            for row in cur.fetchall()
+        ]
+
+def requeue_abandoned(leases: list[tuple[int, str, float]]) -> list[int]:
+    """Puts back in queue given running tasks, as returned by
+    'find_leases', unless their lease changed since it was read
+
+    Returns:
+        list[int]: Ids of re-queued tasks
+    """
+    requeued = []
+    with _db_con() as con:
+        for dtask_id, owner, expires_at in leases:
+            cur = con.execute(REQUEUE_ABANDONED, {
+                'id': dtask_id,
+                'owner': owner,
+                'expires_at': expires_at,
+                'queued': DownloadStatus.QUEUED.value,
+                'in_progress': DownloadStatus.IN_PROGRESS.value,
+                'now': time.time()
+            })
+            if cur.rowcount == 1:
+                requeued.append(dtask_id)
+
+    return requeued
+
+def find_stale_dispatches(
+    claimed_before: float
+) -> list[tuple[int, str, float]]:
+    """Returns (id, lease owner, lease expiration) of queued tasks
+    claimed for dispatch before given time, whose download did not
+    start (e.g. worker died before consuming its download message)
+    """
+    with _db_con() as con:
+        cur = con.execute(FIND_STALE_DISPATCHES, {
+            'queued': DownloadStatus.QUEUED.value,
+            'claimed_before': claimed_before
+        })
+        return [
+            (row['id'], row['lease_owner'], row['lease_expires_at'])
+            for row in cur.fetchall()
+        ]
+
+def release_stale_dispatches(
+    leases: list[tuple[int, str, float]],
+    claimed_before: float
+) -> list[int]:
+    """Makes given tasks, as returned by 'find_stale_dispatches',
+    available for dispatch again unless their lease or claim changed
+    since they were read
+
+    Returns:
+        list[int]: Ids of released tasks
+    """
+    released = []
+    with _db_con() as con:
+        for dtask_id, owner, expires_at in leases:
+            cur = con.execute(RELEASE_STALE_DISPATCH, {
+                'id': dtask_id,
+                'owner': owner,
+                'expires_at': expires_at,
+                'queued': DownloadStatus.QUEUED.value,
+                'claimed_before': claimed_before
+            })
+            if cur.rowcount == 1:
+                released.append(dtask_id)
+
+    return released
+
+def find_by_key(
+    key_column: str,
+    key: str,
+    statuses: list[DownloadStatus],
+    limit: int = 5
+) -> list[DownloadTask]:
+    """Finds tasks in given statuses whose dedup key (one of
+    'DEDUP_KEY_COLUMNS') matches, newest first. Attached tasks are
+    skipped, so only tasks fetching their own content are returned
+    """
+    if key_column not in DEDUP_KEY_COLUMNS:
+        raise ValueError(f'Invalid dedup key column: {key_column}')
+
+    placeholders = ','.join('?' * len(statuses))
+    query = f"""
+        SELECT * FROM download_task
+        WHERE {key_column} = ? AND status IN ({placeholders})
+        AND attached_to IS NULL
+        ORDER BY id DESC
+        LIMIT ?
+    """
+
+    with _db_con() as con:
+        cur = con.execute(query, [key] + [s.value for s in statuses] + [limit])
+        return [_map_row_to_dtask(row) for row in cur.fetchall()]
+
+def find_by_keys(
+    keys: dict[str, list[str]],
+    statuses: list[DownloadStatus]
+) -> list[DownloadTask]:
+    """Same as 'find_by_key' for many keys at once, given by dedup key
+    column. Tasks matching any of them are found with a single query,
+    and are not limited in number
+    """
+    lookups = []
+    params = []
+    for key_column, column_keys in keys.items():
+        if key_column not in DEDUP_KEY_COLUMNS:
+            raise ValueError(f'Invalid dedup key column: {key_column}')
+        if column_keys:
+            # Keys are passed as a single json array, so batch size is
+            # not bound by the number of query parameters. One lookup
+            # per column lets each one use its index
+            lookups.append(
+                f'SELECT id FROM download_task WHERE {key_column} '
+                'IN (SELECT value FROM json_each(?))'
+            )
+            params.append(json.dumps(list(column_keys)))
+
+    if not lookups:
+        return []
+
+    placeholders = ','.join('?' * len(statuses))
+    query = f"""
+        SELECT * FROM download_task
+        WHERE id IN ({' UNION ALL '.join(lookups)})
+        AND status IN ({placeholders})
+        AND attached_to IS NULL
+        ORDER BY id DESC
+    """
+
+    with _db_con() as con:
+        cur = con.execute(query, params + [s.value for s in statuses])
+        return [_map_row_to_dtask(row) for row in cur.fetchall()]
+
+def find_followers(source_id: int) -> list[DownloadTask]:
+    """Returns tasks attached to given one"""
+    with _db_con() as con:
+        cur = con.execute(FIND_FOLLOWERS, {'source_id': source_id})
+        return [_map_row_to_dtask(row) for row in cur.fetchall()]
+
+def attach_many(pairs: list[tuple[int, int]]):
+    """Attaches tasks to their source, given (task id, source id) pairs"""
+    with _db_con() as con:
+        con.executemany(ATTACH, [
+            {'id': dtask_id, 'source_id': source_id}
+            for dtask_id, source_id in pairs
+        ])
+
+def detach_followers(source_id: int):
+    """Releases tasks attached to given one, so they are downloaded
+    on their own
+    """
+    with _db_con() as con:
+        con.execute(DETACH_FOLLOWERS, {'source_id': source_id})
+
+def get_setting(key: str, default: str = None) -> str:
+    with _db_con() as con:
+        row = con.execute(FIND_SETTING, {'key': key}).fetchone()
+        return row['value'] if row else default
+
+def set_setting(key: str, value: str):
+    with _db_con() as con:
+        con.execute(UPSERT_SETTING, {'key': key, 'value': value})
 
 def paginate(page_size: int = 30, page: int = 1) -> list[DownloadTask]:
     with _db_con() as con:
@@ -151,13 +1026,86 @@ def paginate(page_size: int = 30, page: int = 1) -> list[DownloadTask]:
         rows = cur.fetchall()
         return list(map(_map_row_to_dtask, rows))
 
-def count() -> int:
+def paginate_after(
+    page_size: int = 30,
+    after_id: int = 0,
+    status: DownloadStatus = None
+) -> list[DownloadTask]:
+    """Keyset pagination, retrieves up to 'page_size' tasks which id is
+    greater than 'after_id'. Unlike 'paginate', cost does not depend
+    on how deep requested page is.
+
+    Args:
+        page_size (int): Max number of tasks to retrieve
+        after_id (int): Id of last task in previous page
+        status (DownloadStatus): If given, only tasks with this
+            status will be retrieved
+
+    Returns:
+        list[DownloadTask]: Tasks sorted by id
+    """
+    with _db_con() as con:
+        if status:
+            cur = con.execute(FIND_BY_STATUS_AFTER_ID, {
+                'status': status.value,
+                'after_id': after_id,
+                'limit': page_size
+            })
+        else:
+            cur = con.execute(FIND_AFTER_ID, {
+                'after_id': after_id,
+                'limit': page_size
+            })
+
+        rows = cur.fetchall()
+        return list(map(_map_row_to_dtask, rows))
+
+def find_by_statuses(statuses: list[DownloadStatus]) -> list[DownloadTask]:
+    """Retrieves all the tasks in any of given statuses. Meant for
+    statuses with few tasks like 'In progress'
+    """
+    with _db_con() as con:
+        dtasks = []
+        for status in statuses:
+            cur = con.execute(FIND_BY_STATUS, {'status': status.value})
+            dtasks += map(_map_row_to_dtask, cur.fetchall())
+
+        return dtasks
+
+def find_by_ids(ids: list[int]) -> list[DownloadTask]:
+    if not ids:
+        return []
+
+    with _db_con() as con:
+        placeholders = ', '.join('?' * len(ids))
+        cur = con.execute(
+            f'SELECT * FROM download_task WHERE id IN ({placeholders})',
+            list(ids)
+        )
+        return list(map(_map_row_to_dtask, cur.fetchall()))
+
+def count(status: DownloadStatus = None) -> int:
     with _db_con() as conn:
-        cur = conn.execute(COUNT)
+        if status:
+            cur = conn.execute(COUNT_BY_STATUS, {'status': status.value})
+        else:
+            cur = conn.execute(COUNT)
         row = cur.fetchone()
 
         return row['total_count']
 
+def count_by_status() -> dict[DownloadStatus, int]:
+    """Returns number of tasks in every status, read from counters
+    table so it does not scan tasks
+    """
+    with _db_con() as con:
+        cur = con.execute(COUNT_GROUP_BY_STATUS)
+        counts = {status: 0 for status in DownloadStatus}
+        for row in cur.fetchall():
+            counts[DownloadStatus(row['status'])] = row['total']
+
+        return counts
+
 def find_by_id(id: int) -> DownloadTask:
     with _db_con() as con:
         cur = con.execute(FIND_BY_ID, {'id': id})
@@ -189,6 +1137,26 @@ def _map_row_to_dtask(row: sqlite3.Row) -> DownloadTask:
     dtask.status = DownloadStatus(row['status'])
     dtask.file_hash = row['file_hash']
     dtask.err_message = row['err_message']
+    dtask.max_rate = row['max_rate']
+    dtask.priority = row['priority']
+    dtask.queued_at = row['queued_at']
+    dtask.attached_to = row['attached_to']
+    dtask.content_key = row['content_key']
+    dtask.etag = row['etag']
+    dtask.last_modified = row['last_modified']
+    if row['post_process']:
+        dtask.post_process = json.loads(row['post_process'])
+    if row['post_status']:
+        dtask.post_status = PostProcessStatus(row['post_status'])
+    dtask.extract_to = row['extract_to']
+    dtask.keep_archive = bool(row['keep_archive'])
+    dtask.retries = row['retries']
+    dtask.retry_at = row['retry_at']
+    if row['attempts']:
+        dtask.attempts = json.loads(row['attempts'])
+    if row['mirrors']:
+        dtask.mirrors = json.loads(row['mirrors'])
+    dtask.source = row['source']
 
     return dtask
 
@@ -12,7 +12,38 @@ class InvalidStatusTransitionError(Exception):
             f'{source_status.value} to {target_status.value}'
         )
 
+class InvalidPostProcessStateError(Exception):
+    def __init__(self, post_status: "PostProcessStatus") -> None:
+        Exception.__init__(self)
+        status = post_status.value if post_status else 'None'
+        self.message = (
+            f'Only failed post-processing can be retried, '
+            f'current status: {status}'
+        )
+
 class MetadataReqError(Exception):
     def __init__(self, message) -> None:
         Exception.__init__(self)
         self.message = f'Metadata request failed: {message}'
+
+class RangeNotSatisfiedError(Exception):
+    def __init__(self, url: str, status_code: int) -> None:
+        Exception.__init__(self)
+        self.message = (
+            f'Server did not honor range request for {url}, '
+            f'response status: {status_code}'
+        )
+
+    def __str__(self) -> str:
+        return self.message
+
+class ShortReadError(Exception):
+    def __init__(self, received: int, expected: int) -> None:
+        Exception.__init__(self)
+        self.message = (
+            f'Connection closed after {int(received)} '
+            f'of {int(expected)} bytes'
+        )
+
+    def __str__(self) -> str:
+        return self.message
@@ -0,0 +1,157 @@
+"""
+Inline verification of 'DownloadTask.file_hash'.
+
+Expected hashes are given as '<algorithm>:<hex digest>', e.g.
+'sha256:9f86d0...', bare hex digests are also accepted and their
+algorithm is inferred from digest length.
+
+Digest is computed as chunks are written. When a download is paused,
+hash state is kept in memory (see 'save_checkpoint') so resuming it
+in the same worker process does not need to re-read downloaded bytes.
+Otherwise, downloaded prefix is hashed once from disk when resuming.
+
+Checkpoints do not survive a process change: they are lost when the
+worker restarts, and a download resumed by another worker process (or
+node) re-hashes its prefix. They are dropped once their task fails or
+is deleted, see 'discard_checkpoint'.
+"""
+import hashlib
+import threading
+
+
+SUPPORTED_ALGORITHMS = ['sha256', 'sha1', 'md5']
+_ALGORITHMS_BY_HEX_LENGTH = {64: 'sha256', 40: 'sha1', 32: 'md5'}
+_READ_SIZE = 1024 * 1024
+
+
+class InvalidFileHashError(Exception):
+    def __init__(self, file_hash: str) -> None:
+        super().__init__(
+            f'Invalid file hash: {file_hash}, expected format is '
+            f'<{"|".join(SUPPORTED_ALGORITHMS)}>:<hex digest>'
+        )
+
+
+def parse_file_hash(file_hash: str) -> tuple[str, str]:
+    """Splits given file hash into algorithm and hex digest
+
+    Raises:
+        InvalidFileHashError: When hash format or algorithm are invalid
+
+    Returns:
+        tuple[str, str]: Algorithm name and lower case hex digest
+    """
+    if not isinstance(file_hash, str):
+        raise InvalidFileHashError(file_hash)
+
+    if ':' in file_hash:
+        algorithm, digest = file_hash.split(':', 1)
+        algorithm = algorithm.strip().lower()
+    else:
+        digest = file_hash
+        algorithm = _ALGORITHMS_BY_HEX_LENGTH.get(len(digest.strip()))
+
+    digest = digest.strip().lower()
+    if algorithm not in SUPPORTED_ALGORITHMS:
+        raise InvalidFileHashError(file_hash)
+
+    expected_length = hashlib.new(algorithm).digest_size * 2
+    if len(digest) != expected_length:
+        raise InvalidFileHashError(file_hash)
+
+    try:
+        bytes.fromhex(digest)
+    except ValueError as err:
+        raise InvalidFileHashError(file_hash) from err
+
+    return algorithm, digest
+
+
+def hash_key(file_hash: str) -> str:
+    """Canonical 'algorithm:digest' form of given file hash, used to
+    find files with same content. None if hash is missing or invalid
+    """
+    try:
+        return ':'.join(parse_file_hash(file_hash))
+    except InvalidFileHashError:
+        return None
+
+
+class StreamingHasher:
+
+    def __init__(self, file_hash: str, state=None, offset: int = 0) -> None:
+        self.algorithm, self.expected = parse_file_hash(file_hash)
+        self.state = state or hashlib.new(self.algorithm)
+        self.offset = offset
+
+    def update(self, data: bytes) -> None:
+        self.state.update(data)
+        self.offset += len(data)
+
+    def hexdigest(self) -> str:
+        return self.state.hexdigest()
+
+    def mismatch_message(self) -> str:
+        """Returns error description if computed digest does not match
+        expected one, None otherwise
+        """
+        actual = self.hexdigest()
+        if actual == self.expected:
+            return None
+
+        return (
+            f'File hash mismatch, expected {self.algorithm}:{self.expected} '
+            f'but downloaded file is {self.algorithm}:{actual}'
+        )
+
+
+_checkpoints: dict[int, StreamingHasher] = {}
+_checkpoints_lock = threading.Lock()
+
+
+def save_checkpoint(dtask_id: int, hasher: StreamingHasher) -> None:
+    """Keeps hash state of a stopped download, so it can be continued
+    if download is resumed by current process
+    """
+    with _checkpoints_lock:
+        _checkpoints[dtask_id] = hasher
+
+def discard_checkpoint(dtask_id: int) -> None:
+    with _checkpoints_lock:
+        _checkpoints.pop(dtask_id, None)
+
+def resume_hasher(
+    dtask_id: int,
+    file_hash: str,
+    target_path: str,
+    offset: int
+) -> StreamingHasher:
+    """Creates the hasher for a download starting (or resuming) at
+    given offset. A checkpoint taken at same offset is reused, otherwise
+    first 'offset' bytes of target path are read and hashed.
+    """
+    with _checkpoints_lock:
+        checkpoint = _checkpoints.pop(dtask_id, None)
+
+    if checkpoint and checkpoint.offset == offset:
+        return checkpoint
+
+    hasher = StreamingHasher(file_hash)
+    if offset:
+        with open(target_path, 'rb') as source:
+            while hasher.offset < offset:
+                data = source.read(min(_READ_SIZE, offset - hasher.offset))
+                if not data:
+                    break
+                hasher.update(data)
+
+    return hasher
+
+def hash_file(file_hash: str, target_path: str) -> StreamingHasher:
+    """Hashes whole content of given file"""
+    hasher = StreamingHasher(file_hash)
+    with open(target_path, 'rb') as source:
+        for data in iter(lambda: source.read(_READ_SIZE), b''):
+            hasher.update(data)
+
+    return hasher
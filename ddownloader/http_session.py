@@ -0,0 +1,80 @@
+"""
+Shared HTTP session with keep-alive connection pools per host, so
+consecutive requests to the same origin (metadata probes, downloads,
+range requests) skip TCP and TLS handshakes.
+"""
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from ddownloader import config_loader as dconfig
+
+
+class SessionManager:
+    """Hands out a single 'requests.Session' per process. Session is
+    discarded, closing all its idle connections, when it has not been
+    used for more than 'max_idle' seconds.
+    """
+
+    def __init__(
+        self,
+        pool_hosts: int = None,
+        pool_size: int = None,
+        max_idle: float = None
+    ) -> None:
+        self.pool_hosts = pool_hosts or dconfig.http_pool_hosts()
+        self.pool_size = pool_size or dconfig.http_pool_size()
+        self.max_idle = max_idle if max_idle is not None \
+            else dconfig.http_max_idle()
+
+        self._lock = threading.Lock()
+        self._session: requests.Session = None
+        self._pid: int = None
+        self._last_used = 0.0
+
+    def get(self) -> requests.Session:
+        with self._lock:
+            now = time.monotonic()
+            expired = now - self._last_used > self.max_idle
+
+            if self._session is None or expired or self._pid != os.getpid():
+                self._close_locked()
+                self._session = self._create()
+                self._pid = os.getpid()
+
+            self._last_used = now
+            return self._session
+
+    def close(self) -> None:
+        with self._lock:
+            self._close_locked()
+
+    def _create(self) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_hosts,
+            pool_maxsize=self.pool_size
+        )
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def _close_locked(self) -> None:
+        # Sessions inherited through fork share sockets with parent
+        if self._session is not None and self._pid == os.getpid():
+            self._session.close()
+        self._session = None
+
+
+_manager = SessionManager()
+
+
+def get_session() -> requests.Session:
+    """Returns the http session shared by current process"""
+    return _manager.get()
+
+def close() -> None:
+    _manager.close()
@@ -0,0 +1,277 @@
+"""
+Heartbeat leases held by workers on the tasks they are downloading.
+
+A worker takes the lease of a task before starting its download and a
+background thread renews leases of all running downloads of the
+process. If a worker dies, its leases expire and 'recover_abandoned'
+puts its tasks back in queue, to be resumed from bytes on disk. Tasks
+claimed for dispatch whose download never started (worker died before
+consuming its message) are made available for dispatch again.
+
+Workers of several nodes may share tasks database and downloads
+volume: leases are owned by '<worker id>:<pid>' and, as a second line
+of defense, target files are locked while being written, see
+'TargetLocks'.
+"""
+import fcntl
+import os
+import threading
+import time
+
+import ddownloader.dtask_repository as dtask_repo
+from ddownloader import config_loader as dconfig
+from ddownloader.downloader import DownloadStatus
+from ddownloader.log_utils import logger
+
+
+def owner_id() -> str:
+    """Identifies current worker process as lease owner"""
+    return f'{dconfig.worker_id()}:{os.getpid()}'
+
+
+class LeaseKeeper:
+    """Takes, renews and releases leases of the tasks downloaded by
+    current process. Leases are renewed every third of their ttl, so a
+    couple of failed renewals do not lose them.
+    """
+
+    def __init__(self, ttl: float = None) -> None:
+        self.ttl = ttl or dconfig.lease_ttl()
+
+        self._lock = threading.Lock()
+        self._held: set[int] = set()
+        self._thread: threading.Thread = None
+        self._thread_pid: int = None
+
+    def acquire(self, dtask_id: int) -> bool:
+        """Takes lease of given task
+
+        Returns:
+            bool: False if lease is held by another live worker, or
+                task is already being downloaded by current process
+        """
+        if self.holds(dtask_id):
+            return False
+
+        if not dtask_repo.acquire_lease(dtask_id, owner_id(), self.ttl):
+            return False
+
+        with self._lock:
+            self._held.add(dtask_id)
+            self._ensure_heartbeat()
+        return True
+
+    def holds(self, dtask_id: int) -> bool:
+        with self._lock:
+            return dtask_id in self._held
+
+    def release(self, dtask_id: int) -> None:
+        with self._lock:
+            self._held.discard(dtask_id)
+        dtask_repo.release_lease(dtask_id, owner_id())
+
+    def renew(self) -> None:
+        with self._lock:
+            held = list(self._held)
+        if not held:
+            return
+
+        for dtask_id in dtask_repo.renew_leases(held, owner_id(), self.ttl):
+            logger.warning(
+                'Lease of task %s was lost, another worker may resume it',
+                dtask_id
+            )
+            with self._lock:
+                self._held.discard(dtask_id)
+
+    def _ensure_heartbeat(self) -> None:
+        if self._thread_pid == os.getpid() and self._thread.is_alive():
+            return
+
+        self._thread = threading.Thread(
+            target=self._heartbeat_loop,
+            name='ddownloader-leases',
+            daemon=True
+        )
+        self._thread_pid = os.getpid()
+        self._thread.start()
+
+    def _heartbeat_loop(self) -> None:
+        while True:
+            time.sleep(self.ttl / 3)
+            try:
+                self.renew()
+            except dtask_repo.DBError as err:
+                logger.warning('Unable to renew leases: %s', err)
+
+
+class TargetLocks:
+    """Exclusive locks on target files of running downloads, so two
+    workers (of any node sharing downloads volume) never write the same
+    file. A lock file is created next to every target and locked with
+    'flock', which network file systems like NFS honor across nodes.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._held: dict[int, tuple[str, int]] = {}
+        self._paths: set[str] = set()
+
+    def acquire(self, dtask_id: int, target_path: str) -> bool:
+        """Locks target file of given task
+
+        Returns:
+            bool: False if it is being written by another download
+        """
+        lock_path = lock_path_of(target_path)
+
+        # Locks taken through different descriptors of the same process
+        # do not exclude each other on every file system
+        with self._lock:
+            if lock_path in self._paths:
+                return False
+            self._paths.add(lock_path)
+
+        fd = _lock_file(lock_path)
+        with self._lock:
+            if fd is None:
+                self._paths.discard(lock_path)
+                return False
+
+            self._held[dtask_id] = (lock_path, fd)
+        return True
+
+    def release(self, dtask_id: int) -> None:
+        with self._lock:
+            lock_path, fd = self._held.pop(dtask_id, (None, None))
+            self._paths.discard(lock_path)
+        if fd is None:
+            return
+
+        # Removed while still locked, see '_lock_file'
+        try:
+            os.remove(lock_path)
+        except FileNotFoundError:
+            pass
+        os.close(fd)
+
+
+def lock_path_of(target_path: str) -> str:
+    directory, name = os.path.split(target_path)
+    return os.path.join(directory, f'.{name}.ddlock')
+
+
+def _lock_file(lock_path: str) -> int:
+    """Opens and locks given lock file
+
+    Returns:
+        int: Descriptor of locked file, None if it is locked already
+    """
+    os.makedirs(os.path.dirname(lock_path) or '.', exist_ok=True)
+
+    while True:
+        fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+
+        # Holder may have removed file between open and lock, in such
+        # case the lock taken is on an unlinked file and is worthless
+        try:
+            current = os.stat(lock_path)
+        except FileNotFoundError:
+            current = None
+
+        locked = os.fstat(fd)
+        if current and (current.st_dev, current.st_ino) \
+                == (locked.st_dev, locked.st_ino):
+            return fd
+
+        os.close(fd)
+
+
+keeper = LeaseKeeper()
+target_locks = TargetLocks()
+
+
+def recover_abandoned() -> list[int]:
+    """Puts back in queue running tasks whose worker is gone: tasks
+    whose lease expired, tasks without lease (started before leases
+    existed) and tasks leased by dead processes of current host.
+
+    Queued tasks claimed for dispatch more than a lease ttl ago, whose
+    download did not start and is not held by a live worker, are made
+    available for dispatch again.
+
+    Returns:
+        list[int]: Ids of re-queued and released tasks
+    """
+    abandoned = [
+        lease
+        for lease in dtask_repo.find_leases(DownloadStatus.IN_PROGRESS)
+        if is_abandoned(*lease)
+    ]
+    requeued = []
+    if abandoned:
+        requeued = dtask_repo.requeue_abandoned(abandoned)
+    if requeued:
+        logger.info('Re-queued abandoned tasks: %s', requeued)
+
+    released = release_unstarted(time.time() - dconfig.lease_ttl())
+    return requeued + released
+
+
+def release_unstarted(claimed_before: float = None) -> list[int]:
+    """Makes queued tasks claimed for dispatch before given time (any
+    time if not given), whose download is not held by a live worker,
+    available for dispatch again
+
+    Returns:
+        list[int]: Ids of released tasks
+    """
+    if claimed_before is None:
+        claimed_before = time.time()
+
+    stale = [
+        lease
+        for lease in dtask_repo.find_stale_dispatches(claimed_before)
+        if is_abandoned(*lease)
+    ]
+    released = []
+    if stale:
+        released = dtask_repo.release_stale_dispatches(stale, claimed_before)
+    if released:
+        logger.info('Released tasks never started by workers: %s', released)
+
+    return released
+
+
+def is_abandoned(dtask_id: int, owner: str, expires_at: float) -> bool:
+    """Checks if lease of given task is not held by a live worker"""
+    return (
+        owner is None
+        or expires_at < time.time()
+        or not _owner_alive(owner)
+
+        # Left by a previous process that had same pid as current one
+        or (owner == owner_id() and not keeper.holds(dtask_id))
+    )
+
+
+def _owner_alive(owner: str) -> bool:
+    """Checks if process holding a lease is alive. Owners from other
+    nodes are assumed alive until their lease expires
+    """
+    worker, _, pid = owner.rpartition(':')
+    if worker != dconfig.worker_id() or not pid.isdigit():
+        return True
+
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
@@ -0,0 +1,361 @@
+"""
+Lightweight, in process metrics rendered in Prometheus text format.
+
+Updating a metric only takes a lock and a dict update, so metrics are
+safe to update from download loops. Every process periodically writes
+a snapshot of its metrics into 'config_loader.metrics_dir()' (see
+'start_exporter'), and the process serving '/metrics' merges snapshots
+of all of them: counters, gauges and histograms are summed.
+"""
+import contextlib
+import json
+import math
+import os
+import threading
+import time
+from typing import Callable, Iterator
+
+from ddownloader import config_loader as dconfig
+from ddownloader.log_utils import logger
+
+
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+
+
+class _Metric:
+    type = None
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = ()
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+        self._lock = threading.Lock()
+        self._values: dict[tuple, float] = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def dump(self) -> dict:
+        with self._lock:
+            values = [[list(k), v] for k, v in self._values.items()]
+
+        return {
+            'type': self.type,
+            'help': self.documentation,
+            'labelnames': list(self.labelnames),
+            'values': values
+        }
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def replace(self, values: dict[tuple, float]) -> None:
+        """Replaces all samples at once, keyed by label values"""
+        with self._lock:
+            self._values = dict(values)
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        buckets: tuple = DEFAULT_BUCKETS
+    ) -> None:
+        super().__init__(name, documentation)
+        self.buckets = tuple(buckets)
+
+        self._counts = [0] * len(self.buckets)
+        self._sum = 0.0
+        self._count = 0
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            for idx, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self._counts[idx] += 1
+                    break
+            self._sum += value
+            self._count += 1
+
+    @contextlib.contextmanager
+    def time(self) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def dump(self) -> dict:
+        with self._lock:
+            return {
+                'type': self.type,
+                'help': self.documentation,
+                'buckets': list(self.buckets),
+                'counts': list(self._counts),
+                'sum': self._sum,
+                'count': self._count
+            }
+
+
+class TransferMeter:
+    """Accumulates bytes received by running downloads. On every
+    'collect' accumulated bytes are added into 'downloaded_bytes' and
+    rates since previous collect are set into 'task_rate' (per task)
+    and 'global_rate' gauges.
+    """
+
+    def __init__(
+        self,
+        downloaded_bytes: Counter,
+        task_rate: Gauge,
+        global_rate: Gauge
+    ) -> None:
+        self.downloaded_bytes = downloaded_bytes
+        self.task_rate = task_rate
+        self.global_rate = global_rate
+
+        self._lock = threading.Lock()
+        self._pending: dict[int, int] = {}
+        self._last_collect = time.monotonic()
+
+    def record(self, dtask_id: int, nbytes: int) -> None:
+        with self._lock:
+            self._pending[dtask_id] = self._pending.get(dtask_id, 0) + nbytes
+
+    def collect(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            now = time.monotonic()
+            elapsed = max(now - self._last_collect, 1e-6)
+            self._last_collect = now
+
+        # Tasks without received bytes since last collect are dropped
+        rates = {(str(k),): v / elapsed for k, v in pending.items()}
+        self.task_rate.replace(rates)
+        self.global_rate.set(sum(rates.values()))
+        self.downloaded_bytes.inc(sum(pending.values()))
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: dict[str, _Metric] = {}
+        self._collectors: list[Callable[[], None]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def add_collector(self, collector: Callable[[], None]) -> None:
+        """Adds a function invoked before taking every snapshot"""
+        self._collectors.append(collector)
+
+    def snapshot(self) -> dict:
+        for collector in self._collectors:
+            collector()
+
+        return {name: m.dump() for name, m in self._metrics.items()}
+
+
+registry = Registry()
+
+db_query_seconds = registry.register(Histogram(
+    'ddownloader_db_query_seconds',
+    'Duration of database transactions'
+))
+metadata_request_seconds = registry.register(Histogram(
+    'ddownloader_metadata_request_seconds',
+    'Duration of url metadata (HEAD) requests'
+))
+queue_wait_seconds = registry.register(Histogram(
+    'ddownloader_queue_wait_seconds',
+    'Time tasks spent queued before being started',
+    buckets=(1, 5, 15, 30, 60, 300, 900, 1800, 3600, 3 * 3600, 12 * 3600)
+))
+downloaded_bytes = registry.register(Counter(
+    'ddownloader_downloaded_bytes_total',
+    'Bytes received by downloads'
+))
+task_transfer_rate = registry.register(Gauge(
+    'ddownloader_task_transfer_rate_bytes',
+    'Transfer rate of running downloads in bytes per second',
+    labelnames=('dtask_id',)
+))
+transfer_rate = registry.register(Gauge(
+    'ddownloader_transfer_rate_bytes',
+    'Aggregated transfer rate in bytes per second'
+))
+
+transfer_meter = TransferMeter(
+    downloaded_bytes,
+    task_transfer_rate,
+    transfer_rate
+)
+registry.add_collector(transfer_meter.collect)
+
+
+_exporter: threading.Thread = None
+_exporter_pid: int = None
+_exporter_lock = threading.Lock()
+
+
+def start_exporter() -> None:
+    """Starts the background thread writing snapshots of current
+    process metrics. Safe to call several times, only one exporter
+    is started per process.
+    """
+    global _exporter, _exporter_pid
+
+    with _exporter_lock:
+        if _exporter_pid == os.getpid() and _exporter.is_alive():
+            return
+
+        os.makedirs(dconfig.metrics_dir(), exist_ok=True)
+        _exporter = threading.Thread(
+            target=_export_loop,
+            name='ddownloader-metrics',
+            daemon=True
+        )
+        _exporter_pid = os.getpid()
+        _exporter.start()
+
+
+def _export_loop() -> None:
+    while True:
+        time.sleep(dconfig.metrics_flush_interval())
+        try:
+            write_snapshot()
+        except OSError as err:
+            logger.warning('Unable to write metrics snapshot: %s', err)
+
+
+def write_snapshot() -> None:
+    path = _snapshot_path()
+    tmp_path = f'{path}.tmp'
+
+    with open(tmp_path, 'w') as snapshot_file:
+        json.dump(registry.snapshot(), snapshot_file)
+    os.replace(tmp_path, path)
+
+
+def collect_all() -> dict:
+    """Merges snapshot of current process with the ones written by
+    other processes. Snapshots not refreshed in a while belong to
+    processes that are gone, so they are removed.
+    """
+    snapshots = [registry.snapshot()]
+    metrics_dir = dconfig.metrics_dir()
+    max_age = dconfig.metrics_flush_interval() * 5
+
+    if os.path.isdir(metrics_dir):
+        for name in os.listdir(metrics_dir):
+            path = os.path.join(metrics_dir, name)
+            if not name.endswith('.json') or path == _snapshot_path():
+                continue
+
+            try:
+                if time.time() - os.path.getmtime(path) > max_age:
+                    os.remove(path)
+                    continue
+
+                with open(path) as snapshot_file:
+                    snapshots.append(json.load(snapshot_file))
+            except (OSError, ValueError):
+                continue
+
+    return merge(snapshots)
+
+
+def merge(snapshots: list[dict]) -> dict:
+    merged = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            if name not in merged:
+                merged[name] = json.loads(json.dumps(metric))
+                continue
+
+            target = merged[name]
+            if metric['type'] == 'histogram':
+                target['counts'] = [
+                    a + b for a, b in zip(target['counts'], metric['counts'])
+                ]
+                target['sum'] += metric['sum']
+                target['count'] += metric['count']
+            else:
+                values = {tuple(k): v for k, v in target['values']}
+                for key, value in metric['values']:
+                    values[tuple(key)] = values.get(tuple(key), 0) + value
+                target['values'] = [[list(k), v] for k, v in values.items()]
+
+    return merged
+
+
+def render(snapshot: dict) -> str:
+    """Renders given (merged) snapshot in Prometheus text format"""
+    lines = []
+    for name, metric in snapshot.items():
+        lines.append(f'# HELP {name} {metric["help"]}')
+        lines.append(f'# TYPE {name} {metric["type"]}')
+
+        if metric['type'] == 'histogram':
+            cumulative = 0
+            for bound, count in zip(metric['buckets'], metric['counts']):
+                cumulative += count
+                lines.append(
+                    f'{name}_bucket{{le="{_format(bound)}"}} {cumulative}'
+                )
+            lines.append(f'{name}_bucket{{le="+Inf"}} {metric["count"]}')
+            lines.append(f'{name}_sum {_format(metric["sum"])}')
+            lines.append(f'{name}_count {metric["count"]}')
+            continue
+
+        for label_values, value in metric['values']:
+            labels = ','.join(
+                f'{label}="{_escape(label_value)}"'
+                for label, label_value in zip(metric['labelnames'], label_values)
+            )
+            labels = f'{{{labels}}}' if labels else ''
+            lines.append(f'{name}{labels} {_format(value)}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def _format(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _snapshot_path() -> str:
+    return os.path.join(dconfig.metrics_dir(), f'{os.getpid()}.json')
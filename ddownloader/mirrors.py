@@ -0,0 +1,289 @@
+"""
+Downloads from a list of mirrors serving same file.
+
+Before a download starts, task url and its mirrors are probed
+concurrently: metadata (size and 'ETag') is read through the metadata
+path ('downloader.metadata') and a short range of the file is fetched
+to measure latency and throughput. See 'probe'.
+
+Only mirrors consistent with the content being downloaded are used, so
+bytes of different files are never mixed: mirrors must serve the same
+size and, when both sides send a strong 'ETag', the same one. Bytes
+already on disk are checked against size and 'ETag' stored on task.
+
+Mirrors are ranked by estimated time to fetch remaining bytes, the
+fastest one is downloaded from first. While downloading, it is left
+for the next one when it stalls, fails with a transient error (see
+'retry.classify'), or its throughput drops below a threshold, see
+'Sources.watch'. Download is resumed from bytes on disk through a
+range request to the new mirror.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import AsyncIterator, Iterator
+
+from requests.exceptions import RequestException
+
+from ddownloader import config_loader as dconfig
+from ddownloader import http_session, retry
+from ddownloader.downloader import DownloadTask, metadata
+from ddownloader.errors import MetadataReqError
+from ddownloader.log_utils import logger
+
+
+class SourceTooSlowError(Exception):
+    def __init__(self, url: str, rate: float, min_rate: float) -> None:
+        super().__init__()
+        self.message = (
+            f'Mirror {url} is too slow: {int(rate)} B/s, '
+            f'{int(min_rate)} B/s expected'
+        )
+
+    def __str__(self) -> str:
+        return self.message
+
+
+@dataclass
+class Probe:
+    url: str
+    content_length: int = 0
+    etag: str = None
+
+    # Seconds until sample response started, and sample bytes per
+    # second once started
+    latency: float = None
+    throughput: float = None
+
+    # Whether mirror serves byte ranges, required to resume from it
+    accepts_ranges: bool = False
+    error: str = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def eta(self, remaining: int) -> float:
+        """Estimated seconds to fetch given number of bytes"""
+        return self.latency + remaining / max(self.throughput, 1)
+
+
+def probe(url: str) -> Probe:
+    """Reads metadata of given url and measures its latency and
+    throughput by fetching first bytes of file
+    """
+    result = Probe(url)
+    try:
+        url_meta = metadata(url)
+        result.content_length = url_meta.content_length
+        result.etag = url_meta.etag
+
+        sample_size = dconfig.mirror_probe_bytes()
+        started = time.monotonic()
+        with http_session.get_session().get(
+            url,
+            stream=True,
+            headers={'Range': f'bytes=0-{sample_size - 1}'},
+            timeout=dconfig.mirror_probe_timeout()
+        ) as res:
+            res.raise_for_status()
+            result.latency = time.monotonic() - started
+            result.accepts_ranges = res.status_code == 206
+
+            received = 0
+            started = time.monotonic()
+            for chunk in res.iter_content(64 * 1024):
+                received += len(chunk)
+                if received >= sample_size:
+                    break
+
+            result.throughput = received / max(time.monotonic() - started, 1e-3)
+    except (MetadataReqError, RequestException, OSError) as err:
+        result.error = getattr(err, 'message', None) or str(err)
+
+    return result
+
+
+def probe_all(urls: list[str]) -> list[Probe]:
+    """Probes given urls concurrently, results are in same order"""
+    with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+        return list(executor.map(probe, urls))
+
+
+def _strong_etag(etag: str) -> str:
+    return etag if etag and not etag.startswith('W/') else None
+
+
+def consistent(probe_result: Probe, size: int, etag: str) -> bool:
+    """Checks that a mirror serves content of given size and 'ETag',
+    unknown values are not compared
+    """
+    if size and probe_result.content_length \
+            and probe_result.content_length != size:
+        return False
+
+    mirror_etag = _strong_etag(probe_result.etag)
+    return not (mirror_etag and _strong_etag(etag) and mirror_etag != etag)
+
+
+class Sources:
+    """Mirrors a task is downloaded from, fastest first. Current one is
+    set as task 'source'
+    """
+
+    def __init__(self, dtask: DownloadTask, candidates: list[Probe]) -> None:
+        self.dtask = dtask
+        self.candidates = candidates
+        self._current = 0
+        dtask.source = candidates[0].url
+
+    @property
+    def current(self) -> Probe:
+        return self.candidates[self._current]
+
+    def switch(self, err: Exception) -> bool:
+        """Moves task to next mirror if given error of current one is
+        transient. Mirrors following current one must serve byte ranges
+        if some bytes were downloaded already
+
+        Returns:
+            bool: False if error must stop download
+        """
+        if not isinstance(err, SourceTooSlowError) \
+                and not retry.classify(err).retryable:
+            return False
+
+        for idx in range(self._current + 1, len(self.candidates)):
+            candidate = self.candidates[idx]
+            if self.dtask.downloaded_size and not candidate.accepts_ranges:
+                continue
+
+            logger.warning(
+                'Task %s switches from mirror %s to %s: %s',
+                self.dtask.id,
+                self.current.url,
+                candidate.url,
+                err
+            )
+            self._current = idx
+            self.dtask.source = candidate.url
+            return True
+
+        return False
+
+    def min_rate(self) -> float:
+        """Throughput below which current mirror is left, 0 if there is
+        no mirror to switch to
+        """
+        if self._current + 1 >= len(self.candidates):
+            return 0
+
+        next_candidate = self.candidates[self._current + 1]
+        return max(
+            dconfig.mirror_min_rate(),
+            dconfig.mirror_switch_ratio() * next_candidate.throughput
+        )
+
+    def watch(self, chunks: Iterator) -> Iterator:
+        """Yields given chunks of current mirror, raises
+        'SourceTooSlowError' if it is too slow. Only time spent waiting
+        for chunks counts, so throttled downloads are not too slow
+        """
+        monitor = _RateMonitor(self.current.url, self.min_rate())
+        while True:
+            started = time.monotonic()
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                return
+
+            monitor.record(len(chunk), time.monotonic() - started)
+            yield chunk
+
+    async def watch_async(self, chunks: AsyncIterator) -> AsyncIterator:
+        """Same as 'watch', for chunks of asyncio engine"""
+        monitor = _RateMonitor(self.current.url, self.min_rate())
+        while True:
+            started = time.monotonic()
+            try:
+                chunk = await chunks.__anext__()
+            except StopAsyncIteration:
+                return
+
+            monitor.record(len(chunk), time.monotonic() - started)
+            yield chunk
+
+
+class _RateMonitor:
+    """Checks throughput every 'mirror_check_interval' seconds spent
+    receiving
+    """
+
+    def __init__(self, url: str, min_rate: float) -> None:
+        self.url = url
+        self.min_rate = min_rate
+        self.interval = dconfig.mirror_check_interval()
+
+        self._received = 0
+        self._elapsed = 0.0
+
+    def record(self, size: int, elapsed: float) -> None:
+        if not self.min_rate:
+            return
+
+        self._received += size
+        self._elapsed += elapsed
+        if self._elapsed < self.interval:
+            return
+
+        rate = self._received / self._elapsed
+        self._received = 0
+        self._elapsed = 0.0
+        if rate < self.min_rate:
+            raise SourceTooSlowError(self.url, rate, self.min_rate)
+
+
+def select(dtask: DownloadTask) -> Sources:
+    """Probes url and mirrors of given task and picks those consistent
+    with its content, fastest first. Task 'source' is set to fastest
+    one, or left as is if no mirror can be used
+
+    Returns:
+        Sources: None if task has no mirrors, or none of them can be
+            used
+    """
+    if not dtask.mirrors:
+        return None
+
+    urls = [dtask.url] + [url for url in dtask.mirrors if url != dtask.url]
+    probes = [p for p in probe_all(urls) if p.ok]
+    for failed in set(urls) - {p.url for p in probes}:
+        logger.info('Mirror %s of task %s is unavailable', failed, dtask.id)
+
+    # Bytes on disk set the content, otherwise task url does (or first
+    # available mirror)
+    if dtask.downloaded_size:
+        size, etag = dtask.total_size, dtask.etag
+        probes = [p for p in probes if p.accepts_ranges]
+    elif probes:
+        size, etag = probes[0].content_length, probes[0].etag
+    else:
+        return None
+
+    candidates = []
+    for candidate in probes:
+        if consistent(candidate, size, etag):
+            candidates.append(candidate)
+        else:
+            logger.warning(
+                'Mirror %s of task %s serves different content',
+                candidate.url,
+                dtask.id
+            )
+
+    if not candidates:
+        return None
+
+    remaining = max(size - dtask.downloaded_size, 0)
+    candidates.sort(key=lambda p: p.eta(remaining))
+    return Sources(dtask, candidates)
@@ -0,0 +1,369 @@
+"""
+Post-processing pipeline run on files of completed downloads.
+
+Every task may carry a list of stages (see 'DownloadTask.post_process')
+run in order once its download completes, e.g.:
+
+    [
+        {"stage": "verify"},
+        {"stage": "extract", "options": {"remove_archive": true}},
+        {"stage": "move", "options": {"to": "library/isos"}},
+        {"stage": "notify", "options": {"url": "http://host/hook"}}
+    ]
+
+Stages run in a bounded thread pool of worker process, apart from
+download workers, so finished downloads free their slot right away.
+Status of every stage is saved on the task; pipeline stops at first
+failed stage. A worker holds the lease of a task while processing it
+(see 'leases'), so pipelines of killed workers are resumed from first
+stage not done by 'recover'.
+
+New stages are plugged through 'register_stage'.
+"""
+import os
+import shutil
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable
+
+import requests
+from pathvalidate import is_valid_filename, is_valid_filepath
+
+import ddownloader.dtask_repository as dtask_repo
+from ddownloader import config_loader as dconfig
+from ddownloader import archives, hashing, http_session, leases
+from ddownloader.downloader import (
+    DownloadStatus,
+    DownloadTask,
+    PostProcessStatus
+)
+from ddownloader.log_utils import logger
+
+
+class PostProcessError(Exception):
+    def __init__(self, message: str) -> None:
+        super().__init__(message)
+        self.message = message
+
+
+@dataclass
+class Stage:
+    """A post-processing step
+
+    Attributes:
+        run: Processes file of given task with given options, returns
+            an optional message describing outcome. Raises
+            'PostProcessError' on failure
+        validate: Checks options given at task creation, raises
+            'PostProcessError' if they are invalid
+    """
+    name: str
+    run: Callable[[DownloadTask, dict], str]
+    validate: Callable[[dict], None] = None
+
+
+_stages: dict[str, Stage] = {}
+
+
+def register_stage(
+    name: str,
+    run: Callable[[DownloadTask, dict], str],
+    validate: Callable[[dict], None] = None
+) -> None:
+    _stages[name] = Stage(name, run, validate)
+
+
+def validate_pipeline(specs: list[dict]) -> None:
+    """Checks that every stage of given pipeline exists and that its
+    options are valid
+
+    Raises:
+        PostProcessError: If a stage is not valid
+    """
+    for spec in specs or []:
+        stage = _stages.get(spec.get('stage'))
+        if stage is None:
+            raise PostProcessError(
+                f"Unknown post-processing stage: {spec.get('stage')}"
+            )
+        if stage.validate:
+            stage.validate(spec.get('options') or {})
+
+
+def new_pipeline(specs: list[dict]) -> list[dict]:
+    """Builds (pending) stages of a task out of given specs"""
+    return [
+        {
+            'stage': spec['stage'],
+            'options': spec.get('options') or {},
+            'status': PostProcessStatus.PENDING.value,
+            'message': None
+        }
+        for spec in specs
+    ]
+
+
+class _Pool:
+    """Thread pool of current process, created on first use"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._executor: ThreadPoolExecutor = None
+        self._pid: int = None
+
+    def submit(self, dtask_id: int) -> Future:
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(
+                    max_workers=dconfig.post_process_workers(),
+                    thread_name_prefix='ddownloader-postprocess'
+                )
+                self._pid = os.getpid()
+
+            return self._executor.submit(run, dtask_id)
+
+
+_pool = _Pool()
+
+
+def start(dtask: DownloadTask) -> Future:
+    """Hands pipeline of given (completed) task over to pool
+
+    Returns:
+        Future: None if task has nothing to process
+    """
+    if dtask is None or dtask.status != DownloadStatus.COMPLETED \
+            or dtask.post_status != PostProcessStatus.PENDING:
+        return None
+
+    return _pool.submit(dtask.id)
+
+
+def recover() -> list[int]:
+    """Hands over to pool pipelines that are pending, or that were left
+    running by a worker that is gone
+
+    Returns:
+        list[int]: Ids of tasks whose pipeline was submitted
+    """
+    recovered = [
+        dtask_id
+        for dtask_id, owner, expires_at in dtask_repo.find_post_process_leases()
+        if leases.is_abandoned(dtask_id, owner, expires_at)
+    ]
+
+    for dtask_id in recovered:
+        _pool.submit(dtask_id)
+    return recovered
+
+
+def run(dtask_id: int) -> None:
+    """Runs stages of given task not done yet, in current thread"""
+    if not leases.keeper.acquire(dtask_id):
+        return
+
+    try:
+        dtask = dtask_repo.find_by_id(dtask_id)
+        if dtask is None or dtask.status != DownloadStatus.COMPLETED:
+            return
+        if dtask.post_status not in [
+            PostProcessStatus.PENDING,
+            PostProcessStatus.RUNNING
+        ]:
+            return
+
+        _run_stages(dtask)
+    except dtask_repo.DBError:
+        logger.exception('Post-processing of task %s failed', dtask_id)
+    finally:
+        leases.keeper.release(dtask_id)
+
+
+def _run_stages(dtask: DownloadTask) -> None:
+    dtask.post_status = PostProcessStatus.RUNNING
+    dtask_repo.save_post_process(dtask)
+
+    for step in dtask.post_process:
+        if step['status'] == PostProcessStatus.DONE.value:
+            continue
+
+        step['status'] = PostProcessStatus.RUNNING.value
+        dtask_repo.save_post_process(dtask)
+
+        failure = None
+        try:
+            stage = _stages.get(step['stage'])
+            if stage is None:
+                raise PostProcessError(f"Unknown stage: {step['stage']}")
+
+            step['message'] = stage.run(dtask, step['options'])
+        except PostProcessError as err:
+            failure = err.message
+        except Exception as err:  # pylint: disable=broad-except
+            # Stages are pluggable, any error just fails the stage
+            failure = str(err) or type(err).__name__
+
+        if failure:
+            logger.warning(
+                "Stage '%s' of task %s failed: %s",
+                step['stage'],
+                dtask.id,
+                failure
+            )
+            step['status'] = PostProcessStatus.FAILED.value
+            step['message'] = failure
+            dtask.post_status = PostProcessStatus.FAILED
+            dtask_repo.save_post_process(dtask)
+            return
+
+        step['status'] = PostProcessStatus.DONE.value
+        dtask_repo.save_post_process(dtask)
+
+    dtask.post_status = PostProcessStatus.DONE
+    dtask_repo.save_post_process(dtask)
+
+
+def retry(dtask: DownloadTask) -> None:
+    """Sets failed stages of given task back to pending, so pipeline
+    is resumed from first of them
+    """
+    for step in dtask.post_process or []:
+        if step['status'] != PostProcessStatus.DONE.value:
+            step['status'] = PostProcessStatus.PENDING.value
+            step['message'] = None
+
+    dtask.post_status = PostProcessStatus.PENDING
+    dtask_repo.save_post_process(dtask)
+
+
+# Built-in stages
+
+def _check_relative_path(options: dict, key: str) -> None:
+    value = options.get(key)
+    if value is None:
+        return
+
+    if not isinstance(value, str) or not is_valid_filepath(value) \
+            or '..' in value:
+        raise PostProcessError(f"'{key}' is not a valid relative path")
+
+
+def _validate_verify(options: dict) -> None:
+    if options.get('file_hash'):
+        try:
+            hashing.parse_file_hash(options['file_hash'])
+        except hashing.InvalidFileHashError as err:
+            raise PostProcessError(str(err)) from err
+
+
+def verify(dtask: DownloadTask, options: dict) -> str:
+    """Checks file on disk against expected size and, if known, its
+    hash. Given 'file_hash' option takes precedence over task one
+    """
+    size = os.path.getsize(dtask.target_path)
+    if dtask.total_size and size != dtask.total_size:
+        raise PostProcessError(
+            f'File has {size} bytes, {int(dtask.total_size)} were expected'
+        )
+
+    file_hash = options.get('file_hash') or dtask.file_hash
+    if not file_hash:
+        return 'Size verified'
+
+    mismatch = hashing.hash_file(file_hash, dtask.target_path) \
+        .mismatch_message()
+    if mismatch:
+        raise PostProcessError(mismatch)
+    return 'Hash verified'
+
+
+def _validate_extract(options: dict) -> None:
+    _check_relative_path(options, 'to')
+    if not isinstance(options.get('remove_archive', False), bool):
+        raise PostProcessError("'remove_archive' must be a boolean")
+
+
+def extract(dtask: DownloadTask, options: dict) -> str:
+    """Extracts archive (tar, optionally compressed, or zip) into 'to'
+    directory of downloads dir, or into a directory named after archive
+    next to it. Archive is removed if 'remove_archive' is set
+    """
+    if options.get('to'):
+        dest = Path(dconfig.downloads_dir(), options['to'])
+    else:
+        dest = Path(archives.default_dest(dtask.target_path))
+
+    try:
+        archives.extract_file(dtask.target_path, str(dest))
+    except archives.ExtractionError as err:
+        raise PostProcessError(err.message) from err
+
+    if options.get('remove_archive'):
+        os.remove(dtask.target_path)
+    return f'Extracted into {dest}'
+
+
+def _validate_move(options: dict) -> None:
+    if not options.get('to'):
+        raise PostProcessError("'to' directory is required")
+    _check_relative_path(options, 'to')
+
+    name = options.get('name')
+    if name is not None and (
+        not isinstance(name, str) or not is_valid_filename(name)
+    ):
+        raise PostProcessError("'name' is not a valid file name")
+
+
+def move(dtask: DownloadTask, options: dict) -> str:
+    """Moves file into 'to' directory of downloads dir, renamed to
+    'name' if given. Task target path is updated
+    """
+    dest = Path(
+        dconfig.downloads_dir(),
+        options['to'],
+        options.get('name') or os.path.basename(dtask.target_path)
+    )
+
+    if not os.path.exists(dtask.target_path):
+        # Moved already by an interrupted run
+        if not dest.exists():
+            raise PostProcessError('Downloaded file is missing')
+    elif dest != Path(dtask.target_path):
+        if dest.exists():
+            raise PostProcessError(f'Destination already exists: {dest}')
+
+        os.makedirs(dest.parent, exist_ok=True)
+        shutil.move(dtask.target_path, dest)
+
+    dtask.target_path = str(dest)
+    return f'Moved to {dest}'
+
+
+def _validate_notify(options: dict) -> None:
+    url = options.get('url')
+    if not isinstance(url, str) or not url.startswith(('http://', 'https://')):
+        raise PostProcessError("'url' must be an http(s) url")
+
+
+def notify(dtask: DownloadTask, options: dict) -> str:
+    """Posts task (as returned by api) to 'url' webhook"""
+    try:
+        res = http_session.get_session().post(
+            options['url'],
+            json={'event': 'completed', 'dtask': dtask.to_dict()},
+            timeout=dconfig.notify_timeout()
+        )
+        res.raise_for_status()
+    except requests.RequestException as err:
+        raise PostProcessError(f'Notification failed: {err}') from err
+
+    return f'Notified with status {res.status_code}'
+
+
+register_stage('verify', verify, _validate_verify)
+register_stage('extract', extract, _validate_extract)
+register_stage('move', move, _validate_move)
+register_stage('notify', notify, _validate_notify)
@@ -0,0 +1,138 @@
+"""
+Coalesced persistence of download progress
+"""
+import os
+import threading
+import time
+from typing import Callable
+
+import ddownloader.dtask_repository as dtask_repo
+from ddownloader import config_loader as dconfig
+from ddownloader.downloader import DownloadStatus, DownloadTask
+from ddownloader.log_utils import logger
+
+
+class ProgressReporter:
+    """Keeps download progress of running tasks in memory and writes it
+    into database in batches, once 'flush_interval' seconds elapsed or
+    'flush_bytes' were downloaded since last flush. A background thread
+    flushes progress left pending by tasks that stopped receiving
+    bytes (stalled or throttled ones).
+
+    Status transitions are written immediately, together with pending
+    progress of every other task.
+
+    Instances are thread safe and are meant to be shared by all the
+    downloads of a worker process. Database writes are done outside of
+    instance lock, so reporting progress never waits for a write of
+    another thread.
+    """
+
+    def __init__(
+        self,
+        flush_interval: float = None,
+        flush_bytes: int = None,
+        save_progress: Callable = dtask_repo.save_progress_many,
+        save_status: Callable = dtask_repo.save
+    ) -> None:
+        self.flush_interval = flush_interval \
+            if flush_interval is not None \
+            else dconfig.progress_flush_interval()
+        self.flush_bytes = flush_bytes \
+            if flush_bytes is not None \
+            else dconfig.progress_flush_bytes()
+
+        self._save_progress = save_progress
+        self._save_status = save_status
+
+        self._lock = threading.Lock()
+        self._pending: dict[int, DownloadTask] = {}
+        self._statuses: dict[int, DownloadStatus] = {}
+        self._sizes: dict[int, int] = {}
+        self._unflushed_bytes = 0
+        self._last_flush = time.monotonic()
+
+        self._flusher: threading.Thread = None
+        self._flusher_pid: int = None
+
+    def update(self, dtask: DownloadTask) -> None:
+        """Reports current state of given task. Use it as 'on_update'
+        callback of 'downloader.download'
+        """
+        pending = None
+        with self._lock:
+            status_changed = self._statuses.get(dtask.id) != dtask.status
+            self._statuses[dtask.id] = dtask.status
+
+            prev_size = self._sizes.get(dtask.id, dtask.downloaded_size)
+            self._sizes[dtask.id] = dtask.downloaded_size
+            self._unflushed_bytes += max(dtask.downloaded_size - prev_size, 0)
+
+            if status_changed:
+                self._pending.pop(dtask.id, None)
+                pending = self._take_pending_locked()
+
+                if dtask.status != DownloadStatus.IN_PROGRESS:
+                    self._forget(dtask.id)
+            else:
+                self._pending[dtask.id] = dtask
+                if self._should_flush():
+                    pending = self._take_pending_locked()
+                self._ensure_flusher_locked()
+
+        if pending is not None:
+            self._save_progress(pending)
+        if status_changed:
+            self._save_status(dtask)
+
+    def flush(self) -> None:
+        """Writes progress of all pending tasks into database"""
+        with self._lock:
+            pending = self._take_pending_locked()
+        self._save_progress(pending)
+
+    def _should_flush(self) -> bool:
+        elapsed = time.monotonic() - self._last_flush
+        return elapsed >= self.flush_interval \
+            or self._unflushed_bytes >= self.flush_bytes
+
+    def _take_pending_locked(self) -> list[DownloadTask]:
+        pending = list(self._pending.values())
+        self._pending.clear()
+        self._unflushed_bytes = 0
+        self._last_flush = time.monotonic()
+        return pending
+
+    def _ensure_flusher_locked(self) -> None:
+        if not self.flush_interval:
+            return
+        if self._flusher_pid == os.getpid() and self._flusher.is_alive():
+            return
+
+        self._flusher = threading.Thread(
+            target=self._flush_loop,
+            name='ddownloader-progress',
+            daemon=True
+        )
+        self._flusher_pid = os.getpid()
+        self._flusher.start()
+
+    def _flush_loop(self) -> None:
+        while True:
+            time.sleep(self.flush_interval)
+            with self._lock:
+                due = self._pending \
+                    and time.monotonic() - self._last_flush \
+                    >= self.flush_interval
+                pending = self._take_pending_locked() if due else None
+
+            if not pending:
+                continue
+            try:
+                self._save_progress(pending)
+            except dtask_repo.DBError as err:
+                logger.warning('Unable to save download progress: %s', err)
+
+    def _forget(self, dtask_id: int) -> None:
+        self._statuses.pop(dtask_id, None)
+        self._sizes.pop(dtask_id, None)
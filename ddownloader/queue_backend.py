@@ -0,0 +1,45 @@
+"""
+Creates the huey instance workers consume from. Task queue is kept
+apart from tasks database, so queue operations do not contend with
+progress writes for the same sqlite lock, see
+'config_loader.queue_backend'
+"""
+from huey import Huey, RedisHuey, SqliteHuey
+
+from ddownloader import config_loader as dconfig
+from ddownloader.log_utils import logger
+
+
+def create_huey(backend: str = None) -> Huey:
+    """Creates huey instance for given backend, configured one if not
+    given
+
+    Raises:
+        ValueError: If backend is unknown, or sqlite backend has no
+            database file configured
+    """
+    backend = backend or dconfig.queue_backend()
+    name = dconfig.queue_name()
+
+    if backend == 'sqlite':
+        # Huey would create its database in working directory otherwise
+        db_path = dconfig.queue_db_path()
+        if not db_path:
+            raise ValueError(
+                'Sqlite queue backend requires QUEUE_DB_PATH or DB_PATH'
+            )
+
+        logger.info('Huey database: %s', db_path)
+        return SqliteHuey(name, filename=db_path)
+
+    if backend == 'redis':
+        # pylint: disable=import-outside-toplevel
+        from redis import ConnectionPool
+
+        # Pool is built here as huey passes options to 'from_url' that
+        # recent redis clients dropped
+        logger.info('Huey redis server: %s', dconfig.queue_url())
+        pool = ConnectionPool.from_url(dconfig.queue_url())
+        return RedisHuey(name, connection_pool=pool)
+
+    raise ValueError(f'Unknown queue backend: {backend}')
@@ -0,0 +1,139 @@
+"""
+Receive path of downloads. Response bodies are read into reusable
+buffers taken from a bounded per process pool, so memory used to move
+bytes from sockets to files does not grow with the number of running
+downloads.
+"""
+import contextlib
+import threading
+import time
+from typing import Callable, Iterator
+
+import requests
+
+from ddownloader import config_loader as dconfig
+
+
+class BufferPool:
+    """Hands out up to 'max_buffers' buffers of 'buffer_size' bytes,
+    reusing released ones. Callers block while all of them are in use.
+    """
+
+    def __init__(self, buffer_size: int, max_buffers: int) -> None:
+        self.buffer_size = buffer_size
+        self.max_buffers = max_buffers
+
+        self._cond = threading.Condition()
+        self._free: list[bytearray] = []
+        self._allocated = 0
+
+    @contextlib.contextmanager
+    def buffer(self) -> Iterator[memoryview]:
+        buf = self._acquire()
+        try:
+            yield memoryview(buf)
+        finally:
+            self._release(buf)
+
+    def _acquire(self) -> bytearray:
+        with self._cond:
+            while not self._free and self._allocated >= self.max_buffers:
+                self._cond.wait()
+
+            if self._free:
+                return self._free.pop()
+
+            self._allocated += 1
+            return bytearray(self.buffer_size)
+
+    def _release(self, buf: bytearray) -> None:
+        with self._cond:
+            self._free.append(buf)
+            self._cond.notify()
+
+
+class ChunkSizer:
+    """Adapts size of reads to measured throughput, so each read takes
+    about 'target_interval' seconds: slow streams use small chunks and
+    still report progress (and notice pauses) often, fast streams use
+    big chunks and do fewer system calls and progress updates.
+    """
+
+    def __init__(
+        self,
+        min_size: int,
+        max_size: int,
+        target_interval: float = 0.25
+    ) -> None:
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_interval = target_interval
+        self.size = min_size
+
+    def record(self, nbytes: int, elapsed: float) -> None:
+        """Adjusts chunk size after reading 'nbytes' in 'elapsed' secs"""
+        if nbytes < self.size:
+            # Short reads tell nothing about throughput
+            return
+
+        if elapsed < self.target_interval / 2:
+            self.size = min(self.size * 2, self.max_size)
+        elif elapsed > self.target_interval * 2:
+            self.size = max(self.size // 2, self.min_size)
+
+
+_pool = BufferPool(dconfig.receive_buffer_size(), dconfig.receive_buffers())
+
+
+def buffer() -> contextlib.AbstractContextManager[memoryview]:
+    """Takes a buffer from process pool for the duration of context"""
+    return _pool.buffer()
+
+
+def iter_body(
+    res: requests.Response,
+    buf: memoryview,
+    max_read: Callable[[int], int] = None
+) -> Iterator[memoryview]:
+    """Yields body of given (streamed) response as views of given
+    buffer. Every view is only valid until next one is requested.
+
+    Args:
+        max_read (Callable[[int], int]): If given, called with size of
+            every read before doing it, returns a (smaller) size to use
+            instead, e.g. 'bandwidth.BandwidthGovernor.read_size'
+    """
+    readinto = _body_reader(res)
+    sizer = ChunkSizer(min(dconfig.receive_min_chunk(), len(buf)), len(buf))
+
+    while True:
+        size = max_read(sizer.size) if max_read else sizer.size
+        started = time.monotonic()
+        nbytes = readinto(buf[:size])
+        if not nbytes:
+            return
+
+        sizer.record(nbytes, time.monotonic() - started)
+        yield buf[:nbytes]
+
+
+def _body_reader(res: requests.Response) -> Callable[[memoryview], int]:
+    """Returns a function that fills given view with next bytes of
+    response body and returns the number of bytes read, 0 at the end.
+
+    Body is read through urllib3, which decodes it and returns the
+    connection to its pool once the body is over, so connections of a
+    session are reused.
+    """
+    raw = res.raw
+
+    def _read(view: memoryview) -> int:
+        # Decoders may hold back bytes until they get some more
+        data = b''
+        while not data and not raw.closed:
+            data = raw.read(len(view), decode_content=True)
+
+        view[:len(data)] = data
+        return len(data)
+
+    return _read
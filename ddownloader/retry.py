@@ -0,0 +1,107 @@
+"""
+Retry policy of downloads failed by transient errors.
+
+Network errors (connection errors, timeouts, connections closed before
+every byte was received) and transient server errors (see
+'config_loader.retry_statuses') are retried, any other error fails the
+download right away. See 'downloader.fail'.
+
+Retries wait for an exponential backoff with jitter, unless server asks
+for a delay through 'Retry-After'. Retried downloads resume from bytes
+already on disk.
+"""
+import asyncio
+import http.client
+import random
+import time
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+
+import aiohttp
+import requests
+import urllib3
+
+from ddownloader import config_loader as dconfig
+from ddownloader.errors import RangeNotSatisfiedError, ShortReadError
+
+
+# Failed attempts kept in task history, older ones are dropped
+MAX_HISTORY = 20
+
+_NETWORK_ERRORS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+    urllib3.exceptions.ProtocolError,
+    http.client.IncompleteRead,
+    http.client.HTTPException,
+    aiohttp.ClientConnectionError,
+    aiohttp.ClientPayloadError,
+    asyncio.TimeoutError,
+    ConnectionError,
+    ShortReadError,
+
+    # Content changed while downloading, next attempt starts over
+    RangeNotSatisfiedError
+)
+
+
+@dataclass
+class Failure:
+    message: str
+    retryable: bool
+
+    # Seconds to wait as requested by server, if any
+    retry_after: float = None
+
+
+def classify(err: BaseException) -> Failure:
+    """Tells whether given error of a download attempt is transient"""
+    status, headers = _http_status(err)
+    if status is not None:
+        return Failure(
+            f'Server responded with status {status}',
+            status in dconfig.retry_statuses(),
+            parse_retry_after(headers.get('Retry-After'))
+        )
+
+    message = str(err) or type(err).__name__
+    return Failure(message, isinstance(err, _NETWORK_ERRORS))
+
+
+def _http_status(err: BaseException) -> tuple[int, dict]:
+    if isinstance(err, requests.HTTPError) and err.response is not None:
+        return err.response.status_code, err.response.headers
+    if isinstance(err, aiohttp.ClientResponseError):
+        return err.status, err.headers or {}
+    return None, {}
+
+
+def parse_retry_after(value: str) -> float:
+    """Seconds to wait as told by a 'Retry-After' header, given either
+    as seconds or as an http date. None if value is missing or invalid
+    """
+    if not value:
+        return None
+
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff(retry: int) -> float:
+    """Seconds to wait before given retry (1 for first one): base delay
+    doubled on every retry, bounded by max delay. Half of it is random,
+    so tasks failed together are not retried together
+    """
+    delay = min(
+        dconfig.retry_base_delay() * 2 ** (retry - 1),
+        dconfig.retry_max_delay()
+    )
+    return delay / 2 + random.uniform(0, delay / 2)
@@ -0,0 +1,77 @@
+"""
+Target file handling: free space checks, preallocation and offset
+based writes
+"""
+import os
+import shutil
+
+
+class InsufficientSpaceError(Exception):
+    def __init__(self, target_path: str, needed: int, free: int) -> None:
+        self.message = (
+            f'Not enough free space to download {target_path}: '
+            f'{needed} bytes needed, {free} bytes available'
+        )
+        super().__init__(self.message)
+
+
+def check_free_space(target_path: str, total_size: int) -> None:
+    """Ensures that target file system can hold the bytes of given
+    target path that are not allocated yet
+
+    Raises:
+        InsufficientSpaceError: When there is not enough free space
+    """
+    allocated = 0
+    if os.path.exists(target_path):
+        allocated = os.path.getsize(target_path)
+
+    needed = total_size - allocated
+    if needed <= 0:
+        return
+
+    target_dir = os.path.dirname(os.path.abspath(target_path))
+    free = shutil.disk_usage(target_dir).free
+    if needed > free:
+        raise InsufficientSpaceError(target_path, needed, free)
+
+
+class TargetFile:
+    """Download target opened for writes at explicit offsets, safe to
+    share between threads. Existing content is never truncated.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+
+    def __enter__(self) -> 'TargetFile':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def preallocate(self, size: int) -> None:
+        """Reserves disk blocks for 'size' bytes, so file is laid out
+        contiguously and a full disk is detected upfront. File systems
+        without fallocate support just get a sparse file.
+        """
+        if os.fstat(self._fd).st_size >= size:
+            return
+
+        try:
+            os.posix_fallocate(self._fd, 0, size)
+        except (AttributeError, OSError):
+            os.ftruncate(self._fd, size)
+
+    def write_at(self, offset: int, data: bytes) -> None:
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(self._fd, view, offset)
+            view = view[written:]
+            offset += written
+
+    def close(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
@@ -1,21 +1,34 @@
-from flask import request
+import json
+
+from flask import Response, request, stream_with_context
 from flask.json import jsonify
 from ddownloader import downloader
 from ddownloader.downloader import DownloadStatus
 
 from ddownloader.errors import (
+    InvalidPostProcessStateError,
     InvalidStatusTransitionError,
     MetadataReqError
 )
-from ddownloader.web import dtask_service
+from ddownloader.web import dtask_service, metrics_service, settings_service
 from ddownloader.web.app import app
 from ddownloader.web.errors import (
     DDownloaderApiError,
+    DTaskNotFoundError,
     DTaskValidationError,
+    DTasksPageRequestValidationError,
+    SettingsValidationError,
     UrlMetadataRequestValidationError
 )
+from ddownloader.web.progress_stream import progress_hub, public_event
+from ddownloader.web.validators import validate_dtasks_batch
 from ddownloader.web.models import (
+    dtask_schema,
+    DownloadTaskRequest,
+    DownloadTasksPageRequest,
     PostDownloadTaskRequest,
+    PostDownloadTasksBatchRequest,
+    PutBandwidthSettingsRequest,
     PutDownloadTaskRequest,
     UrlMetadataRequest
 )
@@ -33,6 +46,7 @@ def on_metadata_req_error(err: MetadataReqError):
     res.status_code = 500
     return res
 
+@app.errorhandler(InvalidPostProcessStateError)
 @app.errorhandler(InvalidStatusTransitionError)
 def on_invalid_status_transition_error(err: InvalidStatusTransitionError):
     res = jsonify({
@@ -45,13 +59,58 @@ def on_invalid_status_transition_error(err: InvalidStatusTransitionError):
 
 @app.route('/tasks', methods=['GET'])
 def get_tasks():
-    page = request.args.get('page', 1)
-    page_size = request.args.get('page_size', 30)
+    inputs = DownloadTasksPageRequest(request)
+    if not inputs.validate():
+        raise DTasksPageRequestValidationError(inputs.errors[0])
+
+    page_size = request.args.get('page_size', 30, type=int)
 
-    dtasks_page = dtask_service.get_page(page, page_size)
+    # Offset pagination is kept for clients sending 'page'
+    if 'page' in request.args:
+        page = request.args.get('page', 1, type=int)
+        dtasks_page = dtask_service.get_page(page, page_size)
+        return jsonify(dtasks_page.to_dict())
+
+    status = request.args.get('status')
+    dtasks_page = dtask_service.get_page_after(
+        page_size,
+        after=request.args.get('after'),
+        status=DownloadStatus(status) if status else None
+    )
     return jsonify(dtasks_page.to_dict())
 
 
+@app.route('/tasks/stream', methods=['GET'])
+def stream_tasks():
+    """Server-Sent Events stream of progress and status changes of
+    download tasks. See 'progress_stream.ProgressHub'
+    """
+    subscription = progress_hub.subscribe()
+
+    def _events():
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                events = subscription.wait(timeout=15)
+                if not events:
+                    yield ': keep-alive\n\n'
+
+                for event in events:
+                    data = json.dumps(public_event(event))
+                    yield f'event: progress\ndata: {data}\n\n'
+        finally:
+            progress_hub.unsubscribe(subscription)
+
+    return Response(
+        stream_with_context(_events()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+
 @app.route('/tasks', methods=['POST'])
 def post_task():
     inputs = PostDownloadTaskRequest(request)
@@ -63,30 +122,120 @@ def post_task():
         relative_target_path=request
             .json
             .get('relative_target_path'),
-        file_hash=request.json.get('file_hash', None)
+        file_hash=request.json.get('file_hash', None),
+        priority=request.json.get('priority', 0),
+        post_process=request.json.get('post_process'),
+        extract=request.json.get('extract'),
+        mirrors=request.json.get('mirrors')
     )
 
     return jsonify(dtask.to_dict())
 
 
+@app.route('/tasks/batch', methods=['POST'])
+def post_tasks_batch():
+    """Creates many download tasks at once. Invalid entries don't
+    prevent valid ones from being created, a result is returned for
+    each entry, in same order than received ones
+    """
+    inputs = PostDownloadTasksBatchRequest(request)
+    if not inputs.validate():
+        raise DTaskValidationError(inputs.errors[0])
+
+    entries = request.json.get('dtasks')
+    errors = validate_dtasks_batch(entries, dtask_schema)
+
+    dtasks = iter(dtask_service.create_and_queue_many([
+        entry for entry, error in zip(entries, errors) if error is None
+    ]))
+
+    results = []
+    for error in errors:
+        if error is None:
+            results.append({'dtask': next(dtasks).to_dict()})
+        else:
+            results.append({'error': error})
+
+    return jsonify({
+        'created': sum(1 for error in errors if error is None),
+        'failed': sum(1 for error in errors if error is not None),
+        'results': results
+    })
+
+
 @app.route('/tasks/<int:dtask_id>', methods=['PUT'])
 def put_task(dtask_id):
     inputs = PutDownloadTaskRequest(request)
     if not inputs.validate():
         raise DTaskValidationError(inputs.errors[0])
 
-    new_status_raw = request.json.get('status')
-    new_status = DownloadStatus(new_status_raw)
-    dtask = dtask_service.update_status(dtask_id, new_status)
+    if 'status' in request.json:
+        new_status = DownloadStatus(request.json.get('status'))
+        dtask = dtask_service.update_status(dtask_id, new_status)
+
+    if 'max_rate' in request.json:
+        max_rate = request.json.get('max_rate')
+        dtask = dtask_service.update_max_rate(dtask_id, max_rate)
+
+    if 'priority' in request.json:
+        priority = request.json.get('priority')
+        dtask = dtask_service.update_priority(dtask_id, priority)
 
     return jsonify(dtask.to_dict())
 
 
+@app.route('/tasks/<int:dtask_id>/post_process/retry', methods=['POST'])
+def retry_post_process(dtask_id):
+    inputs = DownloadTaskRequest(request)
+    if not inputs.validate():
+        raise DTaskNotFoundError(inputs.errors[0])
+
+    dtask = dtask_service.retry_post_process(dtask_id)
+    return jsonify(dtask.to_dict())
+
+
+@app.route('/tasks/<int:dtask_id>/freshness', methods=['GET'])
+def get_task_freshness(dtask_id):
+    inputs = DownloadTaskRequest(request)
+    if not inputs.validate():
+        raise DTaskNotFoundError(inputs.errors[0])
+
+    return jsonify({
+        'id': dtask_id,
+        'fresh': dtask_service.check_freshness(dtask_id)
+    })
+
+
 @app.route('/tasks/<int:id>', methods=['DELETE'])
 def delete_task(id):
     dtask_service.remove(id)
     return '', 204
 
+@app.route('/settings/bandwidth', methods=['GET'])
+def get_bandwidth_settings():
+    return jsonify({'max_rate': settings_service.get_global_max_rate()})
+
+
+@app.route('/settings/bandwidth', methods=['PUT'])
+def put_bandwidth_settings():
+    inputs = PutBandwidthSettingsRequest(request)
+    if not inputs.validate():
+        raise SettingsValidationError(inputs.errors[0])
+
+    max_rate = settings_service.set_global_max_rate(
+        request.json.get('max_rate')
+    )
+    return jsonify({'max_rate': max_rate})
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(
+        metrics_service.render_metrics(),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
+
+
 @app.route('/url/metadata', methods=['GET'])
 def fetch_metadata():
     inputs = UrlMetadataRequest(request)
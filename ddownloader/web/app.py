@@ -4,3 +4,7 @@ app = Flask(__name__)
 import ddownloader.web.api
 
 CORS(app)
+
+# Lets other api processes include metrics of this one
+from ddownloader import metrics
+metrics.start_exporter()
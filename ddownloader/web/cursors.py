@@ -0,0 +1,39 @@
+"""
+Opaque cursors used for keyset pagination of download tasks
+"""
+import base64
+import binascii
+
+
+CURSOR_PREFIX = 'dtask:'
+
+
+class InvalidCursorError(Exception):
+    def __init__(self, cursor: str) -> None:
+        super().__init__(f'Invalid pagination cursor: {cursor}')
+
+
+def encode_cursor(dtask_id: int) -> str:
+    raw = f'{CURSOR_PREFIX}{dtask_id}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor: str) -> int:
+    """Extracts id of last task of previous page from given cursor
+
+    Raises:
+        InvalidCursorError: When cursor was not produced by 'encode_cursor'
+    """
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(cursor + padding).decode()
+    except (binascii.Error, UnicodeDecodeError, ValueError) as err:
+        raise InvalidCursorError(cursor) from err
+
+    if not raw.startswith(CURSOR_PREFIX):
+        raise InvalidCursorError(cursor)
+
+    dtask_id = raw[len(CURSOR_PREFIX):]
+    if not dtask_id.isdigit():
+        raise InvalidCursorError(cursor)
+
+    return int(dtask_id)
@@ -1,17 +1,32 @@
 from pathlib import PurePath
 
 import ddownloader.dtask_repository as dtask_repo
-from ddownloader import async_tasks
-from ddownloader.config_loader import downloads_dir
-from ddownloader.downloader import DownloadStatus, DownloadTask
-from ddownloader.errors import InvalidStatusTransitionError
+from ddownloader import archives, async_tasks, control, dedup, downloader
+from ddownloader import hashing, postprocess
+from ddownloader.cache import normalize_url
+from ddownloader.config_loader import default_post_process, downloads_dir
+from ddownloader.control import ControlCommand
+from ddownloader.downloader import (
+    DownloadStatus,
+    DownloadTask,
+    PostProcessStatus
+)
+from ddownloader.errors import (
+    InvalidPostProcessStateError,
+    InvalidStatusTransitionError
+)
+from ddownloader.web.cursors import decode_cursor, encode_cursor
 from ddownloader.web.models import DownloadTasksPage
 
 
 def create_and_queue(
     url: str,
     relative_target_path: str,
-    file_hash: str
+    file_hash: str,
+    priority: int = 0,
+    post_process: list[dict] = None,
+    extract: dict = None,
+    mirrors: list[str] = None
 ) -> DownloadTask:
     """Creates a new download tasks with given arguments
     and queue it for being processed in background.
@@ -22,6 +37,14 @@ def create_and_queue(
             file
         file_hash (str): If provided, hash will be verified against
             downloaded file when download is complete
+        priority (int): Tasks with higher priority are started first
+        post_process (list[dict]): Stages run once download completes,
+            see 'postprocess' module. Configured default ones if None
+        extract (dict): If given, archive is extracted while being
+            downloaded into 'to' directory (relative to downloads dir),
+            and removed afterwards unless 'keep_archive' is set
+        mirrors (list[str]): Other urls serving same file, download
+            is fetched from fastest one, see 'mirrors' module
 
     Returns:
         DownloadTask: Created task
@@ -34,16 +57,138 @@ def create_and_queue(
     dtask = DownloadTask(
         url=url,
         target_path=str(target_path),
-        file_hash=file_hash
+        file_hash=file_hash,
+        priority=priority,
+        mirrors=_mirrors_of(url, mirrors)
     )
+
+    _set_known_size(dtask)
+    _set_post_process(dtask, post_process)
+    _set_extract(dtask, extract)
+    if not dtask.extract_to:
+        dedup.resolve(dtask)
     dtask_repo.save(dtask)
 
-    # Enqueue to download in background
-    async_tasks.download(dtask.id)
+    # Start download in background as soon as limits allow it
+    if dtask.status == DownloadStatus.QUEUED and not dtask.attached_to:
+        async_tasks.dispatch()
+    elif dtask.status == DownloadStatus.COMPLETED and dtask.post_process:
+        async_tasks.post_process(dtask.id)
 
     return dtask
 
 
+def create_and_queue_many(entries: list[dict]) -> list[DownloadTask]:
+    """Creates a download task for each one of given (already
+    validated) entries within a single transaction and queues them
+    all for being processed in background.
+
+    Args:
+        entries (list[dict]): Dicts with same fields accepted by
+            'create_and_queue'
+
+    Returns:
+        list[DownloadTask]: Created tasks, in same order than entries
+    """
+    dtasks = []
+    for entry in entries:
+        dtask = DownloadTask(
+            url=entry['url'],
+            target_path=str(PurePath(
+                downloads_dir(),
+                entry['relative_target_path']
+            )),
+            file_hash=entry.get('file_hash'),
+            priority=entry.get('priority', 0),
+            mirrors=_mirrors_of(entry['url'], entry.get('mirrors'))
+        )
+        _set_known_size(dtask)
+        _set_post_process(dtask, entry.get('post_process'))
+        _set_extract(dtask, entry.get('extract'))
+        dtasks.append(dtask)
+
+    # Existing tasks matching entries are looked up at once
+    deduplicated = [dtask for dtask in dtasks if not dtask.extract_to]
+    sources = dict(zip(
+        map(id, deduplicated),
+        dedup.resolve_many(deduplicated)
+    ))
+
+    # Entries repeating content of previous ones in same batch are
+    # attached to them once they are saved
+    roots: dict[str, DownloadTask] = {}
+    in_batch_followers = []
+    for dtask in dtasks:
+        if dtask.extract_to or sources[id(dtask)]:
+            continue
+
+        key = hashing.hash_key(dtask.file_hash) or normalize_url(dtask.url)
+        if key in roots:
+            in_batch_followers.append((dtask, roots[key]))
+        else:
+            roots[key] = dtask
+
+    follower_refs = {id(follower) for follower, _ in in_batch_followers}
+    dtask_repo.save_many(
+        [d for d in dtasks if id(d) not in follower_refs],
+        in_batch_followers
+    )
+
+    # A single dispatch starts as many of them as limits allow, the
+    # rest are started as running ones complete
+    if dtasks:
+        async_tasks.dispatch()
+
+    for dtask in dtasks:
+        if dtask.status == DownloadStatus.COMPLETED and dtask.post_process:
+            async_tasks.post_process(dtask.id)
+
+    return dtasks
+
+
+def _set_post_process(dtask: DownloadTask, specs: list[dict]):
+    if specs is None:
+        specs = default_post_process()
+
+    if specs:
+        dtask.post_process = postprocess.new_pipeline(specs)
+        dtask.post_status = PostProcessStatus.PENDING
+
+
+def _mirrors_of(url: str, mirrors: list[str]) -> list[str]:
+    """Given mirrors without repeated ones, nor task url"""
+    unique = [
+        mirror for idx, mirror in enumerate(mirrors or [])
+        if mirror != url and mirror not in mirrors[:idx]
+    ]
+    return unique or None
+
+
+def _set_extract(dtask: DownloadTask, extract: dict):
+    """Tasks extracted while downloading are not deduplicated, as their
+    content is extracted from the bytes they receive
+    """
+    if extract is None:
+        return
+
+    if extract.get('to'):
+        dtask.extract_to = str(PurePath(downloads_dir(), extract['to']))
+    else:
+        dtask.extract_to = archives.default_dest(dtask.target_path)
+    dtask.keep_archive = extract.get('keep_archive', True)
+
+
+def _set_known_size(dtask: DownloadTask):
+    """Size is usually known already from the metadata request the ui
+    did while task was being composed
+    """
+    url_meta = downloader.cached_metadata(dtask.url)
+    if url_meta and url_meta.content_length:
+        dtask.total_size = url_meta.content_length
+
+    dtask.content_key = dedup.content_key(dtask.url, url_meta)
+
+
 def get_page(page: int, page_size: int) -> DownloadTasksPage:
     dtasks = dtask_repo.paginate(page_size, page)
     count = dtask_repo.count()
@@ -55,6 +200,41 @@ def get_page(page: int, page_size: int) -> DownloadTasksPage:
         dtasks
     )
 
+def get_page_after(
+    page_size: int,
+    after: str = None,
+    status: DownloadStatus = None
+) -> DownloadTasksPage:
+    """Retrieves the page of tasks following given cursor using keyset
+    pagination. See 'dtask_repository.paginate_after'
+
+    Args:
+        page_size (int): Max number of tasks in page
+        after (str): Opaque cursor returned with previous page, if not
+            given first page is retrieved
+        status (DownloadStatus): If given, only tasks in this status
+            are retrieved
+
+    Returns:
+        DownloadTasksPage: Requested page, 'next_cursor' will be None
+            if there are no more tasks
+    """
+    after_id = decode_cursor(after) if after else 0
+    dtasks = dtask_repo.paginate_after(page_size, after_id, status)
+    count = dtask_repo.count(status)
+
+    next_cursor = None
+    if dtasks and len(dtasks) == page_size:
+        next_cursor = encode_cursor(dtasks[-1].id)
+
+    return DownloadTasksPage(
+        None,
+        page_size,
+        count,
+        dtasks,
+        next_cursor
+    )
+
 def update_status(dtask_id: int, to_status: DownloadStatus) -> DownloadTask:
     dtask = dtask_repo.find_by_id(dtask_id)
     
@@ -67,10 +247,72 @@ def update_status(dtask_id: int, to_status: DownloadStatus) -> DownloadTask:
             raise InvalidStatusTransitionError(dtask.status, to_status)
 
     
-    # Exception was not raised, update dtask
+    # Exception was not raised, update dtask. Tasks queued by hand are
+    # given a new set of automatic retries
     dtask.status = to_status
+    if to_status == DownloadStatus.QUEUED:
+        dtask.retries = 0
+        dtask.retry_at = None
     dtask_repo.save(dtask)
+
+    # Notify running worker (if any), resumed tasks are queued again
+    if to_status == DownloadStatus.PAUSED:
+        control.send(dtask_id, ControlCommand.PAUSE)
+    elif to_status == DownloadStatus.QUEUED:
+        control.send(dtask_id, ControlCommand.RESUME)
+        async_tasks.dispatch()
+
+    return dtask
+
+def update_max_rate(dtask_id: int, max_rate: int) -> DownloadTask:
+    """Changes bandwidth limit of given task, running download (if any)
+    adopts it right away
+
+    Args:
+        dtask_id (int): Task to update
+        max_rate (int): Limit in bytes per second, 0 for no limit
+    """
+    dtask_repo.update_max_rate(dtask_id, max_rate)
+    control.send(dtask_id, ControlCommand.LIMIT_RATE, max_rate)
+
+    return dtask_repo.find_by_id(dtask_id)
+
+def update_priority(dtask_id: int, priority: int) -> DownloadTask:
+    """Changes priority of given task. Queued tasks are reordered
+    without being enqueued again, see 'async_tasks.dispatch'
+    """
+    dtask_repo.update_priority(dtask_id, priority)
+    return dtask_repo.find_by_id(dtask_id)
+
+def check_freshness(dtask_id: int) -> bool:
+    """Checks whether file of given task still matches content served
+    at its url, see 'downloader.is_fresh'
+
+    Returns:
+        bool: None if task has no validators to check against
+    """
+    dtask = dtask_repo.find_by_id(dtask_id)
+    return downloader.is_fresh(dtask)
+
+def retry_post_process(dtask_id: int) -> DownloadTask:
+    """Resumes failed post-processing of given (completed) task from
+    its first stage not done
+
+    Raises:
+        InvalidPostProcessStateError: If post-processing did not fail
+    """
+    dtask = dtask_repo.find_by_id(dtask_id)
+    if dtask.post_status != PostProcessStatus.FAILED:
+        raise InvalidPostProcessStateError(dtask.post_status)
+
+    postprocess.retry(dtask)
+    async_tasks.post_process(dtask_id)
     return dtask
 
 def remove(task_id: int) -> None:
     dtask_repo.delete_by_id(task_id)
+    control.send(task_id, ControlCommand.CANCEL)
+
+    # Tasks waiting for removed one are downloaded on their own
+    dtask_repo.detach_followers(task_id)
+    async_tasks.dispatch()
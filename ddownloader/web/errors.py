@@ -14,6 +14,16 @@ class DDownloaderApiError(Exception):
 class DTaskValidationError(DDownloaderApiError):
     pass
 
+class DTaskNotFoundError(DDownloaderApiError):
+    def __init__(self, message) -> None:
+        super().__init__(message, status_code=404)
+
+class DTasksPageRequestValidationError(DDownloaderApiError):
+    pass
+
+class SettingsValidationError(DDownloaderApiError):
+    pass
+
 class UrlMetadataRequestValidationError(DDownloaderApiError):
     pass
 
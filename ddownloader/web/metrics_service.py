@@ -0,0 +1,38 @@
+import ddownloader.dtask_repository as dtask_repo
+from ddownloader import async_tasks, metrics
+from ddownloader.config_loader import max_concurrent_downloads
+from ddownloader.downloader import DownloadStatus
+
+
+def render_metrics() -> str:
+    """Renders metrics of all processes plus the ones read from
+    database and queue at scrape time, in Prometheus text format
+    """
+    snapshot = metrics.collect_all()
+
+    status_counts = dtask_repo.count_by_status()
+    tasks = metrics.Gauge(
+        'ddownloader_tasks',
+        'Number of download tasks by status',
+        labelnames=('status',)
+    )
+    for status, count in status_counts.items():
+        tasks.set(count, status=status.value)
+
+    queue_depth = metrics.Gauge(
+        'ddownloader_queue_pending_tasks',
+        'Number of huey tasks waiting for a worker'
+    )
+    queue_depth.set(async_tasks.huey.pending_count())
+
+    utilization = metrics.Gauge(
+        'ddownloader_worker_utilization',
+        'Running downloads over max concurrent downloads'
+    )
+    running = status_counts[DownloadStatus.IN_PROGRESS]
+    utilization.set(running / max(max_concurrent_downloads(), 1))
+
+    for gauge in (tasks, queue_depth, utilization):
+        snapshot[gauge.name] = gauge.dump()
+
+    return metrics.render(snapshot)
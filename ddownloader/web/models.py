@@ -1,13 +1,24 @@
 from dataclasses import dataclass
 from flask_inputs import Inputs
 from flask_inputs.validators import JsonSchema
-from wtforms.validators import DataRequired, URL, Regexp
-from ddownloader.downloader import DownloadTask
+from wtforms.validators import (
+    AnyOf,
+    DataRequired,
+    Optional,
+    Regexp,
+    URL
+)
+from ddownloader.downloader import DownloadStatus, DownloadTask
 
 from ddownloader.web.validators import (
     dtask_exists,
     safe_target_path,
-    target_path_not_exists
+    target_path_not_exists,
+    valid_cursor,
+    valid_extract,
+    valid_file_hash,
+    valid_page_size,
+    valid_post_process
 )
 
 
@@ -25,13 +36,60 @@ dtask_schema = {
         },
         'file_hash': {
             'type': 'string'
+        },
+        'priority': {
+            'type': 'integer'
+        },
+        'post_process': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'required': ['stage'],
+                'properties': {
+                    'stage': {'type': 'string'},
+                    'options': {'type': 'object'}
+                }
+            }
+        },
+        'extract': {
+            'type': 'object',
+            'properties': {
+                'to': {'type': 'string'},
+                'keep_archive': {'type': 'boolean'}
+            }
+        },
+        'mirrors': {
+            'type': 'array',
+            'maxItems': 20,
+            'items': {
+                'type': 'string',
+                'format': 'uri',
+                'pattern': '^https?://'
+            }
+        }
+    }
+}
+
+dtasks_batch_schema = {
+    'type': 'object',
+    'required': ['dtasks'],
+    'properties': {
+        'dtasks': {
+            'type': 'array',
+            'minItems': 1,
+            'maxItems': 10000,
+            'items': {'type': 'object'}
         }
     }
 }
 
 dtask_update_schema = {
     'type': 'object',
-    'required': ['status'],
+    'anyOf': [
+        {'required': ['status']},
+        {'required': ['max_rate']},
+        {'required': ['priority']}
+    ],
     'properties': {
         'status': {
             'type': 'string',
@@ -39,6 +97,24 @@ dtask_update_schema = {
                 'Queued',
                 'Paused'
             ]
+        },
+        'max_rate': {
+            'type': 'integer',
+            'minimum': 0
+        },
+        'priority': {
+            'type': 'integer'
+        }
+    }
+}
+
+bandwidth_settings_schema = {
+    'type': 'object',
+    'required': ['max_rate'],
+    'properties': {
+        'max_rate': {
+            'type': 'integer',
+            'minimum': 0
         }
     }
 }
@@ -47,15 +123,41 @@ class PostDownloadTaskRequest(Inputs):
     json = [
         JsonSchema(schema=dtask_schema),
         safe_target_path,
-        target_path_not_exists
+        target_path_not_exists,
+        valid_file_hash,
+        valid_post_process,
+        valid_extract
     ]
 
+class PostDownloadTasksBatchRequest(Inputs):
+    """Validates batch envelope only, entries are validated one by one
+    through 'validators.validate_dtasks_batch'
+    """
+    json = [JsonSchema(schema=dtasks_batch_schema)]
+
 class PutDownloadTaskRequest(Inputs):
     json = [JsonSchema(schema=dtask_update_schema)]
     rule = {
         'dtask_id': [dtask_exists]
     }
 
+class DownloadTaskRequest(Inputs):
+    """Validates task id of '/tasks/<id>/...' routes"""
+    rule = {
+        'dtask_id': [dtask_exists]
+    }
+
+class PutBandwidthSettingsRequest(Inputs):
+    json = [JsonSchema(schema=bandwidth_settings_schema)]
+
+class DownloadTasksPageRequest(Inputs):
+    args = {
+        'page': [Optional(), Regexp('^[0-9]+$')],
+        'page_size': [Optional(), valid_page_size],
+        'status': [Optional(), AnyOf([s.value for s in DownloadStatus])],
+        'after': [Optional(), valid_cursor]
+    }
+
 class UrlMetadataRequest(Inputs):
     args = {
         'url': [DataRequired(), URL(), Regexp('^(https?|http)://')]
@@ -68,11 +170,13 @@ class DownloadTasksPage():
     page_size: int
     total_count: int
     dtasks: list[DownloadTask]
+    next_cursor: str = None
 
     def to_dict(self) -> dict:
         return {
             'page': self.page,
             'page_size': self.page_size,
             'total_count': self.total_count,
+            'next_cursor': self.next_cursor,
             'dtasks': [dtask.to_dict() for dtask in self.dtasks]
         }
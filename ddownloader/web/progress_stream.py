@@ -0,0 +1,162 @@
+"""
+Fan out of download progress events to Server-Sent Events clients.
+
+A single background thread polls the tasks database for running tasks
+and publishes what changed to every subscriber, so api load does not
+grow with the number of open dashboards. Subscribers only keep the
+latest event of every task, slow clients skip intermediate states.
+
+Queued tasks are not polled, as they may be many and do not progress:
+a task is tracked once it starts and gets a final event when it stops.
+"""
+import threading
+import time
+
+import ddownloader.dtask_repository as dtask_repo
+from ddownloader import config_loader as dconfig
+from ddownloader.downloader import DownloadStatus, DownloadTask
+from ddownloader.log_utils import logger
+
+
+ACTIVE_STATUSES = [DownloadStatus.IN_PROGRESS]
+
+
+class Subscription:
+    """Coalescing mailbox of progress events for a single client"""
+
+    def __init__(self, initial_events: list[dict]) -> None:
+        self._cond = threading.Condition()
+        self._events: dict[int, dict] = {e['id']: e for e in initial_events}
+
+    def publish(self, events: list[dict]) -> None:
+        with self._cond:
+            for event in events:
+                self._events[event['id']] = event
+            self._cond.notify()
+
+    def wait(self, timeout: float) -> list[dict]:
+        """Blocks until there are events to deliver or timeout expires
+
+        Returns:
+            list[dict]: Latest pending event of every changed task,
+                empty if timeout expired
+        """
+        with self._cond:
+            if not self._events:
+                self._cond.wait(timeout)
+
+            events = list(self._events.values())
+            self._events.clear()
+            return events
+
+
+class ProgressHub:
+
+    def __init__(self, poll_interval: float = None) -> None:
+        self.poll_interval = poll_interval \
+            if poll_interval is not None \
+            else dconfig.progress_stream_interval()
+
+        self._lock = threading.Lock()
+        self._subscriptions: set[Subscription] = set()
+        self._states: dict[int, dict] = {}
+        self._poller: threading.Thread = None
+
+    def subscribe(self) -> Subscription:
+        with self._lock:
+            subscription = Subscription(list(self._states.values()))
+            self._subscriptions.add(subscription)
+
+            if not self._poller or not self._poller.is_alive():
+                self._poller = threading.Thread(
+                    target=self._poll_loop,
+                    name='ddownloader-progress-hub',
+                    daemon=True
+                )
+                self._poller.start()
+
+            return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def poll(self) -> list[dict]:
+        """Reads active tasks from database and publishes an event for
+        every task which progress or status changed since last poll.
+        Tracked tasks leaving active statuses get a final event.
+
+        State of unchanged tasks is kept as is, so rates span the whole
+        time since bytes were last saved by workers, which may be
+        longer than poll interval (see 'progress.ProgressReporter')
+        """
+        now = time.monotonic()
+        active = dtask_repo.find_by_statuses(ACTIVE_STATUSES)
+        active_ids = {dtask.id for dtask in active}
+
+        finished_ids = [i for i in self._states if i not in active_ids]
+        finished = dtask_repo.find_by_ids(finished_ids)
+
+        with self._lock:
+            events = []
+            for dtask in active + finished:
+                event = self._to_event(dtask, now)
+                prev = self._states.get(dtask.id)
+                if not prev or _changed(prev, event):
+                    events.append(event)
+                    self._states[dtask.id] = event
+
+            for dtask_id in finished_ids:
+                self._states.pop(dtask_id, None)
+
+            subscriptions = list(self._subscriptions)
+
+        if events:
+            for subscription in subscriptions:
+                subscription.publish(events)
+
+        return events
+
+    def _to_event(self, dtask: DownloadTask, now: float) -> dict:
+        rate = 0
+        prev = self._states.get(dtask.id)
+        if prev and dtask.status == DownloadStatus.IN_PROGRESS:
+            elapsed = now - prev['_polled_at']
+            if elapsed > 0:
+                transferred = dtask.downloaded_size - prev['downloaded_size']
+                rate = max(transferred, 0) / elapsed
+
+        return {
+            'id': dtask.id,
+            'downloaded_size': dtask.downloaded_size,
+            'total_size': dtask.total_size,
+            'rate': round(rate),
+            'status': dtask.status.value,
+            '_polled_at': now
+        }
+
+    def _poll_loop(self) -> None:
+        while True:
+            with self._lock:
+                if not self._subscriptions:
+                    self._poller = None
+                    return
+
+            try:
+                self.poll()
+            except dtask_repo.DBError as err:
+                logger.warning('Unable to poll tasks progress: %s', err)
+
+            time.sleep(self.poll_interval)
+
+
+def _changed(prev: dict, event: dict) -> bool:
+    keys = ['downloaded_size', 'total_size', 'status']
+    return any(prev[key] != event[key] for key in keys)
+
+
+def public_event(event: dict) -> dict:
+    return {k: v for k, v in event.items() if not k.startswith('_')}
+
+
+progress_hub = ProgressHub()
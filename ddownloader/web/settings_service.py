@@ -0,0 +1,24 @@
+import ddownloader.dtask_repository as dtask_repo
+from ddownloader import bandwidth, control
+from ddownloader.config_loader import max_download_rate
+from ddownloader.control import ControlCommand
+
+
+def get_global_max_rate() -> int:
+    rate = dtask_repo.get_setting(
+        bandwidth.GLOBAL_RATE_SETTING,
+        max_download_rate()
+    )
+    return int(rate)
+
+def set_global_max_rate(max_rate: int) -> int:
+    """Stores global bandwidth limit and pushes it to running workers
+
+    Args:
+        max_rate (int): Limit in bytes per second, 0 for no limit
+    """
+    dtask_repo.set_setting(bandwidth.GLOBAL_RATE_SETTING, str(max_rate))
+
+    # Task id 0 addresses global limit, see 'bandwidth.apply_limit'
+    control.send(0, ControlCommand.LIMIT_RATE, max_rate)
+    return max_rate
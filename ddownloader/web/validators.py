@@ -1,9 +1,18 @@
+import os
+from types import SimpleNamespace
 from flask_inputs.validators import ValidationError
+from jsonschema import Draft4Validator
 from pathlib import Path
 from pathvalidate import is_valid_filepath
 
 import ddownloader.dtask_repository as dtask_repo
 from ddownloader.config_loader import downloads_dir
+from ddownloader import archives, postprocess
+from ddownloader.hashing import InvalidFileHashError, parse_file_hash
+from ddownloader.web.cursors import InvalidCursorError, decode_cursor
+
+
+MAX_PAGE_SIZE = 500
 
 
 def safe_target_path(form, field):
@@ -31,6 +40,48 @@ def target_path_not_exists(form, field):
     if dest_file.exists():
         raise ValidationError(f'Given {TARGET_PATH_FN} already exists')
 
+def valid_file_hash(form, field):
+    """Validates that optional file_hash names a supported algorithm
+    and contains a digest of the right length
+    """
+    file_hash = field.data.get('file_hash')
+    if file_hash is None:
+        return
+
+    try:
+        parse_file_hash(file_hash)
+    except InvalidFileHashError as err:
+        raise ValidationError(str(err)) from err
+
+def valid_post_process(form, field):
+    """Validates that optional post_process stages exist and that their
+    options are valid
+    """
+    try:
+        postprocess.validate_pipeline(field.data.get('post_process'))
+    except postprocess.PostProcessError as err:
+        raise ValidationError(err.message) from err
+
+def valid_extract(form, field):
+    """Validates that file of a task extracted while downloading is a
+    supported archive, and that optional 'to' directory is a valid
+    relative path
+    """
+    extract = field.data.get('extract')
+    if extract is None:
+        return
+
+    target_path = field.data.get('relative_target_path', '')
+    if archives.archive_format(target_path) is None:
+        raise ValidationError(
+            'Only tar and zip archives can be extracted, '
+            f'supported suffixes: {", ".join(archives.SUFFIXES)}'
+        )
+
+    to = extract.get('to')
+    if to is not None and (not is_valid_filepath(to) or '..' in to):
+        raise ValidationError("Extract 'to' is not a valid relative path")
+
 def dtask_exists(form, field):
     """Validates that given download task exists
     """
@@ -39,3 +90,75 @@ def dtask_exists(form, field):
         raise ValidationError(
             f"Download task with id '{field.data}' was not found"
         )
+
+def valid_page_size(form, field):
+    """Validates that page size is a number between 1 and
+    'MAX_PAGE_SIZE'
+    """
+    if not str(field.data).isdigit() \
+            or not 1 <= int(field.data) <= MAX_PAGE_SIZE:
+        raise ValidationError(
+            f'page_size must be a number between 1 and {MAX_PAGE_SIZE}'
+        )
+
+def valid_cursor(form, field):
+    """Validates that given pagination cursor was generated by api
+    """
+    try:
+        decode_cursor(field.data)
+    except InvalidCursorError as err:
+        raise ValidationError(str(err)) from err
+
+def validate_dtasks_batch(entries: list[dict], schema: dict) -> list[str]:
+    """Validates every entry of a batch of download tasks in a single
+    pass, applying same rules than single task creation.
+
+    Existing files are looked up by listing each target directory once
+    instead of checking every path, and target paths repeated within
+    the batch are rejected.
+
+    Returns:
+        list[str]: Error message for each entry, None for valid ones
+    """
+    schema_validator = Draft4Validator(schema)
+    dir_listings: dict[Path, set[str]] = {}
+    batch_paths = set()
+    errors = []
+
+    for entry in entries:
+        try:
+            schema_error = next(schema_validator.iter_errors(entry), None)
+            if schema_error:
+                raise ValidationError(schema_error.message)
+
+            field = SimpleNamespace(data=entry)
+            safe_target_path(None, field)
+            valid_file_hash(None, field)
+            valid_post_process(None, field)
+            valid_extract(None, field)
+
+            dest_file = Path(downloads_dir(), entry['relative_target_path'])
+            if dest_file in batch_paths:
+                raise ValidationError(
+                    'Given relative_target_path is repeated in batch'
+                )
+
+            if dest_file.parent not in dir_listings:
+                dir_listings[dest_file.parent] = _list_dir(dest_file.parent)
+            if dest_file.name in dir_listings[dest_file.parent]:
+                raise ValidationError(
+                    'Given relative_target_path already exists'
+                )
+
+            batch_paths.add(dest_file)
+            errors.append(None)
+        except ValidationError as err:
+            errors.append(str(err))
+
+    return errors
+
+def _list_dir(path: Path) -> set[str]:
+    try:
+        return set(os.listdir(path))
+    except (FileNotFoundError, NotADirectoryError):
+        return set()
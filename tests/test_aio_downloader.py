@@ -0,0 +1,101 @@
+import threading
+
+import pytest
+
+from benchmarks.http_stand_in import StandInServer, expected_bytes
+from ddownloader.aio_downloader import AioEngine
+from ddownloader.downloader import DownloadStatus, DownloadTask
+
+
+@pytest.fixture
+def server():
+    server = StandInServer().start()
+    yield server
+    server.stop()
+
+@pytest.fixture
+def engine():
+    engine = AioEngine(max_concurrency=4)
+    yield engine
+    engine.close()
+
+
+def test_concurrent_downloads(server, engine, tmp_path):
+    size = 3 * 1024 * 1024 + 17
+    dtasks = [
+        DownloadTask(server.file_url(size), str(tmp_path / f'f{idx}'))
+        for idx in range(10)
+    ]
+
+    futures = [engine.submit(d, lambda: None, lambda: None) for d in dtasks]
+    for future in futures:
+        future.result(timeout=30)
+
+    for dtask in dtasks:
+        assert dtask.status == DownloadStatus.COMPLETED
+        assert dtask.downloaded_size == size
+
+    assert (tmp_path / 'f0').read_bytes() == expected_bytes(0, size - 1)
+
+
+def test_resume_download(server, engine, tmp_path):
+    size = 2 * 1024 * 1024
+    target = tmp_path / 'f'
+    target.write_bytes(expected_bytes(0, 1000))
+
+    dtask = DownloadTask(server.file_url(size), str(target))
+    dtask.downloaded_size = 1001
+    engine.submit(dtask, lambda: None, lambda: None).result(timeout=30)
+
+    assert dtask.status == DownloadStatus.COMPLETED
+    assert dtask.total_size == size
+    assert target.read_bytes() == expected_bytes(0, size - 1)
+
+
+def test_chunked_download(server, engine, tmp_path):
+    size = 1024 * 1024 + 3
+    dtask = DownloadTask(server.file_url(size, chunked=True), str(tmp_path / 'f'))
+    engine.submit(dtask, lambda: None, lambda: None).result(timeout=30)
+
+    assert dtask.status == DownloadStatus.COMPLETED
+    assert dtask.total_size == size
+    assert (tmp_path / 'f').read_bytes() == expected_bytes(0, size - 1)
+
+
+def test_resume_changed_content(server, engine, tmp_path):
+    size = 1024 * 1024
+    target = tmp_path / 'f'
+    target.write_bytes(b'x' * 1000)
+
+    dtask = DownloadTask(server.file_url(size), str(target))
+    dtask.downloaded_size = 1000
+    dtask.etag = '"stale"'
+    engine.submit(dtask, lambda: None, lambda: None).result(timeout=30)
+
+    assert dtask.status == DownloadStatus.COMPLETED
+    assert dtask.total_size == size
+    assert dtask.etag == f'"{size}-{server.version}"'
+    assert target.read_bytes() == expected_bytes(0, size - 1)
+
+
+def test_slow_callback_does_not_delay_other_streams(server, engine, tmp_path):
+    size = 2 * 1024 * 1024
+    released = threading.Event()
+
+    def _slow_update():
+        # As a progress flush waiting for database lock would
+        released.wait(timeout=10)
+
+    slow = DownloadTask(server.file_url(size), str(tmp_path / 'slow'))
+    fast = DownloadTask(server.file_url(size), str(tmp_path / 'fast'))
+
+    slow_future = engine.submit(slow, _slow_update, lambda: None)
+    try:
+        engine.submit(fast, lambda: None, lambda: None).result(timeout=5)
+        assert not slow_future.done()
+    finally:
+        released.set()
+
+    slow_future.result(timeout=30)
+    assert fast.status == DownloadStatus.COMPLETED
+    assert slow.status == DownloadStatus.COMPLETED
@@ -0,0 +1,241 @@
+import io
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+from benchmarks.http_stand_in import StandInServer
+from ddownloader import archives, downloader
+from ddownloader.archives import ExtractionError
+from ddownloader.downloader import DownloadStatus, DownloadTask
+
+
+FILES = {
+    'docs/readme.txt': b'hello',
+    'data/big.bin': os.urandom(300 * 1024),
+    'data/' + 'n' * 150 + '.txt': b'long name'
+}
+
+
+@pytest.fixture
+def server():
+    server = StandInServer().start()
+    yield server
+    server.stop()
+
+
+def _tar(mode: str = 'w:gz', fmt: int = tarfile.GNU_FORMAT) -> bytes:
+    out = io.BytesIO()
+    with tarfile.open(fileobj=out, mode=mode, format=fmt) as archive:
+        info = tarfile.TarInfo('docs')
+        info.type = tarfile.DIRTYPE
+        archive.addfile(info)
+
+        for name, data in FILES.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+
+        link = tarfile.TarInfo('docs/link')
+        link.type = tarfile.SYMTYPE
+        link.linkname = '/etc/passwd'
+        archive.addfile(link)
+    return out.getvalue()
+
+def _zip() -> bytes:
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, 'w') as archive:
+        archive.writestr('empty/', b'')
+        for idx, (name, data) in enumerate(FILES.items()):
+            compression = zipfile.ZIP_DEFLATED if idx % 2 else zipfile.ZIP_STORED
+            archive.writestr(name, data, compress_type=compression)
+    return out.getvalue()
+
+def _feed(stream, data: bytes, piece_size: int = 7777) -> None:
+    with stream:
+        for offset in range(0, len(data), piece_size):
+            stream.feed(data[offset:offset + piece_size])
+        stream.finish()
+
+def _assert_extracted(dest) -> None:
+    for name, data in FILES.items():
+        assert (dest / name).read_bytes() == data
+
+
+def test_archive_format():
+    assert archives.archive_format('a/b.tar.gz') == 'tar.gz'
+    assert archives.archive_format('b.TGZ') == 'tar.gz'
+    assert archives.archive_format('b.zip') == 'zip'
+    assert archives.archive_format('b.gz') is None
+    assert archives.archive_format('.zip') is None
+    assert archives.default_dest('/d/b.tar.xz') == '/d/b'
+
+
+@pytest.mark.parametrize('mode, compression, fmt', [
+    ('w', None, tarfile.GNU_FORMAT),
+    ('w:gz', 'gz', tarfile.PAX_FORMAT),
+    ('w:bz2', 'bz2', tarfile.GNU_FORMAT),
+    ('w:xz', 'xz', tarfile.PAX_FORMAT)
+])
+def test_tar_stream(tmp_path, mode, compression, fmt):
+    stream = archives.TarStream(str(tmp_path), compression)
+    _feed(stream, _tar(mode, fmt))
+
+    _assert_extracted(tmp_path)
+    assert (tmp_path / 'docs').is_dir()
+    # Links are skipped
+    assert not os.path.lexists(tmp_path / 'docs' / 'link')
+
+def test_tar_stream_truncated(tmp_path):
+    data = _tar()
+    stream = archives.TarStream(str(tmp_path), 'gz')
+
+    with pytest.raises(ExtractionError):
+        _feed(stream, data[:len(data) // 2])
+
+def test_tar_stream_unsafe_member(tmp_path):
+    out = io.BytesIO()
+    with tarfile.open(fileobj=out, mode='w') as archive:
+        info = tarfile.TarInfo('../escaped.txt')
+        info.size = 1
+        archive.addfile(info, io.BytesIO(b'x'))
+
+    with pytest.raises(ExtractionError):
+        _feed(archives.TarStream(str(tmp_path / 'dest')), out.getvalue())
+    assert not (tmp_path / 'escaped.txt').exists()
+
+def test_tar_stream_corrupt_pax_header(tmp_path):
+    out = io.BytesIO()
+    with tarfile.open(fileobj=out, mode='w', format=tarfile.PAX_FORMAT) as archive:
+        info = tarfile.TarInfo('f.txt')
+        info.size = 1
+        info.pax_headers = {'comment': 'pax'}
+        archive.addfile(info, io.BytesIO(b'x'))
+
+    # Length of first record, which starts pax header data block
+    data = bytearray(out.getvalue())
+    data[tarfile.BLOCKSIZE:tarfile.BLOCKSIZE + 2] = b'x1'
+
+    with pytest.raises(ExtractionError):
+        _feed(archives.TarStream(str(tmp_path)), bytes(data))
+
+def test_zip_stream(tmp_path):
+    data = _zip()
+    entries = archives.read_zip_entries(io.BytesIO(data))
+
+    _feed(archives.ZipStream(str(tmp_path), entries), data, 1000)
+    _assert_extracted(tmp_path)
+
+def test_zip_stream_corrupt(tmp_path):
+    data = bytearray(_zip())
+    entries = archives.read_zip_entries(io.BytesIO(bytes(data)))
+    big = next(e for e in entries if e.filename == 'data/big.bin')
+    data[big.header_offset + 1000] ^= 0xFF
+
+    with pytest.raises(ExtractionError):
+        _feed(archives.ZipStream(str(tmp_path), entries), bytes(data))
+
+def _zeros_zip(size: int) -> bytes:
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('zeros.bin', bytes(size))
+    return out.getvalue()
+
+def test_zip_stream_inflates_in_pieces(tmp_path, monkeypatch):
+    data = _zeros_zip(8 * 1024 * 1024)
+    entries = archives.read_zip_entries(io.BytesIO(data))
+
+    pieces = []
+    inflate = archives._inflate
+
+    def _recording_inflate(decompressor, chunk):
+        for out in inflate(decompressor, chunk):
+            pieces.append(len(out))
+            yield out
+
+    monkeypatch.setattr(archives, '_inflate', _recording_inflate)
+    _feed(archives.ZipStream(str(tmp_path), entries), data, len(data))
+
+    assert max(pieces) <= archives._MAX_INFLATE
+    assert (tmp_path / 'zeros.bin').stat().st_size == 8 * 1024 * 1024
+
+def test_zip_stream_entry_larger_than_declared(tmp_path):
+    data = _zeros_zip(4 * 1024 * 1024)
+    entries = archives.read_zip_entries(io.BytesIO(data))
+    entries[0].file_size = 1000
+
+    with pytest.raises(ExtractionError):
+        _feed(archives.ZipStream(str(tmp_path), entries), data, len(data))
+    assert (tmp_path / 'zeros.bin').stat().st_size <= 1000
+
+def test_range_file(server):
+    data = _zip()
+    url = server.add_content('a.zip', data)
+
+    entries = archives.read_zip_entries(archives.RangeFile(url, len(data)))
+    assert [e.filename for e in entries] \
+        == [e.filename for e in archives.read_zip_entries(io.BytesIO(data))]
+
+
+# pylint: disable=R0201
+class TestDownloadExtract:
+
+    def _task(self, server, tmp_path, name, data, keep_archive=True):
+        dtask = DownloadTask(
+            server.add_content(name, data),
+            str(tmp_path / name)
+        )
+        dtask.extract_to = str(tmp_path / 'out')
+        dtask.keep_archive = keep_archive
+        return dtask
+
+    @pytest.mark.parametrize('name, data', [
+        ('a.tar.gz', _tar()),
+        ('a.zip', _zip())
+    ])
+    def test_extract_while_downloading(self, server, tmp_path, name, data):
+        dtask = self._task(server, tmp_path, name, data, keep_archive=False)
+
+        downloader.download(dtask, lambda: None, lambda: None)
+
+        assert dtask.status == DownloadStatus.COMPLETED
+        _assert_extracted(tmp_path / 'out')
+        assert not (tmp_path / name).exists()
+
+    def test_resume(self, server, tmp_path):
+        data = _tar()
+        dtask = self._task(server, tmp_path, 'a.tar.gz', data)
+
+        # Prefix of archive was downloaded by a previous attempt
+        (tmp_path / 'a.tar.gz').write_bytes(data[:len(data) // 2])
+        dtask.downloaded_size = len(data) // 2
+
+        downloader.download(dtask, lambda: None, lambda: None)
+
+        assert dtask.status == DownloadStatus.COMPLETED
+        assert (tmp_path / 'a.tar.gz').read_bytes() == data
+        _assert_extracted(tmp_path / 'out')
+
+    def test_corrupt_archive(self, server, tmp_path):
+        dtask = self._task(server, tmp_path, 'a.tar.gz', os.urandom(4096))
+
+        downloader.download(dtask, lambda: None, lambda: None)
+
+        assert dtask.status == DownloadStatus.FAILED
+        assert dtask.err_message.startswith('Extraction failed')
+
+    def test_fallback_to_post_process(self, server, tmp_path, monkeypatch):
+        monkeypatch.setenv('DOWNLOADS_PATH', str(tmp_path))
+        data = _zip()
+        dtask = self._task(server, tmp_path, 'a.zip', data)
+        dtask.url += '?chunked=1'
+
+        downloader.download(dtask, lambda: None, lambda: None)
+
+        # Size of chunked responses is unknown, index can not be fetched
+        assert dtask.status == DownloadStatus.COMPLETED
+        assert dtask.post_process[0]['stage'] == 'extract'
+        assert dtask.post_process[0]['options'] \
+            == {'to': 'out', 'remove_archive': False}
+        assert not (tmp_path / 'out').exists()
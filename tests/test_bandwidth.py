@@ -0,0 +1,65 @@
+from ddownloader.bandwidth import BandwidthGovernor, TokenBucket
+
+
+def test_bucket_burst_then_wait():
+    bucket = TokenBucket(100)
+
+    assert bucket.reserve(100) == 0
+    assert 0.9 < bucket.reserve(100) <= 1
+
+
+def test_unlimited_bucket():
+    bucket = TokenBucket(0)
+
+    assert bucket.reserve(10 ** 9) == 0
+
+
+def test_fair_share():
+    governor = BandwidthGovernor(global_rate=900)
+    for dtask_id in [1, 2, 3]:
+        governor.register(dtask_id)
+
+    assert [governor.rate_of(i) for i in [1, 2, 3]] == [300, 300, 300]
+
+    # Capped task keeps its limit, leftover is split among others
+    governor.set_task_rate(1, 100)
+    assert [governor.rate_of(i) for i in [1, 2, 3]] == [100, 400, 400]
+
+    governor.unregister(3)
+    assert [governor.rate_of(i) for i in [1, 2]] == [100, 800]
+
+
+def test_runtime_global_rate_change():
+    governor = BandwidthGovernor()
+    governor.register(1, max_rate=500)
+    assert governor.rate_of(1) == 500
+
+    governor.set_global_rate(200)
+    assert governor.rate_of(1) == 200
+
+    governor.set_global_rate(0)
+    assert governor.rate_of(1) == 500
+
+
+def test_share_of_running_total():
+    governor = BandwidthGovernor(global_rate=900)
+    governor.register(1)
+    governor.register(2)
+
+    # Another worker runs a third download
+    governor.set_running_total(3)
+    assert [governor.rate_of(i) for i in [1, 2]] == [300, 300]
+
+    # Downloads of this process not counted yet still get their share
+    governor.set_running_total(1)
+    assert [governor.rate_of(i) for i in [1, 2]] == [450, 450]
+
+
+def test_read_size():
+    governor = BandwidthGovernor()
+    governor.register(1, max_rate=100 * 1024)
+    governor.register(2)
+
+    # Throttled tasks wait for short periods between reads
+    assert governor.read_size(1, 4 * 1024 * 1024) == 10 * 1024
+    assert governor.read_size(2, 4 * 1024 * 1024) == 4 * 1024 * 1024
@@ -0,0 +1,77 @@
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+
+from ddownloader.cache import TTLCache, normalize_url
+
+
+def test_lru_eviction():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.get('a')
+    cache.put('c', 3)
+
+    assert cache.get('a') == 1
+    assert cache.get('b') is None
+    assert cache.get('c') == 3
+
+
+@patch('ddownloader.cache.time.monotonic')
+def test_entries_expire(mock_monotonic):
+    mock_monotonic.return_value = 100
+    cache = TTLCache(maxsize=2, ttl=10)
+    cache.put('a', 1)
+
+    mock_monotonic.return_value = 109
+    assert cache.get('a') == 1
+
+    mock_monotonic.return_value = 111
+    assert cache.get('a') is None
+
+
+def test_concurrent_loads_are_collapsed():
+    cache = TTLCache(maxsize=10, ttl=60)
+    calls = []
+
+    def loader():
+        calls.append(1)
+        time.sleep(0.2)
+        return 'value'
+
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(cache.get_or_load('k', loader))
+        )
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == ['value'] * 5
+
+
+def test_load_errors_are_not_cached():
+    cache = TTLCache(maxsize=10, ttl=60)
+
+    def failing_loader():
+        raise ValueError('boom')
+
+    with pytest.raises(ValueError):
+        cache.get_or_load('k', failing_loader)
+
+    assert cache.get_or_load('k', lambda: 'value') == 'value'
+
+
+def test_normalize_url():
+    assert normalize_url('HTTP://Example.COM:80/a?x=1#frag') \
+        == 'http://example.com/a?x=1'
+    assert normalize_url('https://example.com:443') == 'https://example.com/'
+    assert normalize_url('https://example.com:8443/A') \
+        == 'https://example.com:8443/A'
@@ -0,0 +1,41 @@
+import json
+import socket
+import time
+from unittest.mock import patch
+
+from ddownloader import control
+from ddownloader.control import ControlCommand, ControlRegistry
+
+
+def test_registry_pop():
+    registry = ControlRegistry()
+    registry.push(1, ControlCommand.PAUSE)
+
+    assert registry.pop(1) == ControlCommand.PAUSE
+    assert registry.pop(1) is None
+
+
+def test_registry_resume_clears_pause():
+    registry = ControlRegistry()
+    registry.push(1, ControlCommand.PAUSE)
+    registry.push(1, ControlCommand.RESUME)
+
+    assert registry.pop(1) is None
+
+
+def test_listener_receives_commands(tmp_path):
+    with patch.dict('os.environ', {'CONTROL_SOCKET_DIR': str(tmp_path)}):
+        control.start_listener()
+
+        # Emulate a command sent by another process
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            message = json.dumps({'dtask_id': 7, 'command': 'pause'})
+            sock.sendto(message.encode(), control._socket_path())
+
+        deadline = time.monotonic() + 1
+        command = None
+        while not command and time.monotonic() < deadline:
+            command = control.registry.pop(7)
+            time.sleep(0.01)
+
+    assert command == ControlCommand.PAUSE
@@ -0,0 +1,153 @@
+import hashlib
+import os
+from unittest.mock import patch
+
+import pytest
+
+import ddownloader.dtask_repository as dtask_repo
+from ddownloader import dedup
+from ddownloader.downloader import DownloadStatus, DownloadTask, UrlMetadata
+
+
+@pytest.fixture
+def test_database():
+    dtask_repo.init()
+    yield
+
+    dtask_repo.close()
+    os.remove(os.getenv('DB_PATH'))
+
+
+def _completed_task(tmp_path, url, content, file_hash=None, content_key=None):
+    target = tmp_path / f'source{len(os.listdir(tmp_path))}'
+    target.write_bytes(content)
+
+    dtask = DownloadTask(url, str(target), file_hash=file_hash)
+    dtask.content_key = content_key
+    dtask.total_size = dtask.downloaded_size = len(content)
+    dtask.status = DownloadStatus.COMPLETED
+    dtask_repo.save(dtask)
+    return dtask
+
+
+def test_content_key():
+    meta = UrlMetadata('http://a.com/f')
+    assert dedup.content_key('http://a.com/f', meta) is None
+
+    meta.content_length = 10
+    assert dedup.content_key('HTTP://A.com/f', meta) == 'http://a.com/f#length:10'
+
+    meta.etag = '"abc"'
+    assert dedup.content_key('http://a.com/f', meta) == 'http://a.com/f#etag:"abc"'
+
+
+def test_completed_match_by_hash(test_database, tmp_path):
+    content = b'same content'
+    file_hash = 'sha1:' + hashlib.sha1(content).hexdigest()
+    source = _completed_task(tmp_path, 'http://mirror1.com/f', content, file_hash)
+
+    # Same file from another mirror, bare hex digest
+    dtask = DownloadTask(
+        'http://mirror2.com/f',
+        str(tmp_path / 'copy'),
+        file_hash=hashlib.sha1(content).hexdigest().upper()
+    )
+
+    assert dedup.resolve(dtask).id == source.id
+    assert dtask.status == DownloadStatus.COMPLETED
+    assert dtask.downloaded_size == len(content)
+    assert (tmp_path / 'copy').read_bytes() == content
+
+
+def test_completed_match_requires_content_key(test_database, tmp_path):
+    key = 'http://a.com/f#etag:"v1"'
+    _completed_task(tmp_path, 'http://a.com/f', b'v1', content_key=key)
+
+    # Without etag or length, content could have changed
+    dtask = DownloadTask('http://a.com/f', str(tmp_path / 'copy'))
+    assert dedup.find_completed(dtask) is None
+
+    dtask.content_key = key
+    assert dedup.find_completed(dtask) is not None
+
+
+def test_attach_to_in_flight(test_database, tmp_path):
+    source = DownloadTask('http://a.com/big', str(tmp_path / 'big'))
+    dtask_repo.save(source)
+
+    follower = DownloadTask('http://A.com:80/big', str(tmp_path / 'big2'))
+    assert dedup.resolve(follower).id == source.id
+    assert follower.attached_to == source.id
+    dtask_repo.save(follower)
+
+    # Attached tasks are not dispatched
+    assert dtask_repo.claim_for_dispatch(10, 10) == [source.id]
+
+    (tmp_path / 'big').write_bytes(b'downloaded')
+    source.status = DownloadStatus.COMPLETED
+    source.total_size = source.downloaded_size = len(b'downloaded')
+    dtask_repo.save(source)
+    dedup.on_finished(source)
+
+    follower = dtask_repo.find_by_id(follower.id)
+    assert follower.status == DownloadStatus.COMPLETED
+    assert follower.attached_to is None
+    assert (tmp_path / 'big2').read_bytes() == b'downloaded'
+
+
+def test_followers_detached_on_failure(test_database, tmp_path):
+    source = DownloadTask('http://a.com/big', str(tmp_path / 'big'))
+    dtask_repo.save(source)
+    follower = DownloadTask('http://a.com/big', str(tmp_path / 'big2'))
+    dedup.resolve(follower)
+    dtask_repo.save(follower)
+
+    source.status = DownloadStatus.FAILED
+    dtask_repo.save(source)
+    dedup.on_finished(source)
+
+    follower = dtask_repo.find_by_id(follower.id)
+    assert follower.status == DownloadStatus.QUEUED
+    assert follower.attached_to is None
+
+
+def test_resolve_many(test_database, tmp_path):
+    content = b'same content'
+    file_hash = 'sha1:' + hashlib.sha1(content).hexdigest()
+    completed = _completed_task(tmp_path, 'http://a.com/f', content, file_hash)
+    in_flight = DownloadTask('http://a.com/big', str(tmp_path / 'big'))
+    dtask_repo.save(in_flight)
+
+    dtasks = [
+        DownloadTask(
+            'http://b.com/f',
+            str(tmp_path / 'copy'),
+            file_hash=file_hash
+        ),
+        DownloadTask('http://A.com/big', str(tmp_path / 'big2')),
+        DownloadTask('http://a.com/other', str(tmp_path / 'other'))
+    ]
+    with patch.object(
+        dtask_repo,
+        'find_by_keys',
+        wraps=dtask_repo.find_by_keys
+    ) as find_by_keys:
+        sources = dedup.resolve_many(dtasks)
+
+    find_by_keys.assert_called_once()
+    assert [s and s.id for s in sources] == [completed.id, in_flight.id, None]
+    assert dtasks[0].status == DownloadStatus.COMPLETED
+    assert dtasks[1].attached_to == in_flight.id
+    assert dtasks[2].attached_to is None
+
+
+def test_link_file(tmp_path):
+    source = tmp_path / 'source'
+    source.write_bytes(b'content')
+
+    dedup.link_file(str(source), str(tmp_path / 'sub' / 'target'))
+    assert (tmp_path / 'sub' / 'target').read_bytes() == b'content'
+
+    # Source downloaded again does not change linked file
+    source.write_bytes(b'truncated')
+    assert (tmp_path / 'sub' / 'target').read_bytes() == b'content'
@@ -1,10 +1,15 @@
-from unittest.mock import patch
+import hashlib
+import io
+import time
+from unittest.mock import Mock, patch
 import pytest
 import requests
 
+from benchmarks.http_stand_in import StandInServer, expected_bytes
 from ddownloader import downloader
-from ddownloader.downloader import UrlMetadata
+from ddownloader.downloader import DownloadStatus, DownloadTask, UrlMetadata
 from ddownloader.errors import MetadataReqError
+from ddownloader.storage import InsufficientSpaceError
 
 # pylint: disable=R0201
 class TestUrlMetadata:
@@ -60,30 +65,372 @@ class TestUrlMetadata:
 # pylint: disable=R0201
 class TestMetadataReq:
 
-    @patch('ddownloader.downloader.requests.head')
-    def test_conn_error(self, mock_head):
-        mock_head.side_effect = requests.exceptions.ConnectionError
+    @patch('ddownloader.downloader.http_session.get_session')
+    def test_conn_error(self, mock_session):
+        mock_session.return_value.head.side_effect = requests.exceptions.ConnectionError
 
         with pytest.raises(MetadataReqError):
             downloader.metadata('testurl.com')
 
-    @patch('ddownloader.downloader.requests.head')
-    def test_timeout_error(self, mock_head):
-        mock_head.side_effect = requests.exceptions.Timeout
+    @patch('ddownloader.downloader.http_session.get_session')
+    def test_timeout_error(self, mock_session):
+        mock_session.return_value.head.side_effect = requests.exceptions.Timeout
 
         with pytest.raises(MetadataReqError):
             downloader.metadata('testurl.com')
 
-    @patch('ddownloader.downloader.requests.head')
-    def test_too_many_redirects_error(self, mock_head):
-        mock_head.side_effect = requests.exceptions.TooManyRedirects
+    @patch('ddownloader.downloader.http_session.get_session')
+    def test_too_many_redirects_error(self, mock_session):
+        mock_session.return_value.head.side_effect = requests.exceptions.TooManyRedirects
 
         with pytest.raises(MetadataReqError):
             downloader.metadata('testurl.com')
 
-    @patch('ddownloader.downloader.requests.head')
-    def test_http_error(self, mock_head):
-        mock_head.side_effect = requests.exceptions.HTTPError
+    @patch('ddownloader.downloader.http_session.get_session')
+    def test_http_error(self, mock_session):
+        mock_session.return_value.head.side_effect = requests.exceptions.HTTPError
 
         with pytest.raises(MetadataReqError):
             downloader.metadata('testurl.com')
+
+
+# pylint: disable=R0201
+class TestMetadataCache:
+
+    def setup_method(self):
+        downloader._metadata_cache = downloader.TTLCache(10, 60)
+
+    @patch('ddownloader.downloader.http_session.get_session')
+    def test_metadata_is_cached(self, mock_session):
+        mock_session.return_value.head.return_value.headers = {
+            'Content-Length': '2048'
+        }
+
+        first = downloader.metadata('http://Cached.com/file.bin')
+        second = downloader.metadata('http://cached.com:80/file.bin#x')
+
+        assert mock_session.return_value.head.call_count == 1
+        assert first.content_length == second.content_length == 2048
+        assert second.url == 'http://cached.com:80/file.bin#x'
+
+    @patch('ddownloader.downloader.http_session.get_session')
+    def test_cached_metadata_does_not_request(self, mock_session):
+        assert downloader.cached_metadata('http://cached.com/f') is None
+        mock_session.return_value.head.assert_not_called()
+
+
+class FakeRaw:
+    """Minimal stand-in of urllib3 response"""
+
+    def __init__(self, body: bytes):
+        self._body = io.BytesIO(body)
+        self._size = len(body)
+
+    @property
+    def closed(self):
+        return self._body.tell() >= self._size
+
+    def read(self, amt, decode_content=True):
+        return self._body.read(amt)
+
+
+class FakeResponse:
+    """Minimal stand-in of a streamed 'requests.Response'"""
+
+    def __init__(self, body: bytes, status_code=200, headers=None):
+        self.body = body
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.headers.setdefault('Content-length', str(len(body)))
+        self.raw = FakeRaw(body)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def raise_for_status(self):
+        pass
+
+    def close(self):
+        pass
+
+
+# pylint: disable=R0201
+class TestSegmentedDownload:
+    body = bytes(range(256)) * 4096  # 1MB
+
+    def _range_response(self, url, start, end, if_range=None):
+        return FakeResponse(self.body[start:end + 1], status_code=206)
+
+    def test_split_ranges(self):
+        segments = downloader._split_ranges(10, 3)
+
+        assert [(s.start, s.end) for s in segments] == [(0, 2), (3, 5), (6, 9)]
+
+    @patch.dict('os.environ', {'DOWNLOAD_SEGMENTS': '4', 'MIN_SEGMENT_SIZE': '1'})
+    @patch('ddownloader.downloader._make_request')
+    @patch('ddownloader.downloader._make_range_request')
+    def test_segmented_download(self, mock_range, mock_request, tmp_path):
+        mock_request.return_value = FakeResponse(
+            self.body,
+            headers={'Accept-Ranges': 'bytes'}
+        )
+        mock_range.side_effect = self._range_response
+        dtask = DownloadTask('http://random.com/f', str(tmp_path / 'f'))
+
+        downloader.download(dtask, lambda: None, lambda: None)
+
+        assert mock_range.call_count == 3
+        assert dtask.status == DownloadStatus.COMPLETED
+        assert dtask.downloaded_size == len(self.body)
+        assert (tmp_path / 'f').read_bytes() == self.body
+
+    @patch.dict('os.environ', {'DOWNLOAD_SEGMENTS': '4', 'MIN_SEGMENT_SIZE': '1'})
+    @patch('ddownloader.downloader._make_request')
+    @patch('ddownloader.downloader._make_range_request')
+    def test_no_ranges_fallback(self, mock_range, mock_request, tmp_path):
+        mock_request.return_value = FakeResponse(self.body)
+        dtask = DownloadTask('http://random.com/f', str(tmp_path / 'f'))
+
+        downloader.download(dtask, lambda: None, lambda: None)
+
+        mock_range.assert_not_called()
+        assert dtask.status == DownloadStatus.COMPLETED
+        assert (tmp_path / 'f').read_bytes() == self.body
+
+    @patch.dict('os.environ', {'DOWNLOAD_SEGMENTS': '4', 'MIN_SEGMENT_SIZE': '1'})
+    @patch('ddownloader.downloader._make_request')
+    @patch('ddownloader.downloader._make_range_request')
+    def test_failed_segment_keeps_prefix(self, mock_range, mock_request, tmp_path):
+        mock_request.return_value = FakeResponse(
+            self.body,
+            headers={'Accept-Ranges': 'bytes'}
+        )
+        mock_range.side_effect = requests.exceptions.ConnectionError
+        dtask = DownloadTask('http://random.com/f', str(tmp_path / 'f'))
+
+        downloader.download(dtask, lambda: None, lambda: None)
+
+        # Only bytes of first segment may have been kept, and they are
+        # resumed by next attempt
+        prefix = (tmp_path / 'f').read_bytes()
+        assert dtask.status == DownloadStatus.QUEUED
+        assert dtask.retry_at
+        assert dtask.downloaded_size == len(prefix)
+        assert len(prefix) <= len(self.body) // 4
+        assert prefix == self.body[:len(prefix)]
+
+
+# pylint: disable=R0201
+class TestRetry:
+    body = bytes(range(256)) * 400
+
+    def _short_response(self):
+        half = self.body[:len(self.body) // 2]
+        return FakeResponse(half, headers={
+            'Content-length': str(len(self.body))
+        })
+
+    @patch('ddownloader.downloader._make_request')
+    def test_resumes_after_short_read(self, mock_request, tmp_path):
+        half = len(self.body) // 2
+        mock_request.side_effect = [
+            self._short_response(),
+            FakeResponse(self.body[half:], status_code=206)
+        ]
+        dtask = DownloadTask('http://random.com/f', str(tmp_path / 'f'))
+
+        downloader.download(dtask, lambda: None, lambda: None)
+
+        assert dtask.status == DownloadStatus.QUEUED
+        assert dtask.retries == 1 and dtask.retry_at
+        assert dtask.downloaded_size == half
+        assert dtask.err_message.startswith('Connection closed after')
+        assert dtask.attempts[0]['downloaded_size'] == half
+
+        downloader.download(dtask, lambda: None, lambda: None)
+
+        assert dtask.status == DownloadStatus.COMPLETED
+        assert dtask.retry_at is None
+        assert (tmp_path / 'f').read_bytes() == self.body
+
+    @patch.dict('os.environ', {'RETRY_MAX_ATTEMPTS': '2'})
+    @patch('ddownloader.downloader._make_request')
+    def test_fails_once_attempts_are_over(self, mock_request, tmp_path):
+        mock_request.side_effect = requests.exceptions.ConnectionError('refused')
+        dtask = DownloadTask('http://random.com/f', str(tmp_path / 'f'))
+
+        downloader.download(dtask, lambda: None, lambda: None)
+        assert dtask.status == DownloadStatus.QUEUED
+
+        dtask.status = DownloadStatus.QUEUED
+        downloader.download(dtask, lambda: None, lambda: None)
+        assert dtask.status == DownloadStatus.FAILED
+        assert dtask.err_message == 'refused'
+        assert len(dtask.attempts) == 2
+
+    @patch('ddownloader.downloader._make_request')
+    def test_client_error_is_not_retried(self, mock_request, tmp_path):
+        res = FakeResponse(b'', status_code=404)
+        error = requests.exceptions.HTTPError(response=res)
+        res.raise_for_status = Mock(side_effect=error)
+        mock_request.return_value = res
+        dtask = DownloadTask('http://random.com/f', str(tmp_path / 'f'))
+
+        downloader.download(dtask, lambda: None, lambda: None)
+
+        assert dtask.status == DownloadStatus.FAILED
+        assert dtask.err_message == 'Server responded with status 404'
+        assert dtask.attempts[0]['retryable'] is False
+
+
+# pylint: disable=R0201
+class TestHashVerification:
+    body = b'verified content' * 1000
+
+    @patch('ddownloader.downloader._make_request')
+    def test_hash_match(self, mock_request, tmp_path):
+        mock_request.return_value = FakeResponse(self.body)
+        dtask = DownloadTask('http://random.com/f', str(tmp_path / 'f'))
+        dtask.file_hash = 'sha1:' + hashlib.sha1(self.body).hexdigest()
+
+        downloader.download(dtask, lambda: None, lambda: None)
+
+        assert dtask.status == DownloadStatus.COMPLETED
+
+    @patch('ddownloader.downloader._make_request')
+    def test_hash_mismatch(self, mock_request, tmp_path):
+        mock_request.return_value = FakeResponse(self.body)
+        dtask = DownloadTask('http://random.com/f', str(tmp_path / 'f'))
+        dtask.file_hash = 'md5:' + hashlib.md5(b'other').hexdigest()
+
+        downloader.download(dtask, lambda: None, lambda: None)
+
+        assert dtask.status == DownloadStatus.FAILED
+        assert 'mismatch' in dtask.err_message
+
+
+# pylint: disable=R0201
+class TestUnknownSize:
+    body = b'chunked content' * 1000
+
+    @patch('ddownloader.downloader._make_request')
+    def test_unknown_size(self, mock_request, tmp_path):
+        # Chunked responses come without 'Content-Length'
+        mock_request.return_value = FakeResponse(
+            self.body,
+            headers={'Content-length': ''}
+        )
+        dtask = DownloadTask('http://random.com/f', str(tmp_path / 'f'))
+
+        downloader.download(dtask, lambda: None, lambda: None)
+
+        assert dtask.status == DownloadStatus.COMPLETED
+        assert dtask.total_size == len(self.body)
+
+
+# pylint: disable=R0201
+class TestTargetPreparation:
+    body = b'0123456789' * 1000
+
+    @patch('ddownloader.downloader.storage.check_free_space')
+    @patch('ddownloader.downloader._make_request')
+    def test_insufficient_space(self, mock_request, mock_check, tmp_path):
+        mock_request.return_value = FakeResponse(self.body)
+        mock_check.side_effect = InsufficientSpaceError('f', 10, 1)
+        dtask = DownloadTask('http://random.com/f', str(tmp_path / 'f'))
+
+        downloader.download(dtask, lambda: None, lambda: None)
+
+        assert dtask.status == DownloadStatus.FAILED
+        assert dtask.err_message.startswith('Not enough free space')
+        assert not (tmp_path / 'f').exists()
+
+    @patch.dict('os.environ', {'PREALLOCATE_FILES': 'true'})
+    @patch('ddownloader.downloader._make_request')
+    def test_resume_preallocated(self, mock_request, tmp_path):
+        target = tmp_path / 'f'
+        target.write_bytes(self.body[:100] + bytes(len(self.body) - 100))
+        mock_request.return_value = FakeResponse(
+            self.body[100:],
+            status_code=206
+        )
+
+        dtask = DownloadTask('http://random.com/f', str(target))
+        dtask.downloaded_size = 100
+        downloader.download(dtask, lambda: None, lambda: None)
+
+        assert dtask.status == DownloadStatus.COMPLETED
+        assert target.read_bytes() == self.body
+
+
+@pytest.fixture
+def server():
+    server = StandInServer().start()
+    yield server
+    server.stop()
+
+# pylint: disable=R0201
+class TestValidatedResume:
+    size = 256 * 1024
+
+    def _partial_download(self, server, tmp_path) -> DownloadTask:
+        dtask = DownloadTask(server.file_url(self.size), str(tmp_path / 'f'))
+        downloader.download(dtask, lambda: None, lambda: None)
+
+        # Mark prefix so it can be told whether it was downloaded again
+        (tmp_path / 'f').write_bytes(b'x' * 1000)
+        dtask.status = DownloadStatus.QUEUED
+        dtask.downloaded_size = 1000
+        return dtask
+
+    def test_resume_unchanged(self, server, tmp_path):
+        dtask = self._partial_download(server, tmp_path)
+        assert dtask.etag and dtask.last_modified
+
+        downloader.download(dtask, lambda: None, lambda: None)
+
+        assert dtask.status == DownloadStatus.COMPLETED
+        assert (tmp_path / 'f').read_bytes() \
+            == b'x' * 1000 + expected_bytes(1000, self.size - 1)
+
+    def test_resume_changed(self, server, tmp_path):
+        dtask = self._partial_download(server, tmp_path)
+        old_etag = dtask.etag
+        server.version += 1
+
+        downloader.download(dtask, lambda: None, lambda: None)
+
+        assert dtask.status == DownloadStatus.COMPLETED
+        assert dtask.total_size == self.size
+        assert dtask.etag != old_etag
+        assert (tmp_path / 'f').read_bytes() == expected_bytes(0, self.size - 1)
+
+    def test_is_fresh(self, server, tmp_path):
+        dtask = DownloadTask(server.file_url(self.size), str(tmp_path / 'f'))
+        assert downloader.is_fresh(dtask) is None
+
+        downloader.download(dtask, lambda: None, lambda: None)
+        assert downloader.is_fresh(dtask) is True
+
+        server.version += 1
+        assert downloader.is_fresh(dtask) is False
+
+
+def test_throttled_download_checks_status_often(server, tmp_path):
+    size = 256 * 1024
+    dtask = DownloadTask(server.file_url(size), str(tmp_path / 'f'))
+    dtask.max_rate = 128 * 1024
+
+    checks = []
+    downloader.download(
+        dtask,
+        lambda: None,
+        lambda: checks.append(time.monotonic())
+    )
+
+    assert dtask.status == DownloadStatus.COMPLETED
+    # Pauses and cancellations are noticed while waiting for bandwidth
+    assert max(b - a for a, b in zip(checks, checks[1:])) < 0.4
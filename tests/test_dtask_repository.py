@@ -1,4 +1,5 @@
 import os
+import time
 import pytest
 import ddownloader.dtask_repository as dtask_repo
 from ddownloader.downloader import (
@@ -13,11 +14,13 @@ def test_database():
     """
     db_path = os.getenv('DB_PATH')
     print('Test database path: {}'.format(db_path))
+    dtask_repo.init()
 
     # Yield to execute tests
     yield
 
     # Teardown after tests execution
+    dtask_repo.close()
     os.remove(db_path)
     
 
@@ -50,6 +53,30 @@ def test_save_insert(test_database):
     assert dtask.id >= 1
 
 
+def test_save_many(test_database):
+    dtasks = [
+        DownloadTask('http://batch.com/{}'.format(idx), 'batch{}'.format(idx))
+        for idx in range(5)
+    ]
+    dtask_repo.save_many(dtasks)
+
+    for dtask in dtasks:
+        db_dtask = dtask_repo.find_by_id(dtask.id)
+        assert db_dtask.url == dtask.url
+        assert db_dtask.target_path == dtask.target_path
+
+
+def test_save_many_with_followers(test_database):
+    source = DownloadTask('http://batch.com/same', 'same0')
+    other = DownloadTask('http://batch.com/other', 'other')
+    follower = DownloadTask('http://batch.com/same', 'same1')
+    dtask_repo.save_many([source, other], [(follower, source)])
+
+    assert follower.id > other.id
+    assert dtask_repo.find_by_id(follower.id).attached_to == source.id
+    assert dtask_repo.find_by_id(other.id).attached_to is None
+
+
 def test_find_by_id(test_database):
     dtask = DownloadTask('fake_saved_url.com', 'fake_saved_destination')
     dtask_repo.save(dtask)
@@ -98,3 +125,141 @@ def test_paginate_get_page_3(test_database):
     assert len(dtasks) == 2
     assert dtasks[0].target_path == 'path5'
     assert dtasks[1].target_path == 'path6'
+
+def test_paginate_after(test_database):
+    with dtask_repo._db_con() as con:
+        con.execute('DELETE FROM download_task')
+
+    ids = []
+    for idx in range(1, 7):
+        dtask = DownloadTask('fake_url.com', 'path{}'.format(idx))
+        dtask_repo.save(dtask)
+        ids.append(dtask.id)
+
+    dtasks = dtask_repo.paginate_after(2, ids[3])
+    assert len(dtasks) == 2
+    assert dtasks[0].target_path == 'path5'
+    assert dtasks[1].target_path == 'path6'
+
+    assert dtask_repo.paginate_after(2, ids[5]) == []
+
+def test_paginate_after_by_status(test_database):
+    with dtask_repo._db_con() as con:
+        con.execute('DELETE FROM download_task')
+
+    for idx in range(1, 7):
+        dtask = DownloadTask('fake_url.com', 'path{}'.format(idx))
+        if idx % 2 == 0:
+            dtask.status = DownloadStatus.COMPLETED
+        dtask_repo.save(dtask)
+
+    dtasks = dtask_repo.paginate_after(10, 0, DownloadStatus.COMPLETED)
+    assert [d.target_path for d in dtasks] == ['path2', 'path4', 'path6']
+
+def test_count(test_database):
+    with dtask_repo._db_con() as con:
+        con.execute('DELETE FROM download_task')
+
+    for idx in range(1, 4):
+        dtask_repo.save(DownloadTask('fake_url.com', 'path{}'.format(idx)))
+
+    assert dtask_repo.count() == 3
+    assert dtask_repo.count(DownloadStatus.QUEUED) == 3
+    assert dtask_repo.count(DownloadStatus.PAUSED) == 0
+
+    dtask = dtask_repo.paginate_after(1)[0]
+    dtask.status = DownloadStatus.PAUSED
+    dtask_repo.save(dtask)
+
+    assert dtask_repo.count() == 3
+    assert dtask_repo.count(DownloadStatus.QUEUED) == 2
+    assert dtask_repo.count(DownloadStatus.PAUSED) == 1
+
+    counts = dtask_repo.count_by_status()
+    assert counts[DownloadStatus.QUEUED] == 2
+    assert counts[DownloadStatus.PAUSED] == 1
+    assert counts[DownloadStatus.COMPLETED] == 0
+
+def test_queued_at(test_database):
+    dtask = DownloadTask('fake_url.com', 'queued_path')
+    dtask_repo.save(dtask)
+    queued_at = dtask_repo.find_by_id(dtask.id).queued_at
+    assert queued_at is not None
+
+    dtask.status = DownloadStatus.PAUSED
+    dtask_repo.save(dtask)
+    assert dtask_repo.find_by_id(dtask.id).queued_at == queued_at
+
+    # Queued again, waiting time starts over
+    dtask.status = DownloadStatus.QUEUED
+    dtask_repo.save(dtask)
+    assert dtask_repo.find_by_id(dtask.id).queued_at >= queued_at
+
+def test_claim_for_dispatch(test_database):
+    with dtask_repo._db_con() as con:
+        con.execute('DELETE FROM download_task')
+
+    urls = [
+        ('http://a.com/1', 0),
+        ('http://a.com/2', 0),
+        ('http://a.com/3', 5),
+        ('http://b.com/1', 0),
+        ('http://c.com/1', 9)
+    ]
+    ids = {}
+    for url, priority in urls:
+        dtask = DownloadTask(url, url, priority=priority)
+        dtask_repo.save(dtask)
+        ids[url] = dtask.id
+
+    # Highest priority first, at most 2 per host, 4 in total
+    claimed = dtask_repo.claim_for_dispatch(4, 2)
+    assert claimed == [
+        ids['http://c.com/1'],
+        ids['http://a.com/3'],
+        ids['http://a.com/1'],
+        ids['http://b.com/1']
+    ]
+
+    # Dispatched tasks are running, no slots left
+    assert dtask_repo.claim_for_dispatch(4, 2) == []
+
+    # A finished download frees its slot, but host a.com is still full
+    dtask = dtask_repo.find_by_id(ids['http://b.com/1'])
+    dtask.status = DownloadStatus.COMPLETED
+    dtask_repo.save(dtask)
+    assert dtask_repo.claim_for_dispatch(4, 2) == []
+    assert dtask_repo.claim_for_dispatch(4, 3) == [ids['http://a.com/2']]
+
+def test_claim_skips_pending_retries(test_database):
+    with dtask_repo._db_con() as con:
+        con.execute('DELETE FROM download_task')
+
+    waiting = DownloadTask('http://a.com/1', 'a1')
+    due = DownloadTask('http://a.com/2', 'a2')
+    dtask_repo.save(waiting)
+    dtask_repo.save(due)
+
+    # Retry fields are written on updates
+    waiting.retry_at = time.time() + 60
+    dtask_repo.save(waiting)
+    due.retries = 1
+    due.retry_at = time.time() - 1
+    due.attempts = [{'error': 'refused'}]
+    dtask_repo.save(due)
+    assert dtask_repo.find_by_id(due.id).attempts == [{'error': 'refused'}]
+
+    assert dtask_repo.claim_for_dispatch(4, 4) == [due.id]
+
+def test_release_dispatch(test_database):
+    with dtask_repo._db_con() as con:
+        con.execute('DELETE FROM download_task')
+
+    dtask = DownloadTask('http://a.com/1', 'a1')
+    dtask_repo.save(dtask)
+    assert dtask_repo.claim_for_dispatch(1, 1) == [dtask.id]
+    assert dtask_repo.claim_for_dispatch(1, 1) == []
+
+    # Slot is given back and task can be claimed again
+    dtask_repo.release_dispatch(dtask.id)
+    assert dtask_repo.claim_for_dispatch(1, 1) == [dtask.id]
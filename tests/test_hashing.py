@@ -0,0 +1,75 @@
+import hashlib
+
+import pytest
+
+from ddownloader import downloader, hashing
+from ddownloader.downloader import DownloadStatus, DownloadTask
+from ddownloader.hashing import InvalidFileHashError, StreamingHasher
+
+
+DATA = b'ddownloader' * 1000
+SHA256 = hashlib.sha256(DATA).hexdigest()
+
+
+def test_parse_file_hash():
+    assert hashing.parse_file_hash(f'sha256:{SHA256}') == ('sha256', SHA256)
+    assert hashing.parse_file_hash(f'SHA256:{SHA256.upper()}') == \
+        ('sha256', SHA256)
+
+    md5 = hashlib.md5(DATA).hexdigest()
+    assert hashing.parse_file_hash(md5) == ('md5', md5)
+
+
+def test_parse_invalid_file_hash():
+    invalid_hashes = [
+        'sha512:abc',
+        f'sha1:{SHA256}',
+        'sha256:' + 'z' * 64,
+        'abc'
+    ]
+
+    for file_hash in invalid_hashes:
+        with pytest.raises(InvalidFileHashError):
+            hashing.parse_file_hash(file_hash)
+
+
+def test_mismatch_message():
+    hasher = StreamingHasher(f'sha256:{SHA256}')
+    hasher.update(DATA)
+    assert hasher.mismatch_message() is None
+
+    hasher.update(b'extra')
+    assert 'mismatch' in hasher.mismatch_message()
+
+
+def test_resume_from_checkpoint(tmp_path):
+    hasher = StreamingHasher(f'sha256:{SHA256}')
+    hasher.update(DATA[:100])
+    hashing.save_checkpoint(1, hasher)
+
+    # Checkpoint is reused, target path is not read
+    resumed = hashing.resume_hasher(1, f'sha256:{SHA256}', '/not/found', 100)
+    assert resumed is hasher
+
+
+def test_resume_from_disk(tmp_path):
+    target = tmp_path / 'f'
+    target.write_bytes(DATA[:100])
+
+    resumed = hashing.resume_hasher(2, f'sha256:{SHA256}', str(target), 100)
+    resumed.update(DATA[100:])
+    assert resumed.mismatch_message() is None
+
+
+def test_failed_download_drops_checkpoint():
+    hasher = StreamingHasher(f'sha256:{SHA256}')
+    hasher.update(DATA[:100])
+    hashing.save_checkpoint(3, hasher)
+
+    dtask = DownloadTask('http://a.com/f', '/not/found', id=3)
+    dtask.status = DownloadStatus.IN_PROGRESS
+    downloader.fail(dtask, ValueError('Invalid content'), 100)
+
+    # Without checkpoint, prefix would be read from disk
+    with pytest.raises(FileNotFoundError):
+        hashing.resume_hasher(3, f'sha256:{SHA256}', '/not/found', 100)
@@ -0,0 +1,15 @@
+from ddownloader.http_session import SessionManager
+
+
+def test_session_is_shared():
+    manager = SessionManager(pool_hosts=2, pool_size=4, max_idle=60)
+
+    assert manager.get() is manager.get()
+    assert manager.get().get_adapter('https://a.com')._pool_maxsize == 4
+
+
+def test_idle_session_is_replaced():
+    manager = SessionManager(pool_hosts=2, pool_size=4, max_idle=0)
+    session = manager.get()
+
+    assert manager.get() is not session
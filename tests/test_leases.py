@@ -0,0 +1,134 @@
+import fcntl
+import os
+
+import pytest
+
+import ddownloader.dtask_repository as dtask_repo
+from ddownloader import leases
+from ddownloader.downloader import DownloadStatus, DownloadTask
+from ddownloader.leases import LeaseKeeper, TargetLocks
+
+
+@pytest.fixture
+def test_database():
+    dtask_repo.init()
+    yield
+
+    dtask_repo.close()
+    os.remove(os.getenv('DB_PATH'))
+
+
+def _running_task() -> DownloadTask:
+    dtask = DownloadTask('http://leased.com/f', 'leased')
+    dtask_repo.save(dtask)
+    dtask.status = DownloadStatus.IN_PROGRESS
+    dtask_repo.save(dtask)
+    return dtask
+
+
+def test_lease_is_exclusive(test_database):
+    dtask = _running_task()
+
+    assert dtask_repo.acquire_lease(dtask.id, 'host:1', 60)
+    assert not dtask_repo.acquire_lease(dtask.id, 'host:2', 60)
+
+    # Expired leases can be taken over
+    assert dtask_repo.acquire_lease(dtask.id, 'host:1', -1)
+    assert dtask_repo.acquire_lease(dtask.id, 'host:2', 60)
+    assert dtask_repo.renew_leases([dtask.id], 'host:1', 60) == [dtask.id]
+
+
+def test_keeper_acquire_and_release(test_database):
+    dtask = _running_task()
+    keeper = LeaseKeeper(ttl=60)
+
+    assert keeper.acquire(dtask.id)
+    assert not keeper.acquire(dtask.id)
+    assert not dtask_repo.acquire_lease(dtask.id, 'otherhost:1', 60)
+
+    keeper.release(dtask.id)
+    assert dtask_repo.acquire_lease(dtask.id, 'otherhost:1', 60)
+
+
+def test_recover_abandoned(test_database, monkeypatch):
+    live = _running_task()
+    expired = _running_task()
+    dead_owner = _running_task()
+    without_lease = _running_task()
+
+    dtask_repo.acquire_lease(live.id, 'otherhost:1', 60)
+    dtask_repo.acquire_lease(expired.id, 'otherhost:1', -1)
+    dtask_repo.acquire_lease(dead_owner.id, 'host:999999', 60)
+
+    monkeypatch.setenv('WORKER_ID', 'host')
+    requeued = leases.recover_abandoned()
+
+    assert sorted(requeued) == sorted([
+        expired.id,
+        dead_owner.id,
+        without_lease.id
+    ])
+    assert dtask_repo.find_by_id(live.id).status == DownloadStatus.IN_PROGRESS
+    for dtask_id in requeued:
+        assert dtask_repo.find_by_id(dtask_id).status == DownloadStatus.QUEUED
+
+
+def test_target_locks(tmp_path):
+    target = str(tmp_path / 'dir' / 'f')
+    locks = TargetLocks()
+
+    assert locks.acquire(1, target)
+    assert not locks.acquire(2, target)
+
+    locks.release(1)
+    assert not os.path.exists(leases.lock_path_of(target))
+    assert locks.acquire(2, target)
+    locks.release(2)
+
+
+def test_target_locked_elsewhere(tmp_path):
+    """Lock held through another descriptor, as another node would"""
+    target = str(tmp_path / 'f')
+    locks = TargetLocks()
+
+    with open(leases.lock_path_of(target), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        assert not locks.acquire(1, target)
+
+    assert locks.acquire(1, target)
+    locks.release(1)
+
+
+def test_recover_claim_without_download(test_database):
+    """Worker died between dispatch claim and download start"""
+    with dtask_repo._db_con() as con:
+        con.execute('DELETE FROM download_task')
+
+    claimed = DownloadTask('http://leased.com/f', 'leased')
+    starting = DownloadTask('http://leased.com/g', 'leased_g')
+    dtask_repo.save_many([claimed, starting])
+    assert dtask_repo.claim_for_dispatch(2, 2) == [claimed.id, starting.id]
+
+    # Recent claims are left, their download message may be pending
+    assert leases.recover_abandoned() == []
+
+    with dtask_repo._db_con() as con:
+        con.execute('UPDATE download_task SET dispatched_at = 0')
+
+    # Download of second task is starting in another worker
+    dtask_repo.acquire_lease(starting.id, 'otherhost:1', 60)
+    assert leases.recover_abandoned() == [claimed.id]
+    assert dtask_repo.claim_for_dispatch(2, 2) == [claimed.id]
+
+
+def test_release_unstarted(test_database):
+    """Download messages lost along with queue storage"""
+    with dtask_repo._db_con() as con:
+        con.execute('DELETE FROM download_task')
+
+    dtask = DownloadTask('http://leased.com/f', 'leased')
+    dtask_repo.save(dtask)
+    assert dtask_repo.claim_for_dispatch(1, 1) == [dtask.id]
+
+    assert leases.release_unstarted() == [dtask.id]
+    assert dtask_repo.claim_for_dispatch(1, 1) == [dtask.id]
@@ -0,0 +1,90 @@
+import json
+import os
+from unittest.mock import patch
+
+from ddownloader import metrics
+from ddownloader.metrics import Counter, Gauge, Histogram, TransferMeter
+
+
+def test_render_counter_and_gauge():
+    counter = Counter('test_total', 'Test counter', labelnames=('kind',))
+    counter.inc(kind='a')
+    counter.inc(2, kind='a')
+    gauge = Gauge('test_gauge', 'Test gauge')
+    gauge.set(1.5)
+
+    text = metrics.render({
+        counter.name: counter.dump(),
+        gauge.name: gauge.dump()
+    })
+
+    assert '# TYPE test_total counter\n' in text
+    assert 'test_total{kind="a"} 3\n' in text
+    assert '# TYPE test_gauge gauge\n' in text
+    assert 'test_gauge 1.5\n' in text
+
+
+def test_render_histogram():
+    histogram = Histogram('test_seconds', 'Test histogram', buckets=(1, 5))
+    for value in (0.5, 2, 10):
+        histogram.observe(value)
+
+    text = metrics.render({histogram.name: histogram.dump()})
+
+    assert 'test_seconds_bucket{le="1"} 1\n' in text
+    assert 'test_seconds_bucket{le="5"} 2\n' in text
+    assert 'test_seconds_bucket{le="+Inf"} 3\n' in text
+    assert 'test_seconds_sum 12.5\n' in text
+    assert 'test_seconds_count 3\n' in text
+
+
+def test_merge_sums_processes():
+    first = Counter('c', 'Counter', labelnames=('k',))
+    first.inc(1, k='x')
+    second = Counter('c', 'Counter', labelnames=('k',))
+    second.inc(2, k='x')
+    second.inc(5, k='y')
+
+    merged = metrics.merge([{'c': first.dump()}, {'c': second.dump()}])
+    assert sorted(merged['c']['values']) == [[['x'], 3], [['y'], 5]]
+
+
+@patch('ddownloader.metrics.time.monotonic')
+def test_transfer_meter(mock_monotonic):
+    mock_monotonic.return_value = 100
+    downloaded = Counter('bytes_total', 'Bytes')
+    task_rate = Gauge('task_rate', 'Rate', labelnames=('dtask_id',))
+    global_rate = Gauge('rate', 'Rate')
+    meter = TransferMeter(downloaded, task_rate, global_rate)
+
+    meter.record(1, 1000)
+    meter.record(2, 3000)
+    mock_monotonic.return_value = 102
+    meter.collect()
+
+    assert sorted(task_rate.dump()['values']) == [[['1'], 500], [['2'], 1500]]
+    assert global_rate.dump()['values'] == [[[], 2000]]
+    assert downloaded.dump()['values'] == [[[], 4000]]
+
+    # Finished tasks drop out of rates
+    mock_monotonic.return_value = 104
+    meter.collect()
+    assert task_rate.dump()['values'] == []
+
+
+def test_collect_all_merges_snapshots(tmp_path):
+    counter = Counter('ddownloader_test_total', 'Test')
+    counter.inc(7)
+    (tmp_path / '999999.json').write_text(
+        json.dumps({counter.name: counter.dump()})
+    )
+    stale = tmp_path / '999998.json'
+    stale.write_text(json.dumps({counter.name: counter.dump()}))
+    os.utime(stale, (0, 0))
+
+    with patch.dict('os.environ', {'METRICS_DIR': str(tmp_path)}):
+        merged = metrics.collect_all()
+
+    assert merged[counter.name]['values'] == [[[], 7]]
+    assert 'ddownloader_db_query_seconds' in merged
+    assert not stale.exists()
@@ -0,0 +1,114 @@
+from unittest.mock import patch
+
+import pytest
+
+from benchmarks.http_stand_in import StandInServer, expected_bytes
+from ddownloader import downloader, mirrors
+from ddownloader.aio_downloader import AioEngine
+from ddownloader.downloader import DownloadStatus, DownloadTask
+from ddownloader.mirrors import Probe, Sources
+
+
+SIZE = 1024 * 1024
+
+
+@pytest.fixture
+def fast():
+    server = StandInServer().start()
+    yield server
+    server.stop()
+
+@pytest.fixture
+def slow():
+    server = StandInServer(bandwidth=128 * 1024).start()
+    yield server
+    server.stop()
+
+
+def _sources(dtask: DownloadTask, *urls: str) -> Sources:
+    """Sources in given order, as if first one was probed fastest"""
+    return Sources(dtask, [
+        Probe(url, SIZE, latency=0, throughput=10 * 1024 * 1024,
+              accepts_ranges=True)
+        for url in urls
+    ])
+
+
+def test_consistent():
+    probe = Probe('http://a/f', content_length=10, etag='"v1"')
+
+    assert mirrors.consistent(probe, 10, '"v1"')
+    assert mirrors.consistent(probe, 10, None)
+    assert mirrors.consistent(probe, 10, 'W/"v2"')
+    assert not mirrors.consistent(probe, 11, '"v1"')
+    assert not mirrors.consistent(probe, 10, '"v2"')
+
+@patch.dict('os.environ', {'MIRROR_PROBE_BYTES': str(64 * 1024)})
+def test_select_fastest(fast, slow, tmp_path):
+    dtask = DownloadTask(slow.file_url(SIZE), str(tmp_path / 'f'))
+    dtask.mirrors = [fast.file_url(SIZE)]
+
+    sources = mirrors.select(dtask)
+
+    assert dtask.source == fast.file_url(SIZE)
+    assert [p.url for p in sources.candidates] \
+        == [fast.file_url(SIZE), slow.file_url(SIZE)]
+
+@patch.dict('os.environ', {'MIRROR_PROBE_BYTES': str(64 * 1024)})
+def test_select_skips_inconsistent(fast, slow, tmp_path):
+    fast.version = 2
+    dtask = DownloadTask(slow.file_url(SIZE), str(tmp_path / 'f'))
+    dtask.mirrors = [fast.file_url(SIZE), fast.file_url(SIZE + 1)]
+
+    sources = mirrors.select(dtask)
+
+    # Mirrors serve another version and another size
+    assert dtask.source == slow.file_url(SIZE)
+    assert len(sources.candidates) == 1
+
+@patch.dict('os.environ', {
+    'DOWNLOAD_SEGMENTS': '1',
+    'MIRROR_CHECK_INTERVAL': '0.2'
+})
+def test_switch_slow_mirror(fast, slow, tmp_path):
+    dtask = DownloadTask(slow.file_url(SIZE), str(tmp_path / 'f'))
+    dtask.mirrors = [fast.file_url(SIZE)]
+    sources = _sources(dtask, slow.file_url(SIZE), fast.file_url(SIZE))
+
+    downloader.download(dtask, lambda: None, lambda: None, sources)
+
+    assert dtask.status == DownloadStatus.COMPLETED
+    assert dtask.source == fast.file_url(SIZE)
+    assert (tmp_path / 'f').read_bytes() == expected_bytes(0, SIZE - 1)
+
+@patch.dict('os.environ', {'DOWNLOAD_SEGMENTS': '1'})
+def test_switch_failed_mirror(fast, tmp_path):
+    gone = StandInServer()
+    gone_url = gone.file_url(SIZE)
+    gone.server_close()
+
+    dtask = DownloadTask(gone_url, str(tmp_path / 'f'))
+    dtask.mirrors = [fast.file_url(SIZE)]
+    sources = _sources(dtask, gone_url, fast.file_url(SIZE))
+
+    downloader.download(dtask, lambda: None, lambda: None, sources)
+
+    assert dtask.status == DownloadStatus.COMPLETED
+    assert (tmp_path / 'f').read_bytes() == expected_bytes(0, SIZE - 1)
+
+@patch.dict('os.environ', {'MIRROR_CHECK_INTERVAL': '0.2'})
+def test_aio_switch_slow_mirror(fast, slow, tmp_path):
+    engine = AioEngine(max_concurrency=2)
+    dtask = DownloadTask(slow.file_url(SIZE), str(tmp_path / 'f'))
+    dtask.mirrors = [fast.file_url(SIZE)]
+    sources = _sources(dtask, slow.file_url(SIZE), fast.file_url(SIZE))
+
+    try:
+        engine.submit(dtask, lambda: None, lambda: None, sources) \
+            .result(timeout=30)
+    finally:
+        engine.close()
+
+    assert dtask.status == DownloadStatus.COMPLETED
+    assert dtask.source == fast.file_url(SIZE)
+    assert (tmp_path / 'f').read_bytes() == expected_bytes(0, SIZE - 1)
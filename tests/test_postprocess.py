@@ -0,0 +1,141 @@
+import io
+import os
+import tarfile
+
+import pytest
+
+import ddownloader.dtask_repository as dtask_repo
+from ddownloader import postprocess
+from ddownloader.downloader import (
+    DownloadStatus,
+    DownloadTask,
+    PostProcessStatus
+)
+from ddownloader.postprocess import PostProcessError
+
+
+@pytest.fixture
+def test_database():
+    dtask_repo.init()
+    yield
+
+    dtask_repo.close()
+    os.remove(os.getenv('DB_PATH'))
+
+@pytest.fixture
+def downloads(tmp_path, monkeypatch):
+    monkeypatch.setenv('DOWNLOADS_PATH', str(tmp_path))
+    return tmp_path
+
+
+def _make_archive(path) -> None:
+    with tarfile.open(path, 'w:gz') as archive:
+        data = b'hello'
+        info = tarfile.TarInfo('docs/readme.txt')
+        info.size = len(data)
+        archive.addfile(info, io.BytesIO(data))
+
+def _completed_task(target_path, specs) -> DownloadTask:
+    dtask = DownloadTask('http://host/file', str(target_path))
+    dtask.status = DownloadStatus.COMPLETED
+    dtask.total_size = os.path.getsize(target_path)
+    dtask.post_process = postprocess.new_pipeline(specs)
+    dtask.post_status = PostProcessStatus.PENDING
+    dtask_repo.save(dtask)
+    return dtask
+
+def _statuses(dtask_id: int) -> list[str]:
+    dtask = dtask_repo.find_by_id(dtask_id)
+    return [step['status'] for step in dtask.post_process]
+
+
+def test_validate_pipeline():
+    postprocess.validate_pipeline([
+        {'stage': 'verify'},
+        {'stage': 'move', 'options': {'to': 'library'}}
+    ])
+
+    with pytest.raises(PostProcessError):
+        postprocess.validate_pipeline([{'stage': 'shred'}])
+    with pytest.raises(PostProcessError):
+        postprocess.validate_pipeline([{'stage': 'move'}])
+    with pytest.raises(PostProcessError):
+        postprocess.validate_pipeline([
+            {'stage': 'move', 'options': {'to': '../outside'}}
+        ])
+
+
+def test_pipeline(test_database, downloads):
+    archive_path = downloads / 'docs.tar.gz'
+    _make_archive(archive_path)
+    dtask = _completed_task(archive_path, [
+        {'stage': 'verify'},
+        {'stage': 'extract'},
+        {'stage': 'move', 'options': {'to': 'library', 'name': 'd.tgz'}}
+    ])
+
+    postprocess.start(dtask).result(timeout=10)
+
+    dtask = dtask_repo.find_by_id(dtask.id)
+    assert dtask.post_status == PostProcessStatus.DONE
+    assert _statuses(dtask.id) == ['Done'] * 3
+    assert dtask.target_path == str(downloads / 'library' / 'd.tgz')
+    assert os.path.exists(dtask.target_path)
+    assert (downloads / 'docs' / 'docs' / 'readme.txt').read_bytes() \
+        == b'hello'
+
+
+def test_failed_stage_stops_pipeline(test_database, downloads):
+    target = downloads / 'f'
+    target.write_bytes(b'content')
+    dtask = _completed_task(target, [
+        {'stage': 'verify', 'options': {'file_hash': 'md5:' + '0' * 32}},
+        {'stage': 'move', 'options': {'to': 'library'}}
+    ])
+
+    postprocess.run(dtask.id)
+
+    dtask = dtask_repo.find_by_id(dtask.id)
+    assert dtask.post_status == PostProcessStatus.FAILED
+    assert _statuses(dtask.id) == ['Failed', 'Pending']
+    assert dtask.post_process[0]['message']
+
+    # Retried pipeline resumes from failed stage
+    dtask.post_process[0]['options'] = {}
+    postprocess.retry(dtask)
+    postprocess.run(dtask.id)
+
+    assert _statuses(dtask.id) == ['Done', 'Done']
+    assert (downloads / 'library' / 'f').read_bytes() == b'content'
+
+
+def test_pluggable_stage(test_database, downloads):
+    seen = []
+    postprocess.register_stage(
+        'record',
+        lambda dtask, options: seen.append(options['tag'])
+    )
+    target = downloads / 'f'
+    target.write_bytes(b'content')
+    dtask = _completed_task(target, [
+        {'stage': 'record', 'options': {'tag': 'a'}}
+    ])
+
+    postprocess.run(dtask.id)
+    assert seen == ['a']
+    assert dtask_repo.find_by_id(dtask.id).post_status \
+        == PostProcessStatus.DONE
+
+
+def test_recover(test_database, downloads, monkeypatch):
+    submitted = []
+    monkeypatch.setattr(postprocess._pool, 'submit', submitted.append)
+
+    target = downloads / 'f'
+    target.write_bytes(b'content')
+    pending = _completed_task(target, [{'stage': 'verify'}])
+    held = _completed_task(target, [{'stage': 'verify'}])
+    dtask_repo.acquire_lease(held.id, 'otherhost:1', 60)
+
+    assert postprocess.recover() == [pending.id]
+    assert submitted == [pending.id]
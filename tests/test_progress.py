@@ -0,0 +1,115 @@
+import threading
+import time
+from unittest.mock import Mock
+
+from ddownloader.downloader import DownloadStatus, DownloadTask
+from ddownloader.progress import ProgressReporter
+
+
+def _reporter(**kwargs) -> ProgressReporter:
+    return ProgressReporter(
+        save_progress=Mock(),
+        save_status=Mock(),
+        **kwargs
+    )
+
+def _running_task(dtask_id: int) -> DownloadTask:
+    dtask = DownloadTask('fake_url.com', 'fake/path', id=dtask_id)
+    dtask.status = DownloadStatus.IN_PROGRESS
+    return dtask
+
+
+def test_status_transition_is_saved_immediately():
+    reporter = _reporter(flush_interval=60, flush_bytes=1024)
+    dtask = _running_task(1)
+
+    reporter.update(dtask)
+    reporter._save_status.assert_called_once_with(dtask)
+
+    dtask.status = DownloadStatus.COMPLETED
+    reporter.update(dtask)
+    assert reporter._save_status.call_count == 2
+
+
+def test_progress_is_coalesced():
+    reporter = _reporter(flush_interval=60, flush_bytes=1024)
+    dtask = _running_task(1)
+    reporter.update(dtask)
+    reporter._save_progress.reset_mock()
+
+    for _ in range(5):
+        dtask.downloaded_size += 100
+        reporter.update(dtask)
+
+    reporter._save_progress.assert_not_called()
+
+    dtask.downloaded_size += 600
+    reporter.update(dtask)
+    reporter._save_progress.assert_called_once_with([dtask])
+
+
+def test_progress_of_many_tasks_flushed_together():
+    reporter = _reporter(flush_interval=60, flush_bytes=1024)
+    dtasks = [_running_task(idx) for idx in range(1, 4)]
+    for dtask in dtasks:
+        reporter.update(dtask)
+
+    for dtask in dtasks:
+        dtask.downloaded_size += 10
+        reporter.update(dtask)
+
+    reporter._save_progress.reset_mock()
+
+    # Status transition of one task flushes pending progress of others
+    dtasks[0].status = DownloadStatus.PAUSED
+    reporter.update(dtasks[0])
+    reporter._save_progress.assert_called_once_with(dtasks[1:])
+
+
+def test_flush_on_interval():
+    reporter = _reporter(flush_interval=0, flush_bytes=1024)
+    dtask = _running_task(1)
+    reporter.update(dtask)
+    reporter._save_progress.reset_mock()
+
+    dtask.downloaded_size += 1
+    reporter.update(dtask)
+    reporter._save_progress.assert_called_once_with([dtask])
+
+
+def test_stalled_progress_is_flushed_by_timer():
+    reporter = _reporter(flush_interval=0.1, flush_bytes=1024)
+    dtask = _running_task(1)
+    reporter.update(dtask)
+    reporter._save_progress.reset_mock()
+
+    # No more chunks are received after this one
+    dtask.downloaded_size += 1
+    reporter.update(dtask)
+    time.sleep(0.5)
+
+    reporter._save_progress.assert_called_once_with([dtask])
+
+
+def test_write_does_not_block_other_updates():
+    reporter = _reporter(flush_interval=60, flush_bytes=1024)
+    slow, other = _running_task(1), _running_task(2)
+    reporter.update(slow)
+    reporter.update(other)
+
+    # Status write waiting for database lock
+    released = threading.Event()
+    reporter._save_status.side_effect = lambda _: released.wait(5)
+    slow.status = DownloadStatus.PAUSED
+    writer = threading.Thread(target=reporter.update, args=(slow,))
+    writer.start()
+
+    try:
+        time.sleep(0.1)
+        started = time.monotonic()
+        other.downloaded_size += 10
+        reporter.update(other)
+        assert time.monotonic() - started < 1
+    finally:
+        released.set()
+        writer.join()
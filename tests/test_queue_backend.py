@@ -0,0 +1,64 @@
+import pytest
+from huey.exceptions import TaskLockedException
+
+from benchmarks.redis_stand_in import RedisStandIn
+from ddownloader import queue_backend
+
+
+@pytest.fixture
+def redis_server():
+    server = RedisStandIn().start()
+    yield server
+    server.stop()
+
+
+def test_sqlite_queue_apart_from_tasks(monkeypatch, tmp_path):
+    monkeypatch.setenv('DB_PATH', str(tmp_path / 'ddownloader.db'))
+    monkeypatch.delenv('QUEUE_DB_PATH', raising=False)
+
+    huey = queue_backend.create_huey('sqlite')
+    assert huey.storage.filename == str(tmp_path / 'ddownloader.queue.db')
+
+
+def test_sqlite_queue_requires_path(monkeypatch):
+    monkeypatch.delenv('DB_PATH', raising=False)
+    monkeypatch.delenv('QUEUE_DB_PATH', raising=False)
+
+    with pytest.raises(ValueError):
+        queue_backend.create_huey('sqlite')
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        queue_backend.create_huey('carrier-pigeon')
+
+
+def test_redis_queue(monkeypatch, redis_server):
+    monkeypatch.setenv('QUEUE_URL', redis_server.url)
+    huey = queue_backend.create_huey('redis')
+
+    @huey.task()
+    def add(a, b):
+        return a + b
+
+    result = add(1, 2)
+    assert huey.pending_count() == 1
+    huey.execute(huey.dequeue())
+    assert result.get() == 3
+
+    # Scheduled tasks are popped through a (stand-in) script
+    add.schedule((2, 3), delay=-1)
+    huey.add_schedule(huey.dequeue())
+    assert huey.scheduled_count() == 1
+    assert len(huey.read_schedule()) == 1
+    assert huey.scheduled_count() == 0
+
+    # Locks are shared by every node using the same server
+    other_node = queue_backend.create_huey('redis')
+    with huey.lock_task('dispatch'):
+        with pytest.raises(TaskLockedException):
+            with other_node.lock_task('dispatch'):
+                pass
+
+    with other_node.lock_task('dispatch'):
+        pass
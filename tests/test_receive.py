@@ -0,0 +1,132 @@
+import socket
+import threading
+
+import pytest
+import requests
+
+from benchmarks.http_stand_in import StandInServer, expected_bytes
+from ddownloader import retry
+from ddownloader.receive import BufferPool, ChunkSizer, iter_body
+
+
+@pytest.fixture
+def server():
+    server = StandInServer().start()
+    yield server
+    server.stop()
+
+
+def test_iter_body_reads_into_buffer(server):
+    size = 3 * 1024 * 1024 + 17
+    pool = BufferPool(buffer_size=256 * 1024, max_buffers=1)
+
+    received = bytearray()
+    with requests.get(server.file_url(size), stream=True) as res, \
+            pool.buffer() as buf:
+        for chunk in iter_body(res, buf):
+            assert chunk.obj is buf.obj
+            received += chunk
+
+    assert bytes(received) == expected_bytes(0, size - 1)
+
+
+def test_pool_reuses_buffers_and_blocks_when_exhausted():
+    pool = BufferPool(buffer_size=16, max_buffers=1)
+
+    with pool.buffer() as buf:
+        first = buf.obj
+
+        acquired = threading.Event()
+
+        def _acquire():
+            with pool.buffer():
+                acquired.set()
+
+        thread = threading.Thread(target=_acquire)
+        thread.start()
+        assert not acquired.wait(0.1)
+
+    thread.join(timeout=1)
+    assert acquired.is_set()
+
+    with pool.buffer() as buf:
+        assert buf.obj is first
+
+
+def test_chunk_sizer_adapts_to_throughput():
+    sizer = ChunkSizer(min_size=64, max_size=256, target_interval=1)
+
+    # Fast reads grow chunks up to max size
+    for _ in range(5):
+        sizer.record(sizer.size, 0.1)
+    assert sizer.size == 256
+
+    # Short reads are ignored
+    sizer.record(10, 10)
+    assert sizer.size == 256
+
+    # Slow reads shrink chunks down to min size
+    for _ in range(5):
+        sizer.record(sizer.size, 5)
+    assert sizer.size == 64
+
+
+def test_iter_body_chunked(server):
+    size = 1024 * 1024 + 5
+    pool = BufferPool(buffer_size=64 * 1024, max_buffers=1)
+
+    received = bytearray()
+    with requests.get(server.file_url(size, chunked=True), stream=True) as res, \
+            pool.buffer() as buf:
+        for chunk in iter_body(res, buf):
+            received += chunk
+
+    assert bytes(received) == expected_bytes(0, size - 1)
+
+
+def test_iter_body_reuses_connections(server):
+    accepted = []
+    get_request = server.get_request
+
+    def _count_connections():
+        accepted.append(get_request())
+        return accepted[-1]
+
+    server.get_request = _count_connections
+    pool = BufferPool(buffer_size=64 * 1024, max_buffers=1)
+
+    with requests.Session() as session, pool.buffer() as buf:
+        for _ in range(5):
+            url = server.file_url(256 * 1024)
+            with session.get(url, stream=True) as res:
+                for _ in iter_body(res, buf):
+                    pass
+
+    assert len(accepted) == 1
+
+
+def test_iter_body_truncated_chunked_is_retryable():
+    listener = socket.create_server(('127.0.0.1', 0))
+
+    def _serve():
+        con, _ = listener.accept()
+        with con:
+            con.recv(4096)
+            con.sendall(
+                b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n'
+                b'400\r\n' + b'x' * 100
+            )
+
+    thread = threading.Thread(target=_serve)
+    thread.start()
+
+    url = f'http://127.0.0.1:{listener.getsockname()[1]}/f'
+    pool = BufferPool(buffer_size=64 * 1024, max_buffers=1)
+    with pytest.raises(Exception) as err:
+        with requests.get(url, stream=True) as res, pool.buffer() as buf:
+            for _ in iter_body(res, buf):
+                pass
+
+    thread.join(timeout=1)
+    listener.close()
+    assert retry.classify(err.value).retryable
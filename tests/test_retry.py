@@ -0,0 +1,52 @@
+from email.utils import formatdate
+import http.client
+import time
+from unittest.mock import patch
+
+import aiohttp
+import requests
+
+from ddownloader import retry
+from ddownloader.errors import ShortReadError
+
+
+def _http_error(status: int, headers: dict = None) -> requests.HTTPError:
+    res = requests.Response()
+    res.status_code = status
+    res.headers.update(headers or {})
+    return requests.HTTPError(response=res)
+
+
+def test_classify_http_status():
+    failure = retry.classify(_http_error(503, {'Retry-After': '7'}))
+    assert failure.retryable
+    assert failure.retry_after == 7
+    assert failure.message == 'Server responded with status 503'
+
+    assert not retry.classify(_http_error(404)).retryable
+
+    with patch.dict('os.environ', {'RETRY_STATUSES': '404'}):
+        assert retry.classify(_http_error(404)).retryable
+
+def test_classify_network_errors():
+    assert retry.classify(requests.ConnectionError()).retryable
+    assert retry.classify(requests.ReadTimeout()).retryable
+    assert retry.classify(aiohttp.ClientPayloadError()).retryable
+    assert retry.classify(ShortReadError(1, 2)).retryable
+    assert retry.classify(http.client.IncompleteRead(b'', 10)).retryable
+
+    failure = retry.classify(ValueError('bad'))
+    assert not failure.retryable
+    assert failure.message == 'bad'
+
+def test_parse_retry_after():
+    assert retry.parse_retry_after(None) is None
+    assert retry.parse_retry_after('soon') is None
+    assert 50 < retry.parse_retry_after(formatdate(time.time() + 60)) <= 60
+
+@patch.dict('os.environ', {'RETRY_BASE_DELAY': '2', 'RETRY_MAX_DELAY': '10'})
+def test_backoff():
+    for _ in range(20):
+        assert 1 <= retry.backoff(1) <= 2
+        assert 4 <= retry.backoff(3) <= 8
+        assert 5 <= retry.backoff(10) <= 10
@@ -0,0 +1,43 @@
+from collections import namedtuple
+from unittest.mock import patch
+
+import pytest
+
+from ddownloader import storage
+from ddownloader.storage import InsufficientSpaceError, TargetFile
+
+
+DiskUsage = namedtuple('DiskUsage', ['total', 'used', 'free'])
+
+
+def test_write_at_offsets(tmp_path):
+    path = str(tmp_path / 'f')
+
+    with TargetFile(path) as target:
+        target.preallocate(10)
+        target.write_at(5, b'world')
+        target.write_at(0, b'hello')
+
+    assert (tmp_path / 'f').read_bytes() == b'helloworld'
+
+
+def test_preallocate_keeps_content(tmp_path):
+    (tmp_path / 'f').write_bytes(b'abc')
+
+    with TargetFile(str(tmp_path / 'f')) as target:
+        target.preallocate(6)
+
+    assert (tmp_path / 'f').read_bytes() == b'abc\x00\x00\x00'
+
+
+@patch('ddownloader.storage.shutil.disk_usage')
+def test_check_free_space(mock_usage, tmp_path):
+    mock_usage.return_value = DiskUsage(100, 90, 10)
+    storage.check_free_space(str(tmp_path / 'f'), 10)
+
+    with pytest.raises(InsufficientSpaceError):
+        storage.check_free_space(str(tmp_path / 'f'), 11)
+
+    # Already allocated bytes are not requested again
+    (tmp_path / 'f').write_bytes(b'x' * 5)
+    storage.check_free_space(str(tmp_path / 'f'), 15)
@@ -0,0 +1,39 @@
+import os
+
+import pytest
+
+import ddownloader.dtask_repository as dtask_repo
+from ddownloader.web.app import app
+
+
+@pytest.fixture
+def test_database():
+    dtask_repo.init()
+    yield
+
+    dtask_repo.close()
+    os.remove(os.getenv('DB_PATH'))
+
+@pytest.fixture
+def client(test_database):
+    return app.test_client()
+
+
+def test_freshness_of_unknown_task(client):
+    res = client.get('/tasks/999999/freshness')
+
+    assert res.status_code == 404
+    assert '999999' in res.json['message']
+
+
+def test_retry_post_process_of_unknown_task(client):
+    res = client.post('/tasks/999999/post_process/retry')
+
+    assert res.status_code == 404
+    assert '999999' in res.json['message']
+
+
+def test_page_size_bounds(client):
+    assert client.get('/tasks?page_size=0').status_code == 400
+    assert client.get('/tasks?page_size=100000000').status_code == 400
+    assert client.get('/tasks?page_size=500').status_code == 200
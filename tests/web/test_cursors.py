@@ -0,0 +1,18 @@
+import pytest
+
+from ddownloader.web.cursors import (
+    InvalidCursorError,
+    decode_cursor,
+    encode_cursor
+)
+
+
+def test_cursor_roundtrip():
+    assert decode_cursor(encode_cursor(1)) == 1
+    assert decode_cursor(encode_cursor(987654321)) == 987654321
+
+
+def test_invalid_cursor():
+    for cursor in ['', '123', 'not base64!', encode_cursor(1)[:-2]]:
+        with pytest.raises(InvalidCursorError):
+            decode_cursor(cursor)
@@ -0,0 +1,80 @@
+from unittest.mock import patch
+
+from ddownloader.downloader import DownloadStatus, DownloadTask
+from ddownloader.web.progress_stream import ProgressHub, Subscription
+
+
+def _dtask(dtask_id, downloaded_size, status=DownloadStatus.IN_PROGRESS):
+    dtask = DownloadTask('fake_url.com', 'fake/path', id=dtask_id)
+    dtask.downloaded_size = downloaded_size
+    dtask.status = status
+    return dtask
+
+
+def test_subscription_coalesces_events():
+    subscription = Subscription([])
+    subscription.publish([{'id': 1, 'downloaded_size': 10}])
+    subscription.publish([{'id': 1, 'downloaded_size': 20}])
+
+    assert subscription.wait(timeout=0) == [{'id': 1, 'downloaded_size': 20}]
+    assert subscription.wait(timeout=0) == []
+
+
+@patch('ddownloader.web.progress_stream.dtask_repo')
+def test_poll_publishes_changes(mock_repo):
+    hub = ProgressHub(poll_interval=60)
+    subscription = Subscription([])
+    hub._subscriptions.add(subscription)
+
+    mock_repo.find_by_statuses.return_value = [_dtask(1, 10), _dtask(2, 0)]
+    mock_repo.find_by_ids.return_value = []
+    assert len(hub.poll()) == 2
+
+    # Only changed tasks are published
+    mock_repo.find_by_statuses.return_value = [_dtask(1, 30), _dtask(2, 0)]
+    events = hub.poll()
+    assert [e['id'] for e in events] == [1]
+    assert events[0]['rate'] > 0
+
+    # Finished tasks get a final event
+    mock_repo.find_by_statuses.return_value = [_dtask(1, 30)]
+    mock_repo.find_by_ids.return_value = [
+        _dtask(2, 50, DownloadStatus.COMPLETED)
+    ]
+    events = hub.poll()
+    assert [(e['id'], e['status']) for e in events] == [(2, 'Completed')]
+
+    latest = {e['id']: e for e in subscription.wait(timeout=0)}
+    assert latest[1]['downloaded_size'] == 30
+    assert latest[2]['status'] == 'Completed'
+
+
+@patch('ddownloader.web.progress_stream.time')
+@patch('ddownloader.web.progress_stream.dtask_repo')
+def test_rate_spans_polls_without_changes(mock_repo, mock_time):
+    """Workers save progress every 2 seconds, hub polls every second"""
+    hub = ProgressHub(poll_interval=1)
+    mock_repo.find_by_ids.return_value = []
+
+    mock_time.monotonic.return_value = 0
+    mock_repo.find_by_statuses.return_value = [_dtask(1, 0)]
+    hub.poll()
+
+    mock_time.monotonic.return_value = 1
+    assert hub.poll() == []
+
+    mock_time.monotonic.return_value = 2
+    mock_repo.find_by_statuses.return_value = [_dtask(1, 2000)]
+    assert hub.poll()[0]['rate'] == 1000
+
+    mock_time.monotonic.return_value = 3
+    assert hub.poll() == []
+
+    mock_time.monotonic.return_value = 4
+    mock_repo.find_by_statuses.return_value = [_dtask(1, 4000)]
+    assert hub.poll()[0]['rate'] == 1000
+
+    # Queued tasks are not polled
+    mock_repo.find_by_statuses.assert_called_with(
+        [DownloadStatus.IN_PROGRESS]
+    )
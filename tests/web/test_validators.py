@@ -1,8 +1,13 @@
 import pytest
 from flask_inputs.validators import ValidationError
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 
-from ddownloader.web.validators import safe_target_path
+from ddownloader.web.validators import (
+    MAX_PAGE_SIZE,
+    safe_target_path,
+    valid_page_size,
+    validate_dtasks_batch
+)
 
 
 def test_safe_target_path_not_string():
@@ -57,3 +62,45 @@ def test_safe_target_path():
 
     mock_field.data['relative_target_path'] = '9/8/7/6/5/4/3/'
     safe_target_path(None, mock_field)
+
+
+def test_validate_dtasks_batch(tmp_path):
+    (tmp_path / 'existing.bin').write_bytes(b'data')
+    schema = {
+        'type': 'object',
+        'required': ['url', 'relative_target_path'],
+        'properties': {'url': {'type': 'string'}}
+    }
+
+    entries = [
+        {'url': 'http://a.com/1', 'relative_target_path': 'new.bin'},
+        {'url': 'http://a.com/2', 'relative_target_path': 'existing.bin'},
+        {'url': 'http://a.com/3', 'relative_target_path': 'new.bin'},
+        {'url': 'http://a.com/4', 'relative_target_path': '../escape.bin'},
+        {'url': 'http://a.com/5'},
+        {'url': 'http://a.com/6', 'relative_target_path': 'sub/new.bin'},
+    ]
+
+    with patch('ddownloader.web.validators.downloads_dir') as mock_dir:
+        mock_dir.return_value = str(tmp_path)
+        errors = validate_dtasks_batch(entries, schema)
+
+    assert errors[0] is None
+    assert 'already exists' in errors[1]
+    assert 'repeated' in errors[2]
+    assert errors[3] is not None
+    assert errors[4] is not None
+    assert errors[5] is None
+
+
+def test_valid_page_size():
+    mock_field = Mock()
+
+    for page_size in ['1', '30', str(MAX_PAGE_SIZE)]:
+        mock_field.data = page_size
+        valid_page_size(None, mock_field)
+
+    for page_size in ['0', str(MAX_PAGE_SIZE + 1), '100000000', '-1', 'a']:
+        mock_field.data = page_size
+        with pytest.raises(ValidationError):
+            valid_page_size(None, mock_field)
@@ -1,6 +1,9 @@
 import { h } from 'preact'
 import { useState, useEffect } from 'preact/hooks'
-import { fetchTasks } from '../../services/ddownloader_service';
+import {
+    fetchTasks,
+    subscribeTasksProgress
+} from '../../services/ddownloader_service';
 import DTask from "../dtask";
 
 const Loading = () => (
@@ -28,6 +31,25 @@ const makeTasksItems = (tasksPage) => {
     )
 }
 
+const applyProgress = (tasksPage, progress) => {
+    if (!tasksPage.dtasks) {
+        return tasksPage
+    }
+
+    return {
+        ...tasksPage,
+        dtasks: tasksPage.dtasks.map((dtask) => dtask.id !== progress.id
+            ? dtask
+            : {
+                ...dtask,
+                downloaded_size: progress.downloaded_size,
+                total_size: progress.total_size,
+                status: progress.status
+            }
+        )
+    }
+}
+
 const DTasksGrid = () => {
     const [loading, setLoading] = useState(false)
     const [tasksPage, setTasksPage] = useState([])
@@ -45,6 +67,10 @@ const DTasksGrid = () => {
             })
     }, [])
 
+    useEffect(() => subscribeTasksProgress((progress) => {
+        setTasksPage(tasksPage => applyProgress(tasksPage, progress))
+    }), [])
+
     if (loading) {
         return <Loading/>
     }
@@ -18,6 +18,22 @@ export async function fetchTasks() {
     return response.json();
 }
 
+/**
+ * Subscribes to progress events of download tasks
+ *
+ * @param {function} onProgress Invoked with every progress event
+ * @returns {function} Call it to close the subscription
+ */
+export function subscribeTasksProgress(onProgress) {
+    const source = new EventSource(`${baseUrl}/tasks/stream`)
+
+    source.addEventListener('progress', (event) => {
+        onProgress(JSON.parse(event.data))
+    })
+
+    return () => source.close()
+}
+
 export async function getUrlMetadata(targetUrl) {
     if (!isValidHttpUrl(targetUrl)) {
         throw new Error(`Invalid http url: ${ targetUrl }`)